@@ -1,7 +1,8 @@
 import os
+import io
 import logging
 
-from flask import Flask
+from flask import Flask, Request
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
@@ -12,6 +13,18 @@ class Base(DeclarativeBase):
     pass
 
 
+# Multipart uploads up to this size are kept in memory rather than spooled to
+# temporary files, so scan images reach the analysis without disk I/O
+UPLOAD_MEMORY_LIMIT = int(os.environ.get("UPLOAD_MEMORY_LIMIT", 16 * 1024 * 1024))
+
+
+class InMemoryUploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is not None and total_content_length <= UPLOAD_MEMORY_LIMIT:
+            return io.BytesIO()
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 
@@ -20,6 +33,7 @@ db = SQLAlchemy(model_class=Base)
 
 # Create the Flask application
 app = Flask(__name__)
+app.request_class = InMemoryUploadRequest
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key")
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)  # needed for url_for to generate with https
 
@@ -0,0 +1,119 @@
+"""
+Benchmark per-pair against batch drug interaction analysis
+
+Checks every pair of the first N medications of a list once with one OpenAI
+request per pair and once with the batch prompt, both bypassing the cache,
+and prints requests, tokens and wall time for each mode. Needs
+OPENAI_API_KEY; the answers are written to DrugInteractionCache as usual.
+
+Usage:
+    python benchmark_drug_interactions.py --sizes 3,5,8
+    python benchmark_drug_interactions.py --sizes 10 warfarin aspirin ibuprofen ...
+"""
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import utils
+from app import app
+from utils import (
+    INTERACTION_CONCURRENCY, INTERACTION_BATCH_SIZE,
+    _fetch_and_cache_interaction, _check_interaction_batch_in_app_context
+)
+
+DEFAULT_MEDICATIONS = [
+    "warfarin", "aspirin", "ibuprofen", "sertraline", "tramadol",
+    "simvastatin", "clarithromycin", "lisinopril", "spironolactone", "metformin",
+]
+
+
+class UsageRecorder:
+    """Wrap the OpenAI completions API to count requests and tokens"""
+
+    def __init__(self, completions):
+        self._completions = completions
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def create(self, **kwargs):
+        response = self._completions.create(**kwargs)
+        usage = getattr(response, "usage", None)
+        with self._lock:
+            self.requests += 1
+            if usage is not None:
+                self.prompt_tokens += usage.prompt_tokens
+                self.completion_tokens += usage.completion_tokens
+        return response
+
+
+def _fetch_pair(pair):
+    with app.app_context():
+        _fetch_and_cache_interaction(*pair)
+
+
+def run_per_pair(pairs):
+    """One request per pair, at the production concurrency"""
+    with ThreadPoolExecutor(max_workers=INTERACTION_CONCURRENCY) as executor:
+        list(executor.map(_fetch_pair, pairs))
+    return 0
+
+
+def run_batch(pairs, chunk_size):
+    """One request per chunk of pairs, then per-pair fallback for any gaps"""
+    chunks = [pairs[i:i + chunk_size] for i in range(0, len(pairs), chunk_size)]
+    with ThreadPoolExecutor(max_workers=INTERACTION_CONCURRENCY) as executor:
+        results = {}
+        for chunk_results in executor.map(_check_interaction_batch_in_app_context, chunks):
+            results.update(chunk_results)
+        fallbacks = [pair for pair in pairs if pair not in results]
+        list(executor.map(_fetch_pair, fallbacks))
+    return len(fallbacks)
+
+
+def benchmark(medications, sizes, chunk_size):
+    """Run both modes for each list size and print a comparison table"""
+    recorder = UsageRecorder(utils.openai.chat.completions)
+    utils.openai.chat.completions = recorder
+    
+    print(f"{'Drugs':>5}{'Pairs':>7}  {'Mode':<9}{'Requests':>9}{'Prompt tok':>12}"
+          f"{'Output tok':>12}{'Seconds':>9}{'Fallbacks':>11}")
+    for size in sizes:
+        drugs = medications[:size]
+        pairs = [(drugs[i], drugs[j]) for i in range(len(drugs)) for j in range(i + 1, len(drugs))]
+        for mode, run in (("per-pair", run_per_pair), ("batch", lambda p: run_batch(p, chunk_size))):
+            recorder.reset()
+            started = time.monotonic()
+            fallbacks = run(pairs)
+            elapsed = time.monotonic() - started
+            print(f"{len(drugs):>5}{len(pairs):>7}  {mode:<9}{recorder.requests:>9}"
+                  f"{recorder.prompt_tokens:>12,}{recorder.completion_tokens:>12,}"
+                  f"{elapsed:>9.1f}{fallbacks:>11}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("medications", nargs="*", default=DEFAULT_MEDICATIONS,
+                        help="Medications to draw the lists from")
+    parser.add_argument("--sizes", default="3,5,8",
+                        help="Comma separated list sizes to benchmark (default: 3,5,8)")
+    parser.add_argument("--chunk-size", type=int, default=INTERACTION_BATCH_SIZE,
+                        help=f"Pairs per batch request (default: {INTERACTION_BATCH_SIZE})")
+    args = parser.parse_args()
+    
+    if not utils.openai:
+        parser.error("OPENAI_API_KEY is not configured")
+    sizes = [int(size) for size in args.sizes.split(",")]
+    if max(sizes) > len(args.medications):
+        parser.error(f"Only {len(args.medications)} medications given for list size {max(sizes)}")
+    
+    benchmark(args.medications, sizes, args.chunk_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Benchmark peak memory of preparing a health scan upload for analysis
+
+Compares the former path (decode the base64 upload, write it to a temporary
+file, read it back and encode it again for the OpenAI request) with the
+in-memory ImagePayload path, using tracemalloc. Neither path calls OpenAI.
+
+Usage: python benchmark_image_pipeline.py [--sizes 256,1024,4096] [--repeat 5]
+"""
+import os
+import time
+import base64
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+
+from utils_image import ImagePayload
+
+
+def make_upload(size_kb):
+    """Return a base64 data URL of about size_kb of incompressible image bytes"""
+    encoded = base64.b64encode(os.urandom(size_kb * 1024)).decode("ascii")
+    return f"data:image/jpeg;base64,{encoded}"
+
+
+def run_temp_file(upload):
+    """The pipeline before ImagePayload, returns the data URL sent to OpenAI"""
+    image_data = upload.split(",", 1)[1]
+    temp_dir = tempfile.mkdtemp()
+    temp_image_path = os.path.join(temp_dir, "scan.jpg")
+    try:
+        with open(temp_image_path, "wb") as f:
+            f.write(base64.b64decode(image_data))
+        with open(temp_image_path, "rb") as image_file:
+            base64_image = base64.b64encode(image_file.read()).decode("utf-8")
+        return f"data:image/jpeg;base64,{base64_image}"
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def run_in_memory(upload):
+    """The ImagePayload pipeline, returns the data URL sent to OpenAI"""
+    return ImagePayload.from_base64(upload).data_url
+
+
+def measure(fn, upload, repeat):
+    """Return (peak bytes allocated, mean milliseconds) for fn(upload)"""
+    peak = 0
+    started = time.perf_counter()
+    for _ in range(repeat):
+        tracemalloc.start()
+        fn(upload)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return peak, (time.perf_counter() - started) * 1000 / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="256,1024,4096", help="Comma separated image sizes in KB")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'Image':>10}{'Temp file peak':>18}{'In-memory peak':>18}{'Temp file ms':>15}{'In-memory ms':>15}")
+    for size_kb in [int(size) for size in args.sizes.split(",")]:
+        upload = make_upload(size_kb)
+        temp_peak, temp_ms = measure(run_temp_file, upload, args.repeat)
+        memory_peak, memory_ms = measure(run_in_memory, upload, args.repeat)
+        print(
+            f"{size_kb:>8}KB{temp_peak / 1024:>16,.0f}KB{memory_peak / 1024:>16,.0f}KB"
+            f"{temp_ms:>15.2f}{memory_ms:>15.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
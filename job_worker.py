@@ -0,0 +1,32 @@
+"""
+Standalone worker for background analysis jobs
+
+Runs the AnalysisJob rows queued by the web processes, e.g. health scans
+submitted with "Prefer: respond-async". Start the web processes with
+JOB_WORKERS=0 to run every job here instead of in gunicorn workers.
+
+Usage: python job_worker.py [threads]
+"""
+import sys
+import time
+import logging
+
+from app import app
+from utils_jobs import job_queue, JOB_WORKERS
+
+logging.basicConfig(level=logging.INFO)
+
+
+def main(threads):
+    job_queue.workers = threads
+    job_queue.start_workers()
+    print(f"Running analysis jobs with {threads} threads, press Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        print("Stopped.")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else max(JOB_WORKERS, 1))
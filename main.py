@@ -9,6 +9,17 @@ load_dotenv()
 # Setup OpenAI API key
 openai.api_key = os.environ.get("OPENAI_API_KEY")
 
+# Web processes warm the in-memory indexes and run queued analysis jobs,
+# unless JOB_WORKERS is 0. Scripts importing app don't, and neither does the
+# debug reloader's watcher process
+if __name__ != "__main__" or os.environ.get("WERKZEUG_RUN_MAIN"):
+    from utils_jobs import job_queue
+    job_queue.start_workers()
+    
+    # Build the medicine autocomplete index before the first lookup needs it
+    from utils_suggest import medicine_suggest_index
+    medicine_suggest_index.refresh()
+
 if __name__ == "__main__":
     if not openai.api_key:
         print("WARNING: OpenAI API key not found. AI health analysis features will not work properly.")
@@ -10,6 +10,7 @@ from sqlalchemy.dialects.postgresql import JSON
 from sqlalchemy.sql import text
 
 from app import app, db
+from models import DrugInteractionCheck
 
 
 def migrate_database():
@@ -82,6 +83,17 @@ def migrate_database():
     else:
         print("drug_interaction_check table already exists.")
     
+    # The batch API counts a user's recent checks against an hourly limit
+    index_names = [index['name'] for index in sa.inspect(db.engine).get_indexes('drug_interaction_check')]
+    if 'ix_drug_interaction_check_user_date' not in index_names:
+        print("Creating ix_drug_interaction_check_user_date index...")
+        for index in DrugInteractionCheck.__table__.indexes:
+            if index.name == 'ix_drug_interaction_check_user_date':
+                index.create(db.engine)
+        print("Index created successfully.")
+    else:
+        print("ix_drug_interaction_check_user_date index already exists.")
+    
     # Close connection
     conn.close()
     print("Migration completed successfully.")
@@ -0,0 +1,98 @@
+"""
+Migration script to create the drug_product table, load brand and combination
+products with their active ingredients, and re-key existing
+DrugInteractionCache rows to ingredient-level pair keys
+
+The product file is CSV with "product" and "ingredients" columns, ingredients
+separated by semicolons, or JSON of the form {product: [ingredients]}.
+
+Usage: python migrate_drug_products.py [product_file]
+"""
+import os
+import csv
+import sys
+import json
+
+from app import app, db
+from models import DrugProduct, DrugInteractionCache
+from utils_drugs import canonicalize_medicine_name, interaction_ingredient_pairs, invalidate_product_map
+
+DEFAULT_PRODUCT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "drug_products.csv")
+
+
+def read_products(path):
+    """Read {product: [ingredients]} from a CSV or JSON file"""
+    if path.endswith(".json"):
+        with open(path) as f:
+            return json.load(f)
+    
+    products = {}
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            ingredients = [ingredient for ingredient in row["ingredients"].split(";") if ingredient.strip()]
+            products[row["product"]] = ingredients
+    return products
+
+
+def load_products(path):
+    """Load a product file into DrugProduct"""
+    loaded = 0
+    for product, ingredients in read_products(path).items():
+        name = canonicalize_medicine_name(product)
+        ingredients = sorted({canonicalize_medicine_name(ingredient) for ingredient in ingredients})
+        if not name or not ingredients:
+            continue
+        DrugProduct.set_ingredients(name, ingredients)
+        loaded += 1
+    db.session.commit()
+    
+    invalidate_product_map()
+    print(f"Loaded {loaded} drug products from {path}")
+
+
+def rekey_interaction_cache():
+    """
+    Rename cache rows to their ingredient pair key, keeping the newest row
+    per key. Rows for combination products are removed, their ingredient
+    pairs are cached separately from now on.
+    """
+    groups = {}
+    removed = 0
+    for entry in db.session.query(DrugInteractionCache).all():
+        drug1, _, drug2 = entry.drug_pair.partition(":")
+        ingredient_pairs, shared = interaction_ingredient_pairs(drug1, drug2)
+        if len(ingredient_pairs) != 1 or shared:
+            db.session.delete(entry)
+            removed += 1
+            continue
+        groups.setdefault(DrugInteractionCache.make_pair_key(*ingredient_pairs[0]), []).append(entry)
+    
+    renamed = 0
+    for drug_pair, entries in groups.items():
+        entries.sort(key=lambda entry: entry.last_updated, reverse=True)
+        keep = entries[0]
+        for duplicate in entries[1:]:
+            db.session.delete(duplicate)
+            removed += 1
+        # Delete duplicates before renaming so the unique constraint holds
+        db.session.flush()
+        
+        if keep.drug_pair != drug_pair:
+            keep.drug_pair = drug_pair
+            renamed += 1
+    
+    db.session.commit()
+    print(f"Re-keyed drug interaction cache: {renamed} rows renamed, {removed} rows removed, {len(groups)} entries remain")
+
+
+def migrate_database(product_file=DEFAULT_PRODUCT_FILE):
+    """Create the product table, load products and re-key the interaction cache"""
+    db.create_all()
+    load_products(product_file)
+    rekey_interaction_cache()
+    print("Migration completed successfully.")
+
+
+if __name__ == "__main__":
+    with app.app_context():
+        migrate_database(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_PRODUCT_FILE)
@@ -0,0 +1,67 @@
+"""
+Migration script to create the medicine_alias table, load the seed aliases and
+re-key existing MedicineCache rows to their canonical medicine names
+"""
+import os
+import sys
+import json
+
+from app import app, db
+from models import MedicineCache, MedicineAlias
+from utils_drugs import canonicalize_medicine_name, resolve_medicine_name, invalidate_alias_map
+
+DEFAULT_ALIAS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "medicine_aliases.json")
+
+
+def load_aliases(path):
+    """Load {canonical_name: [aliases]} from a JSON file into MedicineAlias"""
+    with open(path) as f:
+        alias_data = json.load(f)
+    
+    loaded = 0
+    for canonical_name, aliases in alias_data.items():
+        canonical_name = canonicalize_medicine_name(canonical_name)
+        for alias in aliases:
+            if MedicineAlias.add_alias(canonicalize_medicine_name(alias), canonical_name):
+                loaded += 1
+    
+    invalidate_alias_map()
+    print(f"Loaded {loaded} aliases from {path}")
+
+
+def rekey_medicine_cache():
+    """Rename cache rows to canonical names, keeping the newest row per medicine"""
+    groups = {}
+    for entry in db.session.query(MedicineCache).all():
+        groups.setdefault(resolve_medicine_name(entry.medicine_name), []).append(entry)
+    
+    renamed = 0
+    removed = 0
+    for canonical_name, entries in groups.items():
+        entries.sort(key=lambda entry: entry.last_updated, reverse=True)
+        keep = entries[0]
+        for duplicate in entries[1:]:
+            db.session.delete(duplicate)
+            removed += 1
+        # Delete duplicates before renaming so the unique constraint holds
+        db.session.flush()
+        
+        if keep.medicine_name != canonical_name:
+            keep.medicine_name = canonical_name
+            renamed += 1
+    
+    db.session.commit()
+    print(f"Re-keyed medicine cache: {renamed} rows renamed, {removed} duplicate rows removed, {len(groups)} entries remain")
+
+
+def migrate_database(alias_file=DEFAULT_ALIAS_FILE):
+    """Create the alias table, load aliases and re-key the medicine cache"""
+    db.create_all()
+    load_aliases(alias_file)
+    rekey_medicine_cache()
+    print("Migration completed successfully.")
+
+
+if __name__ == "__main__":
+    with app.app_context():
+        migrate_database(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_ALIAS_FILE)
@@ -0,0 +1,66 @@
+"""
+Migration script to add the is_negative flag to the medicine and drug
+interaction caches and set it for existing "not found" and "unknown" answers,
+which from now on expire after a day
+"""
+import sqlalchemy as sa
+from sqlalchemy.sql import text
+
+from app import app, db
+from models import MedicineCache, DrugInteractionCache
+
+# (model, payload attribute) pairs with an is_negative flag
+NEGATIVE_CACHE_MODELS = [
+    (MedicineCache, "data"),
+    (DrugInteractionCache, "interaction_data"),
+]
+
+BATCH_SIZE = 500
+
+
+def add_negative_column(table):
+    """Add the is_negative column to a table if it is missing"""
+    columns = [column['name'] for column in sa.inspect(db.engine).get_columns(table)]
+    if 'is_negative' in columns:
+        print(f"{table}.is_negative already exists.")
+        return
+    
+    print(f"Adding is_negative column to {table}...")
+    with db.engine.begin() as conn:
+        conn.execute(text(f'ALTER TABLE "{table}" ADD COLUMN is_negative BOOLEAN NOT NULL DEFAULT FALSE'))
+    print(f"{table}.is_negative added successfully.")
+
+
+def flag_negative_entries(model, payload_attribute):
+    """Set is_negative from the cached payloads, returns the number of negative rows"""
+    negative = 0
+    last_id = 0
+    while True:
+        entries = db.session.query(model).filter(model.id > last_id).order_by(model.id).limit(BATCH_SIZE).all()
+        if not entries:
+            break
+        for entry in entries:
+            last_id = entry.id
+            entry.is_negative = model.is_negative_payload(getattr(entry, payload_attribute))
+            negative += entry.is_negative
+        db.session.commit()
+    return negative
+
+
+def migrate_database():
+    """Add the columns and flag existing negative entries"""
+    existing_tables = sa.inspect(db.engine).get_table_names()
+    for model, payload_attribute in NEGATIVE_CACHE_MODELS:
+        table = model.__tablename__
+        if table not in existing_tables:
+            print(f"{table} table does not exist, skipping.")
+            continue
+        add_negative_column(table)
+        negative = flag_negative_entries(model, payload_attribute)
+        print(f"Flagged {negative} negative entries in {table}.")
+    print("Migration completed successfully.")
+
+
+if __name__ == "__main__":
+    with app.app_context():
+        migrate_database()
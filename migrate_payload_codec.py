@@ -0,0 +1,119 @@
+"""
+Migration script to rewrite cached AI payload columns in compact form
+
+On PostgreSQL the columns are converted to JSONB. On other databases the rows
+are re-encoded in batches with the configured payload codec. Prints the bytes
+saved per table.
+
+Usage: python migrate_payload_codec.py [batch_size]
+"""
+import sys
+
+from sqlalchemy.sql import text
+
+from app import app, db
+from utils_payload import decode_payload, encode_payload, PAYLOAD_CODEC
+
+# (table, payload column) pairs stored with PayloadType
+PAYLOAD_COLUMNS = [
+    ("medicine_cache", "data"),
+    ("drug_interaction_cache", "interaction_data"),
+    ("food_scan", "data"),
+    ("bmi_record", "diet_plan"),
+]
+
+DEFAULT_BATCH_SIZE = 500
+
+
+def _stored_size(value):
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    return len(value)
+
+
+def _postgres_column_bytes(conn, table, column):
+    return conn.execute(text(
+        f'SELECT COALESCE(SUM(pg_column_size("{column}")), 0) FROM "{table}"'
+    )).scalar()
+
+
+def migrate_postgres_column(conn, table, column):
+    """Convert a TEXT payload column to JSONB, returns (bytes before, bytes after)"""
+    data_type = conn.execute(text(
+        "SELECT data_type FROM information_schema.columns "
+        "WHERE table_name = :table AND column_name = :column"
+    ), {"table": table, "column": column}).scalar()
+
+    before = _postgres_column_bytes(conn, table, column)
+    if data_type != "jsonb":
+        conn.execute(text(
+            f'ALTER TABLE "{table}" ALTER COLUMN "{column}" TYPE JSONB USING "{column}"::jsonb'
+        ))
+        conn.commit()
+    after = _postgres_column_bytes(conn, table, column)
+    return before, after
+
+
+def migrate_column_in_batches(conn, table, column, batch_size):
+    """Re-encode every row of a payload column, returns (bytes before, bytes after)"""
+    before = 0
+    after = 0
+    last_id = 0
+
+    while True:
+        rows = conn.execute(text(
+            f'SELECT id, "{column}" FROM "{table}" WHERE id > :last_id ORDER BY id LIMIT :limit'
+        ), {"last_id": last_id, "limit": batch_size}).fetchall()
+        if not rows:
+            break
+
+        updates = []
+        for row_id, raw in rows:
+            last_id = row_id
+            if raw is None:
+                continue
+            encoded = encode_payload(decode_payload(raw))
+            before += _stored_size(raw)
+            after += len(encoded)
+            if encoded != raw:
+                updates.append({"id": row_id, "value": encoded})
+
+        if updates:
+            conn.execute(text(f'UPDATE "{table}" SET "{column}" = :value WHERE id = :id'), updates)
+        conn.commit()
+        print(f"  {table}: re-encoded rows up to id {last_id}")
+
+    return before, after
+
+
+def migrate_database(batch_size=DEFAULT_BATCH_SIZE):
+    """Rewrite all payload columns and report the bytes saved per table"""
+    is_postgres = db.engine.dialect.name == "postgresql"
+    existing_tables = db.inspect(db.engine).get_table_names()
+    print(f"Rewriting payloads as {'JSONB' if is_postgres else PAYLOAD_CODEC}...")
+
+    report = []
+    with db.engine.connect() as conn:
+        for table, column in PAYLOAD_COLUMNS:
+            if table not in existing_tables:
+                print(f"{table} table does not exist, skipping.")
+                continue
+            if is_postgres:
+                before, after = migrate_postgres_column(conn, table, column)
+            else:
+                before, after = migrate_column_in_batches(conn, table, column, batch_size)
+            report.append((table, before, after))
+
+    print(f"{'Table':<25}{'Before':>14}{'After':>14}{'Saved':>14}")
+    for table, before, after in report:
+        saved = before - after
+        percent = f" ({saved / before:.0%})" if before else ""
+        print(f"{table:<25}{before:>14,}{after:>14,}{saved:>14,}{percent}")
+    print("Migration completed successfully.")
+
+
+if __name__ == "__main__":
+    with app.app_context():
+        migrate_database(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_BATCH_SIZE)
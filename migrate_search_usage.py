@@ -0,0 +1,52 @@
+"""
+Migration script to add the search_usage counter table and the composite
+(user_id, timestamp) index on search_history, then backfill the counters for
+the current day and month from search_history
+
+Run it while the application is stopped so no searches are counted twice.
+"""
+from datetime import datetime
+
+import sqlalchemy as sa
+
+from app import app, db
+from models import SearchHistory, SearchUsage
+
+
+def migrate_database():
+    """Create the counter table and index and backfill current counters"""
+    inspector = sa.inspect(db.engine)
+    
+    if 'search_usage' not in inspector.get_table_names():
+        print("Creating search_usage table...")
+        SearchUsage.__table__.create(db.engine)
+        print("search_usage table created successfully.")
+    else:
+        print("search_usage table already exists.")
+    
+    index_names = [index['name'] for index in inspector.get_indexes('search_history')]
+    if 'ix_search_history_user_timestamp' not in index_names:
+        print("Creating ix_search_history_user_timestamp index...")
+        for index in SearchHistory.__table__.indexes:
+            if index.name == 'ix_search_history_user_timestamp':
+                index.create(db.engine)
+        print("Index created successfully.")
+    else:
+        print("ix_search_history_user_timestamp index already exists.")
+    
+    # Only the current periods matter for quota checks
+    month_start = SearchUsage.start_of_period('month', datetime.utcnow())
+    db.session.query(SearchUsage).filter(SearchUsage.period_start >= month_start).delete()
+    
+    searches = db.session.query(SearchHistory.user_id, SearchHistory.timestamp).filter(
+        SearchHistory.timestamp >= datetime.combine(month_start, datetime.min.time())
+    ).all()
+    SearchUsage.increment(searches)
+    db.session.commit()
+    print(f"Backfilled search counters from {len(searches)} searches this month.")
+    print("Migration completed successfully.")
+
+
+if __name__ == "__main__":
+    with app.app_context():
+        migrate_database()
@@ -2,8 +2,12 @@ from app import db, login_manager
 from flask_login import UserMixin
 from datetime import datetime, timedelta
 from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy.exc import IntegrityError
 import json
 import sqlalchemy.sql.functions as db_func
+from utils_cache import medicine_memory_cache
+from utils_payload import PayloadType
+from utils_interaction_graph import drug_interaction_graph
 
 
 @login_manager.user_loader
@@ -58,22 +62,18 @@ class User(UserMixin, db.Model):
         return self.subscription.plan_search_limit
     
     def get_remaining_searches(self):
-        if not self.subscription:
-            # For free tier, calculate remaining daily searches
-            today = datetime.utcnow().date()
-            searches_today = db.session.query(SearchHistory).filter(
-                SearchHistory.user_id == self.id,
-                db.func.date(SearchHistory.timestamp) == today
-            ).count()
-            return max(0, self.get_search_limit() - searches_today)
+        # Searches recorded in this worker but not yet flushed to the database
+        from utils_writebehind import search_history_buffer
+        
+        # Free tier has a daily limit, paid subscriptions a monthly one
+        period = 'month' if self.subscription else 'day'
+        period_start = SearchUsage.start_of_period(period, datetime.utcnow())
         
-        # For paid subscriptions, calculate remaining monthly searches
-        this_month = datetime.utcnow().replace(day=1)
-        searches_this_month = db.session.query(SearchHistory).filter(
-            SearchHistory.user_id == self.id,
-            SearchHistory.timestamp >= this_month
-        ).count()
-        return max(0, self.get_search_limit() - searches_this_month)
+        searches = SearchUsage.get_count(self.id, period, period_start)
+        searches += search_history_buffer.pending_count(
+            self.id, datetime.combine(period_start, datetime.min.time())
+        )
+        return max(0, self.get_search_limit() - searches)
         
     def get_display_name(self):
         """Get user's display name, preferring full name if available"""
@@ -125,34 +125,230 @@ class SearchHistory(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     query = db.Column(db.String(200), nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (db.Index('ix_search_history_user_timestamp', 'user_id', 'timestamp'),)
+
+
+class SearchUsage(db.Model):
+    """Per-user search counters for each day and month, used for quota checks"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    period = db.Column(db.String(10), nullable=False)  # day, month
+    period_start = db.Column(db.Date, nullable=False)
+    search_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    # One counter per user and period, this also serves the quota lookup
+    __table_args__ = (db.UniqueConstraint('user_id', 'period', 'period_start', name='unique_search_usage'),)
+    
+    PERIODS = ('day', 'month')
+    
+    @staticmethod
+    def start_of_period(period, timestamp):
+        """First day of the day or month period containing timestamp"""
+        if period == 'month':
+            return timestamp.date().replace(day=1)
+        return timestamp.date()
+    
+    @staticmethod
+    def get_count(user_id, period, period_start):
+        """Number of searches a user made in a period"""
+        count = db.session.query(SearchUsage.search_count).filter_by(
+            user_id=user_id,
+            period=period,
+            period_start=period_start
+        ).scalar()
+        return count or 0
+    
+    @staticmethod
+    def increment(search_timestamps):
+        """
+        Add searches to the day and month counters of their users
+        
+        Takes (user_id, timestamp) pairs and upserts the counters in the
+        current transaction without committing, so they can be written
+        atomically with the SearchHistory rows.
+        """
+        counts = {}
+        for user_id, timestamp in search_timestamps:
+            for period in SearchUsage.PERIODS:
+                key = (user_id, period, SearchUsage.start_of_period(period, timestamp))
+                counts[key] = counts.get(key, 0) + 1
+        if not counts:
+            return
+        
+        if db.engine.dialect.name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        
+        stmt = insert(SearchUsage).values([
+            {'user_id': user_id, 'period': period, 'period_start': period_start, 'search_count': count}
+            for (user_id, period, period_start), count in counts.items()
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id', 'period', 'period_start'],
+            set_={'search_count': SearchUsage.search_count + stmt.excluded.search_count}
+        )
+        db.session.execute(stmt)
 
 
 class MedicineCache(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     medicine_name = db.Column(db.String(200), unique=True, nullable=False, index=True)
-    data = db.Column(db.Text, nullable=False)  # JSON data containing medicine information
+    data = db.Column(PayloadType, nullable=False)  # Medicine information payload
+    is_negative = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())  # medicine not found
     last_updated = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Entries are fresh for a week, after that they are still served while
+    # a background refresh runs, until they are too old to use at all
+    SOFT_TTL = timedelta(days=7)
+    HARD_TTL = timedelta(days=30)
+    # "Not found" answers are only kept for a day and never served stale
+    NEGATIVE_TTL = timedelta(days=1)
+    
     @staticmethod
-    def get_cached_data(medicine_name):
+    def is_negative_payload(data):
+        """Whether medicine info says the medicine was not recognised"""
+        return isinstance(data, dict) and data.get("found") is False
+    
+    @staticmethod
+    def get_cached_entry(medicine_name):
+        """
+        Get cached data and whether it is stale
+        
+        Returns (data, is_stale) with data already decoded. data is None if
+        there is no entry or it is older than HARD_TTL (NEGATIVE_TTL for a
+        not found answer); is_stale is True if it is older than SOFT_TTL.
+        """
         cache_entry = db.session.query(MedicineCache).filter_by(medicine_name=medicine_name).first()
         if cache_entry:
-            # Check if cache is older than a week
             cache_age = datetime.utcnow() - cache_entry.last_updated
-            if cache_age.days < 7:  # Cache valid for a week
-                return cache_entry.data
-        return None
+            if cache_entry.is_negative:
+                if cache_age < MedicineCache.NEGATIVE_TTL:
+                    return cache_entry.data, False
+            elif cache_age < MedicineCache.HARD_TTL:
+                return cache_entry.data, cache_age >= MedicineCache.SOFT_TTL
+        return None, False
+    
+    @staticmethod
+    def get_cached_data(medicine_name):
+        """Get cached data only if it is still fresh"""
+        data, is_stale = MedicineCache.get_cached_entry(medicine_name)
+        return None if is_stale else data
     
     @staticmethod
     def update_cache(medicine_name, data):
+        is_negative = MedicineCache.is_negative_payload(data)
         cache_entry = db.session.query(MedicineCache).filter_by(medicine_name=medicine_name).first()
         if cache_entry:
             cache_entry.data = data
+            cache_entry.is_negative = is_negative
             cache_entry.last_updated = datetime.utcnow()
         else:
-            cache_entry = MedicineCache(medicine_name=medicine_name, data=data)
+            cache_entry = MedicineCache(medicine_name=medicine_name, data=data, is_negative=is_negative)
             db.session.add(cache_entry)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another worker inserted the same medicine first, update its row instead
+            db.session.rollback()
+            cache_entry = db.session.query(MedicineCache).filter_by(medicine_name=medicine_name).first()
+            cache_entry.data = data
+            cache_entry.is_negative = is_negative
+            cache_entry.last_updated = datetime.utcnow()
+            db.session.commit()
+        
+        # Drop the in-process copy so the next lookup sees the new data
+        medicine_memory_cache.invalidate(medicine_name)
+
+
+class MedicineAlias(db.Model):
+    """Maps brand names and common misspellings to a canonical medicine name"""
+    id = db.Column(db.Integer, primary_key=True)
+    alias = db.Column(db.String(200), unique=True, nullable=False, index=True)  # canonicalized alias
+    canonical_name = db.Column(db.String(200), nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    @staticmethod
+    def add_alias(alias, canonical_name):
+        """Create or repoint an alias, both names must already be canonicalized"""
+        if alias == canonical_name:
+            return None
+        entry = db.session.query(MedicineAlias).filter_by(alias=alias).first()
+        if entry:
+            entry.canonical_name = canonical_name
+        else:
+            entry = MedicineAlias(alias=alias, canonical_name=canonical_name)
+            db.session.add(entry)
+        db.session.commit()
+        return entry
+
+
+class DrugProduct(db.Model):
+    """Maps a drug product or brand name to its active ingredients"""
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200), unique=True, nullable=False, index=True)  # canonicalized product name
+    ingredients = db.Column(db.Text, nullable=False)  # JSON list of canonicalized ingredient names
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    @staticmethod
+    def set_ingredients(name, ingredients):
+        """Create or update a product, names must already be canonicalized; the caller commits"""
+        entry = db.session.query(DrugProduct).filter_by(name=name).first()
+        if entry:
+            entry.ingredients = json.dumps(ingredients)
+        else:
+            entry = DrugProduct(name=name, ingredients=json.dumps(ingredients))
+            db.session.add(entry)
+        return entry
+
+
+class CacheLease(db.Model):
+    """Short-lived lease used to let one worker fill a cache entry at a time"""
+    id = db.Column(db.Integer, primary_key=True)
+    lease_key = db.Column(db.String(255), unique=True, nullable=False, index=True)
+    owner = db.Column(db.String(100), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    
+    @staticmethod
+    def acquire(lease_key, owner, ttl_seconds=30):
+        """Try to take the lease, returns True if this owner now holds it"""
+        now = datetime.utcnow()
+        
+        # Clear a lease left behind by a worker that died while holding it
+        db.session.query(CacheLease).filter(
+            CacheLease.lease_key == lease_key,
+            CacheLease.expires_at < now
+        ).delete(synchronize_session=False)
+        
+        db.session.add(CacheLease(
+            lease_key=lease_key,
+            owner=owner,
+            expires_at=now + timedelta(seconds=ttl_seconds)
+        ))
+        try:
+            db.session.commit()
+            return True
+        except IntegrityError:
+            db.session.rollback()
+            return False
+    
+    @staticmethod
+    def release(lease_key, owner):
+        """Give up a lease held by this owner"""
+        db.session.query(CacheLease).filter_by(
+            lease_key=lease_key,
+            owner=owner
+        ).delete(synchronize_session=False)
         db.session.commit()
+    
+    @staticmethod
+    def is_held(lease_key):
+        """Check whether any worker currently holds an unexpired lease"""
+        return db.session.query(CacheLease).filter(
+            CacheLease.lease_key == lease_key,
+            CacheLease.expires_at >= datetime.utcnow()
+        ).first() is not None
 
 
 class UserMedication(db.Model):
@@ -174,53 +370,161 @@ class UserMedication(db.Model):
     user = db.relationship('User', backref=db.backref('medications', lazy='dynamic'))
 
 
+class MedicationInteraction(db.Model):
+    """Precomputed interaction between two of a user's saved medications"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    medication1_id = db.Column(db.Integer, db.ForeignKey('user_medication.id'), nullable=False, index=True)  # lower id
+    medication2_id = db.Column(db.Integer, db.ForeignKey('user_medication.id'), nullable=False, index=True)  # higher id
+    status = db.Column(db.String(20), nullable=False, default='pending')  # 'pending', 'ready', 'error'
+    interaction_data = db.Column(PayloadType, nullable=True)
+    has_interaction = db.Column(db.Boolean, nullable=True)
+    severity = db.Column(db.String(20), nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (db.UniqueConstraint('user_id', 'medication1_id', 'medication2_id', name='unique_medication_interaction'),)
+    
+    @staticmethod
+    def ordered_ids(medication1_id, medication2_id):
+        """The (lower, higher) id order pairs are stored in"""
+        return tuple(sorted([medication1_id, medication2_id]))
+
+
 class DrugInteractionCache(db.Model):
     """Cache for drug interaction data to reduce API calls"""
     id = db.Column(db.Integer, primary_key=True)
     drug_pair = db.Column(db.String(400), unique=True, nullable=False, index=True)  # Format: "drug1:drug2" (alphabetically sorted)
-    interaction_data = db.Column(db.Text, nullable=False)  # JSON data containing interaction information
+    interaction_data = db.Column(PayloadType, nullable=False)  # Interaction information payload
     severity = db.Column(db.String(20), nullable=True)  # 'mild', 'moderate', 'severe'
     description = db.Column(db.Text, nullable=True)
+    is_negative = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())  # interaction unknown
     last_updated = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Entries are fresh for a month, then served stale while they are
+    # refreshed in the background, until they are too old to use at all
+    SOFT_TTL = timedelta(days=30)
+    HARD_TTL = timedelta(days=90)
+    # "Unknown" answers, e.g. for misspelled drugs, are only kept for a day
+    # and never served stale
+    NEGATIVE_TTL = timedelta(days=1)
+    
+    # Keys per IN (...) query, below SQLite's bound parameter limit
+    BULK_LOOKUP_CHUNK = 500
+    
     @staticmethod
-    def get_cached_interaction(drug1, drug2):
-        """Get cached interaction data for two drugs"""
+    def make_pair_key(drug1, drug2):
+        """Cache key for a drug pair, the same for either order"""
         # Sort drug names alphabetically for consistent storage
         drug_names = sorted([drug1, drug2])
-        drug_pair = f"{drug_names[0]}:{drug_names[1]}"
+        return f"{drug_names[0]}:{drug_names[1]}"
+    
+    @staticmethod
+    def get_cached_entry(drug1, drug2):
+        """
+        Get cached interaction data for two drugs and whether it is stale
+        
+        Returns (data, is_stale) with data already decoded. data is None if
+        there is no entry or it is older than HARD_TTL; is_stale is True if it
+        is older than SOFT_TTL.
+        """
+        drug_pair = DrugInteractionCache.make_pair_key(drug1, drug2)
         
         cache_entry = db.session.query(DrugInteractionCache).filter_by(drug_pair=drug_pair).first()
         if cache_entry:
-            # Check if cache is older than a month
-            cache_age = datetime.utcnow() - cache_entry.last_updated
-            if cache_age.days < 30:  # Cache valid for a month
-                return cache_entry.interaction_data
-        return None
+            usable, is_stale = DrugInteractionCache.freshness(
+                cache_entry.last_updated, cache_entry.is_negative, datetime.utcnow()
+            )
+            if usable:
+                return cache_entry.interaction_data, is_stale
+        return None, False
+    
+    @staticmethod
+    def is_negative_payload(interaction_data):
+        """Whether an interaction answer says the interaction is unknown"""
+        return isinstance(interaction_data, dict) and interaction_data.get("has_interaction") is None
+    
+    @staticmethod
+    def freshness(last_updated, is_negative, now):
+        """
+        Return (usable, is_stale) for an entry updated at last_updated
+        
+        Unknown answers are usable for NEGATIVE_TTL and never stale, the rest
+        follow SOFT_TTL and HARD_TTL.
+        """
+        cache_age = now - last_updated
+        if is_negative:
+            return cache_age < DrugInteractionCache.NEGATIVE_TTL, False
+        return cache_age < DrugInteractionCache.HARD_TTL, cache_age >= DrugInteractionCache.SOFT_TTL
+    
+    @staticmethod
+    def get_cached_interactions(pairs):
+        """
+        Look up many drug pairs at once
+        
+        Returns (hits, misses). hits maps each cached (drug1, drug2) pair to
+        (data, is_stale) as get_cached_entry would; misses lists the pairs with
+        no usable entry, in their original order.
+        """
+        keys = {pair: DrugInteractionCache.make_pair_key(*pair) for pair in pairs}
+        unique_keys = list(dict.fromkeys(keys.values()))
+        
+        entries = {}
+        chunk_size = DrugInteractionCache.BULK_LOOKUP_CHUNK
+        for i in range(0, len(unique_keys), chunk_size):
+            rows = db.session.query(DrugInteractionCache).filter(
+                DrugInteractionCache.drug_pair.in_(unique_keys[i:i + chunk_size])
+            ).all()
+            entries.update((row.drug_pair, row) for row in rows)
+        
+        now = datetime.utcnow()
+        hits = {}
+        misses = []
+        for pair, key in keys.items():
+            cache_entry = entries.get(key)
+            usable, is_stale = DrugInteractionCache.freshness(
+                cache_entry.last_updated, cache_entry.is_negative, now
+            ) if cache_entry else (False, False)
+            if usable:
+                hits[pair] = (cache_entry.interaction_data, is_stale)
+            else:
+                misses.append(pair)
+        return hits, misses
+    
+    @staticmethod
+    def get_cached_interaction(drug1, drug2):
+        """Get cached interaction data for two drugs only if it is still fresh"""
+        data, is_stale = DrugInteractionCache.get_cached_entry(drug1, drug2)
+        return None if is_stale else data
     
     @staticmethod
     def update_cache(drug1, drug2, interaction_data, severity=None, description=None):
         """Update the interaction cache for two drugs"""
-        # Sort drug names alphabetically for consistent storage
-        drug_names = sorted([drug1, drug2])
-        drug_pair = f"{drug_names[0]}:{drug_names[1]}"
+        drug_pair = DrugInteractionCache.make_pair_key(drug1, drug2)
+        is_negative = DrugInteractionCache.is_negative_payload(interaction_data)
+        updated_at = datetime.utcnow()
         
         cache_entry = db.session.query(DrugInteractionCache).filter_by(drug_pair=drug_pair).first()
         if cache_entry:
             cache_entry.interaction_data = interaction_data
             cache_entry.severity = severity
             cache_entry.description = description
-            cache_entry.last_updated = datetime.utcnow()
+            cache_entry.is_negative = is_negative
+            cache_entry.last_updated = updated_at
         else:
             cache_entry = DrugInteractionCache(
                 drug_pair=drug_pair, 
                 interaction_data=interaction_data,
                 severity=severity,
-                description=description
+                description=description,
+                is_negative=is_negative,
+                last_updated=updated_at
             )
             db.session.add(cache_entry)
         db.session.commit()
         
+        # Keep this worker's interaction graph in sync
+        drug_interaction_graph.add(drug1, drug2, interaction_data, severity, updated_at, is_negative)
+        
         return cache_entry
 
 
@@ -235,6 +539,8 @@ class DrugInteractionCheck(db.Model):
     
     # Relationship to user
     user = db.relationship('User', backref=db.backref('interaction_checks', lazy='dynamic'))
+    
+    __table_args__ = (db.Index('ix_drug_interaction_check_user_date', 'user_id', 'check_date'),)
 
 class HealthScan(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -306,12 +612,59 @@ class FoodScan(db.Model):
     sodium = db.Column(db.Float, nullable=True)
     cholesterol = db.Column(db.Float, nullable=True)
     food_image_url = db.Column(db.String(500), nullable=True)
-    data = db.Column(db.Text, nullable=True)  # JSON data with additional nutrition info
+    data = db.Column(PayloadType, nullable=True)  # Additional nutrition info payload
     
     # Relationships
     user = db.relationship('User', backref=db.backref('food_scans', lazy='dynamic'))
 
 
+class ScanImageHash(db.Model):
+    """Perceptual hash of a scanned image and the result it produced, to answer rescans"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    scan_type = db.Column(db.String(20), nullable=False)  # face, tongue, eye, skin, food
+    image_hash = db.Column(db.BigInteger, nullable=False)  # 64-bit dHash stored as a signed integer
+    result = db.Column(PayloadType, nullable=False)
+    health_scan_id = db.Column(db.Integer, db.ForeignKey('health_scan.id'), nullable=True)
+    food_scan_id = db.Column(db.Integer, db.ForeignKey('food_scan.id'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (db.Index('ix_scan_image_hash_user_type_created', 'user_id', 'scan_type', 'created_at'),)
+    
+    @staticmethod
+    def to_signed(image_hash):
+        """Map an unsigned 64-bit hash into the BIGINT range"""
+        return image_hash - (1 << 64) if image_hash >= (1 << 63) else image_hash
+    
+    @staticmethod
+    def to_unsigned(image_hash):
+        return image_hash & ((1 << 64) - 1)
+
+
+class AnalysisJob(db.Model):
+    """Background analysis request, e.g. a health scan, run by the job workers"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    kind = db.Column(db.String(30), nullable=False)  # health_scan, food_scan, diet_plan
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)  # queued, running, done, error
+    params = db.Column(PayloadType, nullable=True)
+    input_image = db.Column(db.LargeBinary, nullable=True)  # cleared once the job has finished
+    result = db.Column(PayloadType, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    def to_dict(self):
+        data = {"job_id": self.id, "kind": self.kind, "status": self.status}
+        if self.status == 'done':
+            data["result"] = self.result
+        elif self.status == 'error':
+            data["error"] = self.error
+        return data
+
+
 class BMIRecord(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -320,7 +673,7 @@ class BMIRecord(db.Model):
     weight = db.Column(db.Float, nullable=False)  # in kilograms
     bmi_value = db.Column(db.Float, nullable=False)
     bmi_category = db.Column(db.String(50), nullable=False)  # Underweight, Normal, Overweight, Obese
-    diet_plan = db.Column(db.Text, nullable=True)  # JSON data containing personalized diet plan
+    diet_plan = db.Column(PayloadType, nullable=True)  # Personalized diet plan payload
     
     # Relationships
     user = db.relationship('User', backref=db.backref('bmi_records', lazy='dynamic'))
@@ -0,0 +1,159 @@
+"""
+Pre-warm the medicine cache for the most popular searches
+
+Aggregates SearchHistory over a recent window, picks the most searched
+medicines whose MedicineCache entry is missing or close to expiry and
+refreshes them from OpenAI with bounded concurrency and a request budget.
+
+Run once (e.g. from cron):
+    python prewarm_medicine_cache.py --top 100
+Or keep it running as a scheduled job:
+    python prewarm_medicine_cache.py --top 100 --interval 3600
+"""
+import time
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from app import app, db
+from models import SearchHistory, MedicineCache
+from utils import refresh_medicine_info, openai
+from utils_drugs import is_medicine_query, resolve_medicine_name
+
+
+class RequestBudget:
+    """Space out calls so no more than per_minute start in any minute"""
+
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0
+        self._next_start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def popular_medicines(days):
+    """Return a Counter of canonical medicine names searched in the last days"""
+    since = datetime.utcnow() - timedelta(days=days)
+    rows = db.session.query(
+        SearchHistory.query,
+        db.func.count(SearchHistory.id)
+    ).filter(
+        SearchHistory.timestamp >= since
+    ).group_by(SearchHistory.query).all()
+    
+    counts = Counter()
+    for query, count in rows:
+        if is_medicine_query(query):
+            counts[resolve_medicine_name(query)] += count
+    return counts
+
+
+def select_candidates(counts, top_n, refresh_before):
+    """Split the top medicines into (needs refresh, still fresh) name lists"""
+    top_names = [name for name, _ in counts.most_common(top_n)]
+    last_updated = dict(
+        db.session.query(MedicineCache.medicine_name, MedicineCache.last_updated)
+        .filter(MedicineCache.medicine_name.in_(top_names)).all()
+    ) if top_names else {}
+    
+    refresh_after = datetime.utcnow() - (MedicineCache.SOFT_TTL - refresh_before)
+    stale = []
+    fresh = []
+    for name in top_names:
+        updated = last_updated.get(name)
+        if updated is None or updated <= refresh_after:
+            stale.append(name)
+        else:
+            fresh.append(name)
+    return stale, fresh
+
+
+def _refresh(name, budget):
+    budget.wait()
+    with app.app_context():
+        result = refresh_medicine_info(name)
+    return bool(result)
+
+
+def prewarm(top_n=100, days=30, refresh_before_hours=24, concurrency=4, per_minute=30, dry_run=False):
+    """Refresh popular medicines ahead of time and return a report dict"""
+    counts = popular_medicines(days)
+    total_searches = sum(counts.values())
+    stale, fresh = select_candidates(counts, top_n, timedelta(hours=refresh_before_hours))
+    
+    refreshed = []
+    failed = []
+    if stale and not dry_run:
+        if not openai:
+            print("OpenAI API key is not configured, nothing can be refreshed.")
+        else:
+            budget = RequestBudget(per_minute)
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                futures = {name: executor.submit(_refresh, name, budget) for name in stale}
+                for name, future in futures.items():
+                    try:
+                        (refreshed if future.result() else failed).append(name)
+                    except Exception as e:
+                        print(f"Failed to refresh {name}: {str(e)}")
+                        failed.append(name)
+    
+    # Projected hit rate if the next window's searches look like this one
+    warm = set(fresh) | set(refreshed)
+    cached_names = set(
+        name for (name,) in db.session.query(MedicineCache.medicine_name)
+        .filter(MedicineCache.last_updated > datetime.utcnow() - MedicineCache.SOFT_TTL).all()
+    )
+    warm |= cached_names & set(counts)
+    warm_searches = sum(count for name, count in counts.items() if name in warm)
+    
+    return {
+        "searches": total_searches,
+        "distinct_medicines": len(counts),
+        "candidates": len(stale),
+        "refreshed": len(refreshed),
+        "failed": len(failed),
+        "already_fresh": len(fresh),
+        "projected_hit_rate": warm_searches / total_searches if total_searches else 0.0
+    }
+
+
+def print_report(report):
+    print(f"Medicine searches in window: {report['searches']} ({report['distinct_medicines']} medicines)")
+    print(f"Top medicines needing refresh: {report['candidates']}, already fresh: {report['already_fresh']}")
+    print(f"Refreshed: {report['refreshed']}, failed: {report['failed']}")
+    print(f"Projected cache hit rate: {report['projected_hit_rate']:.1%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-warm the medicine cache from search popularity")
+    parser.add_argument("--top", type=int, default=100, help="number of popular medicines to consider")
+    parser.add_argument("--days", type=int, default=30, help="search history window in days")
+    parser.add_argument("--refresh-before", type=int, default=24, help="refresh entries expiring within this many hours")
+    parser.add_argument("--concurrency", type=int, default=4, help="maximum parallel OpenAI calls")
+    parser.add_argument("--rate", type=int, default=30, help="maximum OpenAI calls per minute")
+    parser.add_argument("--interval", type=int, default=0, help="repeat every N seconds, 0 runs once")
+    parser.add_argument("--dry-run", action="store_true", help="report candidates without calling OpenAI")
+    args = parser.parse_args()
+    
+    while True:
+        with app.app_context():
+            print_report(prewarm(
+                top_n=args.top,
+                days=args.days,
+                refresh_before_hours=args.refresh_before,
+                concurrency=args.concurrency,
+                per_minute=args.rate,
+                dry_run=args.dry_run
+            ))
+        if args.interval <= 0:
+            break
+        time.sleep(args.interval)
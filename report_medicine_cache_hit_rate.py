@@ -0,0 +1,117 @@
+"""
+Report the cache hit rates that recorded traffic would see with raw keys
+compared with canonical keys: SearchHistory against the medicine cache with
+alias resolved names, and DrugInteractionCheck against the drug interaction
+cache with ingredient-level pair keys
+"""
+import json
+
+from app import app, db
+from models import SearchHistory, MedicineCache, DrugInteractionCheck, DrugInteractionCache
+from utils_drugs import is_medicine_query, resolve_medicine_name, interaction_ingredient_pairs
+
+# Entries up to the hard TTL are served without waiting on OpenAI
+CACHE_TTL = MedicineCache.HARD_TTL
+
+
+def simulate_hit_rate(searches, key_fn):
+    """
+    Replay searches in time order against an unbounded cache with the
+    MedicineCache TTL and count how many would have been cache hits.
+    """
+    filled_at = {}
+    hits = 0
+    for query, timestamp in searches:
+        key = key_fn(query)
+        last_fill = filled_at.get(key)
+        if last_fill is not None and timestamp - last_fill < CACHE_TTL:
+            hits += 1
+        else:
+            filled_at[key] = timestamp
+    return hits, len(filled_at)
+
+
+def simulate_pair_hit_rate(checks, keys_fn):
+    """
+    Replay interaction checks in time order against an unbounded cache with
+    the DrugInteractionCache TTL. A drug pair is a hit if every key it needs
+    is cached.
+    """
+    filled_at = {}
+    hits = 0
+    pairs_checked = 0
+    for medications, timestamp in checks:
+        for i in range(len(medications)):
+            for j in range(i + 1, len(medications)):
+                pairs_checked += 1
+                keys = keys_fn(medications[i], medications[j])
+                if all(
+                    key in filled_at and timestamp - filled_at[key] < DrugInteractionCache.HARD_TTL
+                    for key in keys
+                ):
+                    hits += 1
+                    continue
+                for key in keys:
+                    if key not in filled_at or timestamp - filled_at[key] >= DrugInteractionCache.HARD_TTL:
+                        filled_at[key] = timestamp
+    return hits, pairs_checked, len(filled_at)
+
+
+def _ingredient_keys(drug1, drug2):
+    ingredient_pairs, _ = interaction_ingredient_pairs(drug1, drug2)
+    return [DrugInteractionCache.make_pair_key(*pair) for pair in ingredient_pairs]
+
+
+def report_interaction_hit_rate():
+    """Print the before/after hit rate for all recorded drug interaction checks"""
+    checks = []
+    for medications, timestamp in db.session.query(
+        DrugInteractionCheck.medications, DrugInteractionCheck.check_date
+    ).order_by(DrugInteractionCheck.check_date).all():
+        try:
+            medications = json.loads(medications)
+        except ValueError:
+            continue
+        if isinstance(medications, list) and timestamp is not None:
+            checks.append((medications, timestamp))
+    if not checks:
+        print("No drug interaction checks recorded.")
+        return
+    
+    raw_hits, total, raw_keys = simulate_pair_hit_rate(
+        checks, lambda drug1, drug2: [DrugInteractionCache.make_pair_key(drug1, drug2)]
+    )
+    ingredient_hits, _, ingredient_keys = simulate_pair_hit_rate(checks, _ingredient_keys)
+    
+    print(f"Drug pairs replayed: {total}")
+    print(f"Raw pair keys:        {raw_keys} cache entries, hit rate {raw_hits / total:.1%}")
+    print(f"Ingredient pair keys: {ingredient_keys} cache entries, hit rate {ingredient_hits / total:.1%}")
+
+
+def report_hit_rate():
+    """Print the before/after hit rate for all recorded medicine searches"""
+    searches = [
+        (query, timestamp)
+        for query, timestamp in db.session.query(SearchHistory.query, SearchHistory.timestamp)
+        .order_by(SearchHistory.timestamp).all()
+        if is_medicine_query(query) and timestamp is not None
+    ]
+    if not searches:
+        print("No medicine searches recorded.")
+        return
+    
+    total = len(searches)
+    raw_hits, raw_keys = simulate_hit_rate(searches, lambda query: query)
+    canonical_hits, canonical_keys = simulate_hit_rate(searches, resolve_medicine_name)
+    
+    print(f"Medicine searches replayed: {total}")
+    print(f"Raw keys:       {raw_keys} cache entries, hit rate {raw_hits / total:.1%}")
+    print(f"Canonical keys: {canonical_keys} cache entries, hit rate {canonical_hits / total:.1%}")
+    print(f"OpenAI calls avoided: {canonical_hits - raw_hits}")
+
+
+if __name__ == "__main__":
+    with app.app_context():
+        report_hit_rate()
+        print()
+        report_interaction_hit_rate()
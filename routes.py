@@ -1,16 +1,26 @@
 import json
 import os
 import time
-from flask import render_template, request, redirect, url_for, flash, jsonify, abort, session
+from flask import render_template, request, redirect, url_for, flash, jsonify, abort, session, Response, stream_with_context
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_wtf import FlaskForm
 from wtforms import StringField, TextAreaField, DateField, BooleanField, SelectField, FileField, IntegerField, PasswordField, EmailField
 from wtforms.validators import DataRequired, Length, Optional, Email, ValidationError, NumberRange, EqualTo
 from app import app, db
-from models import User, Subscription, SearchHistory, MedicineCache, HealthScan, FoodScan, BMIRecord, Reminder, Doctor, Appointment, DoctorReview, Message, UserMedication, DrugInteractionCheck
-from utils import get_medicine_info, init_admin_account, record_search, analyze_health_data, analyze_food_image, generate_diet_plan, check_drug_interaction, check_multiple_drug_interactions
+from models import User, Subscription, SearchHistory, MedicineCache, HealthScan, FoodScan, BMIRecord, Reminder, Doctor, Appointment, DoctorReview, Message, UserMedication, DrugInteractionCheck, DrugInteractionCache, ScanImageHash, AnalysisJob, SearchUsage, MedicationInteraction
+from utils import get_medicine_info, stream_medicine_info, init_admin_account, record_search, analyze_health_data, analyze_food_image, generate_diet_plan, check_drug_interaction, check_multiple_drug_interactions, stream_drug_interactions, known_interactions_with, get_remaining_interaction_checks, INTERACTION_API_MAX_PAIRS, INTERACTION_API_DEADLINE, INTERACTION_API_PAIRS_PER_HOUR
 from utils_mail import generate_otp, send_otp_email
+from utils_cache import medicine_memory_cache, medicine_single_flight, cache_refresher, upstream_error_cache, openai_calls_avoided
+from utils_writebehind import search_history_buffer, interaction_check_buffer
+from utils_suggest import medicine_suggest_index
+from utils_interaction_graph import drug_interaction_graph
+from utils_interaction_rules import interaction_rules
+from utils_image import ImagePayload, vision_image_stats
+from utils_scan_cache import find_recent_scan, scan_dedupe_stats
+from utils_jobs import job_queue
+from utils_analysis import run_health_scan, run_food_scan, run_bmi_record
+from utils_medication_matrix import check_saved_medication_interactions, add_medication_pairs, remove_medication_pairs, queue_matrix_update, medication_matrix_refresher
 from datetime import datetime, timedelta
 import logging
 
@@ -357,6 +367,26 @@ def search():
                               medicine=medicine_info, 
                               title=f'Results for {query}')
                               
+    # Logged in users get the page right away and the answer streamed into
+    # it from /api/search/stream, see search.js
+    query = request.args.get('medicine_name', '').strip()
+    if query and current_user.is_authenticated:
+        placeholder = {
+            "name": query,
+            "description": "",
+            "useCases": [],
+            "pros": [],
+            "cons": [],
+            "dosage": {"timing": "", "duration": "", "breaks": ""},
+            "warnings": [],
+            "found": True
+        }
+        return render_template('search_results.html',
+                              medicine=placeholder,
+                              streaming=True,
+                              query=query,
+                              title=f'Results for {query}')
+    
     # GET request or no query, redirect to home
     return redirect(url_for('home'))
 
@@ -380,9 +410,70 @@ def api_search():
     medicine_info = get_medicine_info(query, current_user)
     return jsonify(medicine_info)
 
+def _sse_event(event, data):
+    """Format one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/api/search/stream')
+@login_required
+def api_search_stream():
+    """Stream medicine info to the browser as Server-Sent Events"""
+    query = request.args.get('medicine_name', '').strip()
+    
+    # Check the request before streaming, the user object is detached
+    # from the database session once the generator runs
+    error = None
+    if not query:
+        error = {'error': 'Medicine name is required'}
+    elif current_user.get_remaining_searches() <= 0:
+        error = {
+            'error': 'Search limit reached',
+            'message': 'You have reached your search limit. Please upgrade your subscription.'
+        }
+    user = current_user._get_current_object()
+    
+    def generate():
+        # Send something right away so the browser sees the first byte
+        # before the OpenAI call starts
+        yield ": stream opened\n\n"
+        
+        if error:
+            yield _sse_event('error', error)
+            return
+        
+        for event, data in stream_medicine_info(query, user):
+            yield _sse_event(event, data)
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+@app.route('/api/medicines/suggest')
+@login_required
+def api_medicine_suggest():
+    """Autocomplete medicine names from the in-memory suggestion index"""
+    query = request.args.get('q', '').strip()
+    limit = max(1, min(request.args.get('limit', 8, type=int), 20))
+    
+    if len(query) < 2:
+        return jsonify({'query': query, 'suggestions': []})
+    
+    return jsonify({
+        'query': query,
+        'suggestions': medicine_suggest_index.suggest(query, limit)
+    })
+
 @app.route('/user/dashboard')
 @login_required
 def user_dashboard():
+    # Write out buffered searches so the history below is complete
+    search_history_buffer.flush()
+    
     # Get user's search history
     search_history = db.session.query(SearchHistory).filter_by(user_id=current_user.id)\
                                  .order_by(SearchHistory.timestamp.desc())\
@@ -609,6 +700,31 @@ def fix_admin_privilege():
     
     return redirect(url_for('admin_check'))
 
+@app.route('/admin/cache-stats')
+@login_required
+def admin_cache_stats():
+    """Per-worker cache counters for monitoring"""
+    if not current_user.is_admin:
+        abort(403)
+    
+    return jsonify({
+        "pid": os.getpid(),
+        "medicine_memory_cache": medicine_memory_cache.stats(),
+        "medicine_single_flight": medicine_single_flight.stats(),
+        "search_history_buffer": search_history_buffer.stats(),
+        "interaction_check_buffer": interaction_check_buffer.stats(),
+        "cache_refresher": cache_refresher.stats(),
+        "drug_interaction_graph": drug_interaction_graph.stats(),
+        "interaction_rules": interaction_rules.stats(),
+        "medication_matrix_refresher": medication_matrix_refresher.stats(),
+        "upstream_error_cache": upstream_error_cache.stats(),
+        "openai_calls_avoided": openai_calls_avoided.stats(),
+        "vision_image_stats": vision_image_stats.stats(),
+        "scan_dedupe": scan_dedupe_stats.stats(),
+        "job_queue": job_queue.stats(),
+        "medicine_suggest_index": medicine_suggest_index.stats()
+    })
+
 # Error handlers
 @app.errorhandler(404)
 def not_found_error(error):
@@ -717,8 +833,8 @@ def check_saved_medications():
         flash('Please select at least two medications to check for interactions.', 'warning')
         return redirect(url_for('drug_interactions'))
     
-    # Check for interactions
-    results = check_multiple_drug_interactions(medications, current_user)
+    # Check for interactions, precomputed when the medications were saved
+    results = check_saved_medication_interactions(medications, current_user)
     
     # Render the same template with results
     return render_template('drug_interactions.html',
@@ -754,9 +870,27 @@ def add_medication():
         )
         
         db.session.add(medication)
+        db.session.flush()
+        
+        # Only the pairs with the new medication need computing
+        add_medication_pairs(medication)
         db.session.commit()
+        queue_matrix_update(current_user.id)
         
         flash(f'Medication "{form.medication_name.data}" added successfully.', 'success')
+        
+        # Warn right away about interactions we already know of
+        saved_names = [
+            name for (name,) in db.session.query(UserMedication.medication_name).filter(
+                UserMedication.user_id == current_user.id,
+                UserMedication.id != medication.id
+            )
+        ]
+        known = known_interactions_with(medication.medication_name, saved_names)
+        if known:
+            names = ', '.join(f'{name} ({severity})' for name, severity in known)
+            flash(f'"{medication.medication_name}" is known to interact with: {names}. '
+                  f'Check your saved medications for details.', 'warning')
     else:
         for field, errors in form.errors.items():
             for error in errors:
@@ -780,6 +914,7 @@ def edit_medication():
         return redirect(url_for('drug_interactions'))
     
     # Update medication fields
+    name_changed = medication.medication_name != request.form.get('medication_name')
     medication.medication_name = request.form.get('medication_name')
     medication.dosage = request.form.get('dosage')
     medication.frequency = request.form.get('frequency')
@@ -802,7 +937,14 @@ def edit_medication():
     medication.notes = request.form.get('notes')
     medication.updated_at = datetime.utcnow()
     
+    # A renamed medication needs its pairs recomputed
+    if name_changed:
+        remove_medication_pairs(medication.id)
+        add_medication_pairs(medication)
+    
     db.session.commit()
+    if name_changed:
+        queue_matrix_update(current_user.id)
     
     flash('Medication updated successfully.', 'success')
     return redirect(url_for('drug_interactions'))
@@ -822,6 +964,7 @@ def delete_medication():
         flash('Medication not found.', 'danger')
         return redirect(url_for('drug_interactions'))
     
+    remove_medication_pairs(medication.id)
     db.session.delete(medication)
     db.session.commit()
     
@@ -848,6 +991,112 @@ def api_drug_interaction():
     
     return jsonify(interaction)
 
+
+def _parse_interaction_batch(data):
+    """
+    Collect the drug pairs of a batch request, returns (pairs, error)
+    
+    Accepts "pairs" as [drug1, drug2] lists or {"drug1", "drug2"} objects and
+    "medication_lists" as lists of medications to check pairwise. Pairs are
+    de-duplicated regardless of order.
+    """
+    requested = []
+    for item in data.get('pairs') or []:
+        if isinstance(item, dict):
+            item = [item.get('drug1'), item.get('drug2')]
+        if not isinstance(item, list) or len(item) != 2:
+            return None, 'Each pair must have exactly two medications'
+        requested.append(item)
+    
+    for medications in data.get('medication_lists') or []:
+        if not isinstance(medications, list) or len(medications) < 2:
+            return None, 'Each medication list must have at least two medications'
+        requested.extend(
+            [medications[i], medications[j]]
+            for i in range(len(medications))
+            for j in range(i + 1, len(medications))
+        )
+    
+    pairs = {}
+    for drug1, drug2 in requested:
+        if not isinstance(drug1, str) or not isinstance(drug2, str) or not drug1.strip() or not drug2.strip():
+            return None, 'Medication names must be non-empty strings'
+        drug1, drug2 = drug1.strip(), drug2.strip()
+        if len(drug1) > 200 or len(drug2) > 200:
+            return None, 'Medication names must be at most 200 characters'
+        if drug1 != drug2:
+            pairs.setdefault(DrugInteractionCache.make_pair_key(drug1, drug2), (drug1, drug2))
+    
+    if not pairs:
+        return None, 'At least one pair of medications is required'
+    return list(pairs.values()), None
+
+def _ndjson_line(data):
+    """Format one newline-delimited JSON record"""
+    return json.dumps(data) + "\n"
+
+@app.route('/api/drug-interactions/batch', methods=['POST'])
+@login_required
+def api_drug_interactions_batch():
+    """
+    Check many drug pairs in one request, streaming one JSON line per pair
+    as it resolves (cache hits first) followed by a summary line
+    
+    Every pair is recorded as an interaction check and counts against the
+    user's hourly limit, a batch that does not fit is rejected whole.
+    """
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data, dict):
+        return jsonify({"error": "No data provided"}), 400
+    
+    pairs, error = _parse_interaction_batch(data)
+    if error:
+        return jsonify({"error": error}), 400
+    if len(pairs) > INTERACTION_API_MAX_PAIRS:
+        return jsonify({
+            "error": f"Too many pairs, at most {INTERACTION_API_MAX_PAIRS} can be checked per request",
+            "pairs": len(pairs)
+        }), 413
+    
+    user_id = current_user.id
+    remaining = get_remaining_interaction_checks(user_id)
+    if len(pairs) > remaining:
+        return jsonify({
+            "error": f"Too many interaction checks, at most {INTERACTION_API_PAIRS_PER_HOUR} pairs can be checked per hour",
+            "pairs": len(pairs),
+            "remaining": remaining
+        }), 429
+    
+    def generate():
+        timed_out = 0
+        unchecked = set(pairs)
+        try:
+            for (drug1, drug2), interaction in stream_drug_interactions(pairs, INTERACTION_API_DEADLINE):
+                timed_out += bool(interaction.get("timed_out"))
+                unchecked.discard((drug1, drug2))
+                interaction_check_buffer.record(
+                    user_id,
+                    [drug1, drug2],
+                    interaction.get("has_interaction", False),
+                    interaction.get("severity")
+                )
+                yield _ndjson_line({"drug1": drug1, "drug2": drug2, "interaction": interaction})
+            yield _ndjson_line({"done": True, "pairs": len(pairs), "timed_out": timed_out, "partial": timed_out > 0})
+        finally:
+            # Pairs the client disconnected before are still being checked,
+            # they count against the limit like a timed out pair
+            for drug1, drug2 in unchecked:
+                interaction_check_buffer.record(user_id, [drug1, drug2], False, "unknown")
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
 # Health Scanner Routes
 @app.route('/health-scanner')
 @login_required
@@ -914,18 +1163,13 @@ def api_process_heart_rate_frame():
         image_data = data.get('image_data')
         
         # Process image with ML heart rate detection
-        import base64
-        import numpy as np
-        import cv2
         from ml_heart_rate import get_vital_signs_from_image
         
         # Decode base64 image
-        if ',' in image_data:
-            image_data = image_data.split(',', 1)[1]
-        
-        img_bytes = base64.b64decode(image_data)
-        np_arr = np.frombuffer(img_bytes, np.uint8)
-        img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+        try:
+            img = ImagePayload.from_base64(image_data).to_cv2()
+        except ValueError:
+            img = None
         
         if img is None:
             return jsonify({"error": "Invalid image data"}), 400
@@ -947,6 +1191,32 @@ def api_process_heart_rate_frame():
         print(traceback.format_exc())
         return jsonify({"success": False, "error": str(e)}), 500
 
+def _wants_async():
+    """Whether the client asked for slow work to run as a background job"""
+    return 'respond-async' in request.headers.get('Prefer', '')
+
+def _job_accepted(job):
+    """202 response pointing the client at the job status endpoint"""
+    status_url = url_for('api_job_status', job_id=job.id)
+    response = jsonify({"job_id": job.id, "status": job.status, "status_url": status_url})
+    response.status_code = 202
+    response.headers['Location'] = status_url
+    response.headers['Preference-Applied'] = 'respond-async'
+    return response
+
+@app.route('/api/jobs/<int:job_id>')
+@login_required
+def api_job_status(job_id):
+    """Status, and once finished the result, of a background analysis job"""
+    job = db.session.query(AnalysisJob).filter_by(id=job_id, user_id=current_user.id).first()
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    
+    response = jsonify(job.to_dict())
+    if job.status in ('queued', 'running'):
+        response.headers['Retry-After'] = '1'
+    return response
+
 @app.route('/api/health-scan', methods=['POST'])
 @login_required
 def api_health_scan():
@@ -954,11 +1224,8 @@ def api_health_scan():
     if not current_user.is_authenticated:
         return jsonify({"error": "Authentication required"}), 401
     
-    # Check if user has remaining searches
-    if current_user.get_remaining_searches() <= 0:
-        return jsonify({"error": "You have reached your search limit. Please upgrade your subscription."}), 403
-    
-    # Handle both JSON and form data requests
+    # Handle multipart binary uploads, JSON and form data requests
+    image_file = request.files.get('image')
     if request.is_json:
         data = request.get_json()
         scan_type = data.get('scan_type', 'face')
@@ -973,104 +1240,42 @@ def api_health_scan():
         return jsonify({"error": "Invalid scan type"}), 400
     
     # Validate image data
-    if not image_data:
+    if not image_file and not image_data:
         return jsonify({"error": "Image data is required"}), 400
     
+    # The image stays in memory, a base64 upload is passed to OpenAI as is
+    try:
+        if image_file:
+            image = ImagePayload.from_file(image_file)
+        else:
+            image = ImagePayload.from_base64(image_data).validate()
+    except ValueError:
+        return jsonify({"error": "Invalid image data"}), 400
+    
+    # A rescan of the same image returns the stored result without using quota
+    previous_result, image_hash = find_recent_scan(current_user.id, scan_type, image)
+    if previous_result is not None:
+        return jsonify(previous_result)
+    
+    # Check if user has remaining searches
+    if current_user.get_remaining_searches() <= 0:
+        return jsonify({"error": "You have reached your search limit. Please upgrade your subscription."}), 403
+    
     try:
         # Record the search
         record_search(current_user.id, f"Health Scan: {scan_type}")
         
-        # Process scan with OpenAI API
-        import json
-        import base64
-        import tempfile
-        import os
-        from utils import analyze_health_data
-        
-        # Save the image temporarily for analysis
-        temp_dir = tempfile.mkdtemp()
-        temp_image_path = os.path.join(temp_dir, f"scan_{current_user.id}.jpg")
-        
-        try:
-            # Extract base64 data if it includes the data URL prefix
-            if image_data and ',' in image_data:
-                image_data = image_data.split(',', 1)[1]
-                
-            with open(temp_image_path, "wb") as f:
-                f.write(base64.b64decode(image_data))
-            
-            # Process the image based on scan type
-            result = analyze_health_data(temp_image_path, scan_type)
-            
-        finally:
-            # Clean up the temporary file
-            if os.path.exists(temp_image_path):
-                os.remove(temp_image_path)
-            if os.path.exists(temp_dir):
-                os.rmdir(temp_dir)
-        
-        # Save the scan to database
-        if result:
-            # Create a base health scan object with common fields
-            new_scan = HealthScan(
-                user_id=current_user.id,
-                scan_type=scan_type,
-                scan_image_path=None,  # We don't store the actual image
-                wellness_score=result.get('wellness_score')
+        if _wants_async():
+            job = job_queue.enqueue(
+                current_user.id,
+                'health_scan',
+                {"scan_type": scan_type, "image_hash": image_hash, "mime_type": image.mime_type},
+                image=image.data
             )
-            
-            # Add fields specific to each scan type
-            if scan_type == 'face':
-                new_scan.heart_rate = result.get('heart_rate')
-                new_scan.blood_pressure_systolic = result.get('blood_pressure_systolic')
-                new_scan.blood_pressure_diastolic = result.get('blood_pressure_diastolic')
-                new_scan.breathing_rate = result.get('breathing_rate')
-                new_scan.oxygen_saturation = result.get('oxygen_saturation')
-                new_scan.sympathetic_stress = result.get('sympathetic_stress')
-                new_scan.parasympathetic_activity = result.get('parasympathetic_activity')
-                new_scan.prq = result.get('prq')
-                new_scan.hemoglobin = result.get('hemoglobin')
-                new_scan.hemoglobin_a1c = result.get('hemoglobin_a1c')
-                new_scan.ascvd_risk = result.get('ascvd_risk')
-                new_scan.hypertension_risk = result.get('hypertension_risk')
-                new_scan.glucose_risk = result.get('glucose_risk')
-                new_scan.cholesterol_risk = result.get('cholesterol_risk')
-                new_scan.tuberculosis_risk = result.get('tuberculosis_risk')
-                new_scan.heart_age = result.get('heart_age')
-            
-            elif scan_type == 'tongue':
-                new_scan.tongue_color = result.get('tongue_color')
-                new_scan.tongue_coating = result.get('tongue_coating')
-                new_scan.tongue_shape = result.get('tongue_shape')
-                new_scan.tcm_diagnosis = result.get('tcm_diagnosis')
-                new_scan.vitamin_deficiency = result.get('vitamin_deficiency')
-                new_scan.infection_indicator = result.get('infection_indicator')
-            
-            elif scan_type == 'eye':
-                new_scan.sclera_color = result.get('sclera_color')
-                new_scan.conjunctiva_color = result.get('conjunctiva_color')
-                new_scan.eye_redness = result.get('eye_redness')
-                new_scan.pupil_reactivity = result.get('pupil_reactivity')
-                new_scan.eye_condition = result.get('eye_condition')
-            
-            elif scan_type == 'skin':
-                new_scan.skin_color = result.get('skin_color')
-                new_scan.skin_texture = result.get('skin_texture')
-                new_scan.rash_detection = result.get('rash_detection', False)
-                new_scan.rash_pattern = result.get('rash_pattern')
-                new_scan.skin_condition = result.get('skin_condition')
-            
-            # Add notes and recommendations
-            if result.get('notes'):
-                new_scan.notes = json.dumps(result.get('notes', {}))
-            
-            # Save to database
-            db.session.add(new_scan)
-            db.session.commit()
-            
-            # Add the scan ID to the result for reference
-            result['scan_id'] = new_scan.id
+            return _job_accepted(job)
         
+        # Process scan with OpenAI API
+        result = run_health_scan(current_user, scan_type, image, image_hash)
         return jsonify(result)
     except Exception as e:
         import traceback
@@ -1091,10 +1296,6 @@ def api_food_scan():
     if not current_user.is_authenticated:
         return jsonify({"error": "Authentication required"}), 401
     
-    # Check if user has remaining searches
-    if current_user.get_remaining_searches() <= 0:
-        return jsonify({"error": "You have reached your search limit. Please upgrade your subscription."}), 403
-    
     try:
         # Get image data from request
         if 'food_image' not in request.files:
@@ -1102,44 +1303,31 @@ def api_food_scan():
         
         food_image = request.files['food_image']
         food_name = request.form.get('food_name', 'Unknown Food')
+        image = ImagePayload.from_file(food_image)
+        
+        # A rescan of the same image returns the stored result without using quota
+        previous_result, image_hash = find_recent_scan(current_user.id, 'food', image)
+        if previous_result is not None:
+            return jsonify(previous_result)
+        
+        # Check if user has remaining searches
+        if current_user.get_remaining_searches() <= 0:
+            return jsonify({"error": "You have reached your search limit. Please upgrade your subscription."}), 403
         
         # Record the search
         record_search(current_user.id, f"Food Scan: {food_name}")
         
-        # Analyze food image with OpenAI API
-        import json
-        import os
-        from utils import analyze_food_image
-        
-        # Save the uploaded image temporarily
-        image_path = os.path.join('/tmp', food_image.filename)
-        food_image.save(image_path)
-        
-        # Process the image
-        result = analyze_food_image(image_path, food_name)
-        
-        # Save the food scan to database
-        if result:
-            new_scan = FoodScan(
-                user_id=current_user.id,
-                food_name=food_name,
-                calories=result.get('calories'),
-                protein=result.get('protein'),
-                carbs=result.get('carbs'),
-                fat=result.get('fat'),
-                fiber=result.get('fiber'),
-                sugar=result.get('sugar'),
-                sodium=result.get('sodium'),
-                cholesterol=result.get('cholesterol'),
-                food_image_url=None,  # We don't store images for now
-                data=json.dumps(result)
+        if _wants_async():
+            job = job_queue.enqueue(
+                current_user.id,
+                'food_scan',
+                {"food_name": food_name, "image_hash": image_hash, "mime_type": image.mime_type},
+                image=image.data
             )
-            db.session.add(new_scan)
-            db.session.commit()
-        
-        # Remove temporary file
-        os.remove(image_path)
+            return _job_accepted(job)
         
+        # Analyze food image with OpenAI API, in memory
+        result = run_food_scan(current_user.id, food_name, image, image_hash)
         return jsonify(result)
     except Exception as e:
         import traceback
@@ -1188,32 +1376,29 @@ def api_calculate_bmi():
             category = "Obese"
         
         # Generate diet plan if overweight or obese
-        diet_plan = None
+        diet_plan_params = None
         if category in ["Overweight", "Obese"] or is_pregnant:
             # Record the search for diet plan
             record_search(current_user.id, f"BMI Calculator and Diet Plan")
             
-            from utils import generate_diet_plan
-            diet_plan = generate_diet_plan(bmi, category, age, gender, is_pregnant, activity_level)
+            diet_plan_params = {
+                "age": age,
+                "gender": gender,
+                "is_pregnant": is_pregnant,
+                "activity_level": activity_level
+            }
+            if _wants_async():
+                job = job_queue.enqueue(current_user.id, 'diet_plan', {
+                    "height": height,
+                    "weight": weight,
+                    "bmi": bmi,
+                    "category": category,
+                    "diet_plan_params": diet_plan_params
+                })
+                return _job_accepted(job)
         
         # Save BMI record to database
-        if current_user.is_authenticated:
-            new_record = BMIRecord(
-                user_id=current_user.id,
-                height=height,
-                weight=weight,
-                bmi_value=bmi,
-                bmi_category=category,
-                diet_plan=json.dumps(diet_plan) if diet_plan else None
-            )
-            db.session.add(new_record)
-            db.session.commit()
-        
-        result = {
-            "bmi": round(bmi, 1),
-            "category": category,
-            "diet_plan": diet_plan
-        }
+        result = run_bmi_record(current_user.id, height, weight, bmi, category, diet_plan_params)
         
         return jsonify(result)
     except Exception as e:
@@ -2352,6 +2537,11 @@ def delete_account():
         user_id = current_user.id
         username = current_user.username
         
+        # Write out buffered searches and interaction checks first, a later
+        # flush would recreate rows for the deleted user
+        search_history_buffer.flush()
+        interaction_check_buffer.flush()
+        
         # Delete all associated data in the correct order to maintain referential integrity
         try:
             # Delete reminders
@@ -2360,15 +2550,33 @@ def delete_account():
             # Delete BMI records
             db.session.query(BMIRecord).filter_by(user_id=user_id).delete()
             
+            # Delete analysis jobs
+            db.session.query(AnalysisJob).filter_by(user_id=user_id).delete()
+            
+            # Delete scan image hashes, they reference the scans
+            db.session.query(ScanImageHash).filter_by(user_id=user_id).delete()
+            
             # Delete food scans
             db.session.query(FoodScan).filter_by(user_id=user_id).delete()
             
             # Delete health scans
             db.session.query(HealthScan).filter_by(user_id=user_id).delete()
             
+            # Delete drug interaction check history
+            db.session.query(DrugInteractionCheck).filter_by(user_id=user_id).delete()
+            
+            # Delete the medication interaction matrix, it references the medications
+            db.session.query(MedicationInteraction).filter_by(user_id=user_id).delete()
+            
+            # Delete saved medications
+            db.session.query(UserMedication).filter_by(user_id=user_id).delete()
+            
             # Delete search history
             db.session.query(SearchHistory).filter_by(user_id=user_id).delete()
             
+            # Delete search quota counters
+            db.session.query(SearchUsage).filter_by(user_id=user_id).delete()
+            
             # Delete subscription
             db.session.query(Subscription).filter_by(user_id=user_id).delete()
             
@@ -60,10 +60,12 @@ document.addEventListener('DOMContentLoaded', function() {
             fetch('/api/calculate-bmi', {
                 method: 'POST',
                 headers: {
-                    'Content-Type': 'application/json'
+                    'Content-Type': 'application/json',
+                    'Prefer': 'respond-async'
                 },
                 body: JSON.stringify(formData)
             })
+            .then(resolveJobResponse)
             .then(response => {
                 if (!response.ok) {
                     throw new Error('Network response was not ok');
@@ -141,8 +141,12 @@ document.addEventListener('DOMContentLoaded', function() {
         // Submit the form
         fetch('/api/food-scan', {
             method: 'POST',
+            headers: {
+                'Prefer': 'respond-async'
+            },
             body: formData
         })
+        .then(resolveJobResponse)
         .then(response => {
             if (!response.ok) {
                 throw new Error('Network response was not ok');
@@ -169,8 +173,12 @@ document.addEventListener('DOMContentLoaded', function() {
         
         fetch('/api/food-scan', {
             method: 'POST',
+            headers: {
+                'Prefer': 'respond-async'
+            },
             body: formData
         })
+        .then(resolveJobResponse)
         .then(response => {
             if (!response.ok) {
                 throw new Error('Network response was not ok');
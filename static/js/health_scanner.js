@@ -168,18 +168,15 @@ document.addEventListener('DOMContentLoaded', function() {
                     
                     fileInput.addEventListener('change', function(e) {
                         if (e.target.files && e.target.files[0]) {
-                            const reader = new FileReader();
-                            reader.onload = function(event) {
-                                capturedImage = event.target.result;
-                                // Show processing status
-                                scanStatus.style.display = 'block';
-                                // Reset button states
-                                resetBtn.disabled = false;
-                                captureBtn.disabled = true;
-                                // Process the image
-                                processHealthScan();
-                            };
-                            reader.readAsDataURL(e.target.files[0]);
+                            // The file is uploaded as is, no need to read it as a data URL
+                            capturedImage = e.target.files[0];
+                            // Show processing status
+                            scanStatus.style.display = 'block';
+                            // Reset button states
+                            resetBtn.disabled = false;
+                            captureBtn.disabled = true;
+                            // Process the image
+                            processHealthScan();
                         }
                         document.body.removeChild(fileInput);
                     });
@@ -211,9 +208,6 @@ document.addEventListener('DOMContentLoaded', function() {
         const ctx = canvas.getContext('2d');
         ctx.drawImage(video, 0, 0, canvas.width, canvas.height);
         
-        // Get image data
-        capturedImage = canvas.toDataURL('image/jpeg');
-        
         // Show processing status
         scanStatus.style.display = 'block';
         
@@ -224,8 +218,11 @@ document.addEventListener('DOMContentLoaded', function() {
         resetBtn.disabled = false;
         captureBtn.disabled = true;
         
-        // Process the image
-        processHealthScan();
+        // Get the image as a binary JPEG and process it
+        canvas.toBlob(function(blob) {
+            capturedImage = blob;
+            processHealthScan();
+        }, 'image/jpeg', 0.92);
     });
     
     // Reset the scanner
@@ -256,20 +253,20 @@ document.addEventListener('DOMContentLoaded', function() {
     // Process the health scan
     async function processHealthScan() {
         try {
-            // Prepare the data
-            const data = {
-                scan_type: scanType,
-                image_data: capturedImage
-            };
+            // Prepare the data, the image is sent as a binary multipart upload
+            const formData = new FormData();
+            formData.append('scan_type', scanType);
+            formData.append('image', capturedImage, 'scan.jpg');
             
-            // Send the request to the server
-            const response = await fetch('/api/health-scan', {
+            // Send the request to the server. The scan runs as a background
+            // job, resolveJobResponse waits for its result
+            const response = await resolveJobResponse(await fetch('/api/health-scan', {
                 method: 'POST',
                 headers: {
-                    'Content-Type': 'application/json'
+                    'Prefer': 'respond-async'
                 },
-                body: JSON.stringify(data)
-            });
+                body: formData
+            }));
             
             if (!response.ok) {
                 throw new Error(`Server responded with ${response.status}: ${response.statusText}`);
@@ -82,6 +82,43 @@ if ('IntersectionObserver' in window) {
     document.addEventListener('DOMContentLoaded', animateOnScroll);
 }
 
+// Resolve a fetch response that may be an accepted background job (202) by
+// polling its status URL. Resolves to a response carrying the job result, so
+// callers handle it like a synchronous response.
+async function resolveJobResponse(response, pollInterval = 1000, timeout = 180000) {
+    if (response.status !== 202) {
+        return response;
+    }
+    
+    const job = await response.json();
+    const deadline = Date.now() + timeout;
+    while (Date.now() < deadline) {
+        await new Promise(resolve => setTimeout(resolve, pollInterval));
+        
+        const statusResponse = await fetch(job.status_url, {
+            headers: { 'Accept': 'application/json' }
+        });
+        if (!statusResponse.ok) {
+            return statusResponse;
+        }
+        
+        const status = await statusResponse.json();
+        if (status.status === 'done') {
+            return new Response(JSON.stringify(status.result), {
+                status: 200,
+                headers: { 'Content-Type': 'application/json' }
+            });
+        }
+        if (status.status === 'error') {
+            return new Response(JSON.stringify({ error: status.error || 'Analysis failed' }), {
+                status: 500,
+                headers: { 'Content-Type': 'application/json' }
+            });
+        }
+    }
+    throw new Error('Timed out waiting for the analysis to finish');
+}
+
 // Add additional ripple styles
 const style = document.createElement('style');
 style.innerHTML = `
@@ -1,37 +1,71 @@
 // Search functionality specific JavaScript
 
 document.addEventListener('DOMContentLoaded', function() {
-    const searchForm = document.querySelector('form[action*="search"]');
+    // The medicine search box is marked data-medicine-search, its input gets
+    // autocomplete when marked data-medicine-suggest (logged in users only)
+    const searchForm = document.querySelector('form[data-medicine-search]');
     const searchInput = searchForm ? searchForm.querySelector('input[name="medicine_name"]') : null;
+    const suggestInput = searchForm ? searchForm.querySelector('input[data-medicine-suggest]') : null;
     
-    // Add search suggestions if input exists
     if (searchInput) {
         // Focus the search input automatically on the home page
         if (window.location.pathname === '/' || window.location.pathname === '/home') {
             searchInput.focus();
         }
         
-        // Add event listener for input to implement autocomplete in the future
-        searchInput.addEventListener('input', function() {
-            const query = this.value.trim();
-            if (query.length >= 3) {
-                // In a real implementation, this would fetch suggestions from the server
-                // For now, we'll just log that this would happen
-                console.log('Would fetch suggestions for:', query);
-            }
-        });
-        
-        // Allow Enter key to submit the form
+        // Allow Enter key to submit the form, through its submit handlers
         searchInput.addEventListener('keydown', function(e) {
             if (e.key === 'Enter') {
                 e.preventDefault();
-                searchForm.submit();
+                if (searchForm.requestSubmit) {
+                    searchForm.requestSubmit();
+                } else {
+                    searchForm.submit();
+                }
             }
         });
     }
     
+    // Add search suggestions if the input offers them
+    if (suggestInput) {
+        // Autocomplete medicine names through a datalist
+        const suggestionList = document.createElement('datalist');
+        suggestionList.id = 'medicine-suggestions';
+        suggestInput.parentNode.appendChild(suggestionList);
+        suggestInput.setAttribute('list', suggestionList.id);
+        suggestInput.setAttribute('autocomplete', 'off');
+        
+        let suggestTimer = null;
+        let suggestRequest = 0;
+        suggestInput.addEventListener('input', function() {
+            const query = this.value.trim();
+            clearTimeout(suggestTimer);
+            if (query.length < 2) {
+                suggestionList.innerHTML = '';
+                return;
+            }
+            
+            // Wait for a pause in typing before asking the server
+            suggestTimer = setTimeout(function() {
+                const requestId = ++suggestRequest;
+                fetchMedicineSuggestions(query).then(suggestions => {
+                    // Ignore responses that arrive after a newer request
+                    if (requestId !== suggestRequest) {
+                        return;
+                    }
+                    suggestionList.innerHTML = '';
+                    suggestions.forEach(name => {
+                        const option = document.createElement('option');
+                        option.value = name;
+                        suggestionList.appendChild(option);
+                    });
+                });
+            }, 150);
+        });
+    }
+    
     // Add loading state to search form on submit
-    if (searchForm) {
+    if (searchForm && searchInput) {
         searchForm.addEventListener('submit', function(e) {
             // Validate input
             const searchValue = searchInput.value.trim();
@@ -66,6 +100,27 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
+    // Forms marked data-stream-search open the streamed results page, so the
+    // answer shows up field by field instead of after the whole lookup.
+    // Without EventSource they are posted as usual
+    document.querySelectorAll('form[data-stream-search]').forEach(form => {
+        form.addEventListener('submit', function(e) {
+            const input = form.querySelector('input[name="medicine_name"]');
+            const query = input ? input.value.trim() : '';
+            if (!query || !window.EventSource) {
+                return;
+            }
+            e.preventDefault();
+            window.location.href = '/search?medicine_name=' + encodeURIComponent(query);
+        });
+    });
+    
+    // Fill in the streamed results page
+    const streamContainer = document.getElementById('medicine-stream');
+    if (streamContainer) {
+        renderStreamingSearch(streamContainer);
+    }
+    
     // Implement collapsible sections in search results if they exist
     const collapsibleHeaders = document.querySelectorAll('.collapsible-header');
     collapsibleHeaders.forEach(header => {
@@ -129,6 +184,15 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 });
 
+// Fetch medicine name suggestions for the search box
+function fetchMedicineSuggestions(query) {
+    // Don't follow a redirect to the login page if the session expired
+    return fetch('/api/medicines/suggest?q=' + encodeURIComponent(query), { redirect: 'manual' })
+        .then(response => response.ok ? response.json() : { suggestions: [] })
+        .then(data => data.suggestions || [])
+        .catch(() => []);
+}
+
 // Function to handle AJAX search if needed
 function performAjaxSearch(query) {
     // This would be used for API-based searching
@@ -157,3 +221,114 @@ function performAjaxSearch(query) {
         };
     });
 }
+
+// Stream medicine information over Server-Sent Events.
+// handlers.onField(name, value) is called for each field as soon as it arrives,
+// handlers.onResult(data) once with the complete result and
+// handlers.onError(data) if the lookup fails. If the connection fails
+// handlers.onDisconnect() is called instead when given.
+function performStreamingSearch(query, handlers) {
+    handlers = handlers || {};
+    const url = '/api/search/stream?medicine_name=' + encodeURIComponent(query);
+    const source = new EventSource(url);
+    
+    source.addEventListener('field', function(e) {
+        const field = JSON.parse(e.data);
+        if (handlers.onField) {
+            handlers.onField(field.name, field.value);
+        }
+    });
+    
+    source.addEventListener('result', function(e) {
+        source.close();
+        if (handlers.onResult) {
+            handlers.onResult(JSON.parse(e.data));
+        }
+    });
+    
+    // Server-sent "error" events carry data, connection failures do not
+    source.addEventListener('error', function(e) {
+        source.close();
+        if (!e.data && handlers.onDisconnect) {
+            handlers.onDisconnect();
+        } else if (handlers.onError) {
+            handlers.onError(e.data ? JSON.parse(e.data) : {
+                error: true,
+                message: 'Search failed'
+            });
+        }
+    });
+    
+    return source;
+}
+
+// Fill the [data-field] elements of the streamed results page as fields
+// arrive. If the stream cannot be opened the page falls back to posting the
+// search form.
+function renderStreamingSearch(container) {
+    const card = document.getElementById('medicine-card');
+    const notFound = document.getElementById('medicine-not-found');
+    const errorAlert = document.getElementById('medicine-stream-error');
+    const spinner = document.getElementById('medicine-stream-spinner');
+    let received = false;
+    
+    function fill(name, value) {
+        // Nested objects such as dosage fill "dosage.timing" and so on
+        if (value && typeof value === 'object' && !Array.isArray(value)) {
+            Object.keys(value).forEach(key => fill(name + '.' + key, value[key]));
+            return;
+        }
+        container.querySelectorAll('[data-field="' + name + '"]').forEach(element => {
+            if (Array.isArray(value)) {
+                element.innerHTML = '';
+                value.forEach(item => {
+                    const li = document.createElement('li');
+                    if (element.dataset.itemClass) {
+                        li.className = element.dataset.itemClass;
+                    }
+                    li.textContent = item;
+                    element.appendChild(li);
+                });
+            } else {
+                element.textContent = value;
+            }
+        });
+    }
+    
+    function done() {
+        if (spinner) {
+            spinner.remove();
+        }
+    }
+    
+    performStreamingSearch(container.dataset.query, {
+        onField: function(name, value) {
+            received = true;
+            fill(name, value);
+        },
+        onResult: function(data) {
+            Object.keys(data).forEach(name => fill(name, data[name]));
+            if (data.found === false) {
+                card.classList.add('d-none');
+                notFound.classList.remove('d-none');
+            }
+            done();
+        },
+        onError: function(data) {
+            done();
+            card.classList.add('d-none');
+            errorAlert.textContent = data.message || data.description || data.error || 'Search failed';
+            errorAlert.classList.remove('d-none');
+        },
+        onDisconnect: function() {
+            done();
+            if (!received) {
+                document.getElementById('medicine-stream-fallback').submit();
+                return;
+            }
+            card.classList.add('d-none');
+            errorAlert.textContent = 'The connection was lost, please search again.';
+            errorAlert.classList.remove('d-none');
+        }
+    });
+}
@@ -1,10 +1,21 @@
 import os
 import json
+import time
+import socket
 import logging
-from datetime import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta
 from openai import OpenAI
-from app import db
-from models import MedicineCache, SearchHistory, DrugInteractionCache, DrugInteractionCheck, UserMedication
+from app import app, db
+from models import MedicineCache, SearchHistory, DrugInteractionCache, DrugInteractionCheck, UserMedication, CacheLease
+from utils_cache import medicine_memory_cache, medicine_single_flight, cache_refresher, upstream_error_cache, openai_calls_avoided
+from utils_drugs import resolve_medicine_name, drug_ingredients, interaction_ingredient_pairs
+from utils_writebehind import search_history_buffer, interaction_check_buffer
+from utils_suggest import medicine_suggest_index
+from utils_interaction_graph import drug_interaction_graph, SEVERITY_RANKS
+from utils_interaction_rules import interaction_rules
+from utils_image import as_image_payload, prepare_for_vision
 
 # Configure OpenAI client 
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
@@ -21,17 +32,57 @@ else:
     logger.warning("OPENAI_API_KEY is not configured. AI features will be limited.")
 logger = logging.getLogger(__name__)
 
+# How long one worker may hold the right to fill a medicine cache entry
+MEDICINE_LEASE_TTL = int(os.environ.get("MEDICINE_LEASE_TTL", 30))  # seconds
+LEASE_POLL_INTERVAL = 0.25  # seconds
+
+# Multi-drug interaction checks: at most this many OpenAI calls run at once
+# for one request, and whatever is unresolved after the deadline is reported
+# as incomplete
+INTERACTION_CONCURRENCY = int(os.environ.get("INTERACTION_CONCURRENCY", 4))
+INTERACTION_DEADLINE = float(os.environ.get("INTERACTION_DEADLINE", 25))  # seconds
+# Uncached pairs are analysed together in one prompt per chunk of this many
+# pairs, falling back to one prompt per pair for anything the batch misses
+INTERACTION_BATCH_MODE = os.environ.get("INTERACTION_BATCH_MODE", "1") == "1"
+INTERACTION_BATCH_SIZE = int(os.environ.get("INTERACTION_BATCH_SIZE", 10))
+INTERACTION_SEVERITIES = ["none", "mild", "moderate", "severe", "unknown"]
+# Limits for the batch drug interaction API
+INTERACTION_API_MAX_PAIRS = int(os.environ.get("INTERACTION_API_MAX_PAIRS", 200))
+INTERACTION_API_DEADLINE = float(os.environ.get("INTERACTION_API_DEADLINE", 60))  # seconds
+# Pairs a user can check through the batch API in a rolling hour
+INTERACTION_API_PAIRS_PER_HOUR = int(os.environ.get("INTERACTION_API_PAIRS_PER_HOUR", 1000))
+
 def get_medicine_info(medicine_name, user=None):
     """
     Get information about a medicine using OpenAI API with caching
+    
+    Brand names, misspellings, strengths and dosage forms are resolved to a
+    canonical name first, so they all share one cache entry.
     """
-    # Check cache first
-    cached_data = MedicineCache.get_cached_data(medicine_name)
-    if cached_data:
+    canonical_name = resolve_medicine_name(medicine_name)
+    
+    # Check the in-process cache first, this never touches the database
+    cached_result = medicine_memory_cache.get(canonical_name)
+    if cached_result is not None:
+        _count_negative_medicine_hit(cached_result)
+        if user:
+            record_search(user.id, medicine_name)
+        return cached_result
+    
+    # Fall back to the database cache, serving stale entries while they
+    # are refreshed in the background
+    cached_data, is_stale = MedicineCache.get_cached_entry(canonical_name)
+    if cached_data is not None:
+        result = cached_data
+        medicine_memory_cache.set(canonical_name, result)
+        _count_negative_medicine_hit(result)
+        if is_stale:
+            _queue_medicine_refresh(canonical_name)
+        
         # Record search if user is provided
         if user:
             record_search(user.id, medicine_name)
-        return json.loads(cached_data)
+        return result
     
     # Check if OpenAI client is available
     if not openai or not OPENAI_API_KEY:
@@ -39,73 +90,22 @@ def get_medicine_info(medicine_name, user=None):
         if user:
             record_search(user.id, medicine_name)
             
-        return {
-            "name": medicine_name,
-            "description": "OpenAI API key is not configured. Please contact the administrator to set up the API key.",
-            "useCases": ["API key required for detailed information"],
-            "pros": ["Contact administrator to enable this feature"],
-            "cons": ["API key missing"],
-            "dosage": {
-                "timing": "Not available",
-                "duration": "Not available",
-                "breaks": "Not available"
-            },
-            "warnings": ["This feature requires an OpenAI API key to function properly."],
-            "found": False,
-            "error": "API key not configured"
-        }
+        return _medicine_api_key_missing_result(medicine_name)
     
-    # No cache hit, use OpenAI
+    # Don't retry a lookup that just failed, e.g. during an OpenAI outage
+    error_result = upstream_error_cache.get(f"medicine:{canonical_name}")
+    if error_result is not None:
+        openai_calls_avoided.incr("medicine_upstream_error")
+        return error_result
+    
+    # No cache hit, use OpenAI. Concurrent lookups of the same medicine in
+    # this worker share a single call.
     try:
-        response = openai.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[
-                {
-                    "role": "system",
-                    "content": """You are a pharmaceutical information assistant. 
-                    Provide detailed, accurate information about medications. 
-                    Your response should be well-structured, medically accurate, and include:
-                    1. General description of the medication
-                    2. Use cases and conditions it treats
-                    3. Pros/benefits of the medication
-                    4. Cons/side effects
-                    5. Dosage guidelines (when to take, how long, breaks needed)
-                    6. Important warnings and contraindications
-                    7. Disclaimer about consulting healthcare professionals
-
-                    If the medicine name is unknown or unclear, provide a clear message stating that you don't have information about it and suggest checking the spelling or consulting a healthcare professional.
-                    
-                    Return your response in JSON format with the following structure:
-                    {
-                        "name": "Full medication name",
-                        "description": "General description",
-                        "useCases": ["list", "of", "use cases"],
-                        "pros": ["list", "of", "benefits"],
-                        "cons": ["list", "of", "side effects"],
-                        "dosage": {
-                            "timing": "When to take",
-                            "duration": "How long to take",
-                            "breaks": "Any breaks needed"
-                        },
-                        "warnings": ["list", "of", "warnings"],
-                        "found": true/false (whether the medicine was found)
-                    }
-                    """
-                },
-                {
-                    "role": "user",
-                    "content": f"Provide information about the medication: {medicine_name}"
-                }
-            ],
-            response_format={"type": "json_object"},
-            max_tokens=1000
+        result = medicine_single_flight.do(
+            canonical_name,
+            lambda: _fill_medicine_cache(canonical_name)
         )
         
-        result = json.loads(response.choices[0].message.content)
-        
-        # Cache the result
-        MedicineCache.update_cache(medicine_name, json.dumps(result))
-        
         # Record search if user is provided
         if user:
             record_search(user.id, medicine_name)
@@ -114,27 +114,400 @@ def get_medicine_info(medicine_name, user=None):
         
     except Exception as e:
         logger.error(f"Error getting medicine info: {str(e)}")
-        return {
-            "name": medicine_name,
-            "description": "Error retrieving medicine information",
-            "useCases": [],
-            "pros": [],
-            "cons": [],
-            "dosage": {
-                "timing": "Unknown",
-                "duration": "Unknown",
-                "breaks": "Unknown"
-            },
-            "warnings": ["Information could not be retrieved."],
-            "found": False,
-            "error": str(e)
+        error_result = _medicine_error_result(medicine_name, e)
+        upstream_error_cache.set(f"medicine:{canonical_name}", error_result)
+        return error_result
+
+def _count_negative_medicine_hit(result):
+    """Count a cached "not found" answer served instead of asking OpenAI again"""
+    if MedicineCache.is_negative_payload(result):
+        openai_calls_avoided.incr("medicine_not_found")
+
+def refresh_medicine_info(medicine_name):
+    """
+    Fetch fresh medicine info from OpenAI and overwrite the cache entry,
+    even if the cached one has not expired yet
+    """
+    canonical_name = resolve_medicine_name(medicine_name)
+    return medicine_single_flight.do(
+        canonical_name,
+        lambda: _fetch_and_cache_medicine_info(canonical_name)
+    )
+
+def _queue_medicine_refresh(medicine_name):
+    """Revalidate a stale medicine cache entry without making the user wait"""
+    if not openai or not OPENAI_API_KEY:
+        return
+    
+    def refresh():
+        with app.app_context():
+            medicine_single_flight.do(
+                medicine_name,
+                lambda: _fill_medicine_cache(medicine_name)
+            )
+    
+    cache_refresher.submit(f"medicine:{medicine_name}", refresh)
+
+def _medicine_api_key_missing_result(medicine_name):
+    """Placeholder medicine info returned when OpenAI is not configured"""
+    return {
+        "name": medicine_name,
+        "description": "OpenAI API key is not configured. Please contact the administrator to set up the API key.",
+        "useCases": ["API key required for detailed information"],
+        "pros": ["Contact administrator to enable this feature"],
+        "cons": ["API key missing"],
+        "dosage": {
+            "timing": "Not available",
+            "duration": "Not available",
+            "breaks": "Not available"
+        },
+        "warnings": ["This feature requires an OpenAI API key to function properly."],
+        "found": False,
+        "error": "API key not configured"
+    }
+
+def _medicine_error_result(medicine_name, error):
+    """Placeholder medicine info returned when the OpenAI lookup fails"""
+    return {
+        "name": medicine_name,
+        "description": "Error retrieving medicine information",
+        "useCases": [],
+        "pros": [],
+        "cons": [],
+        "dosage": {
+            "timing": "Unknown",
+            "duration": "Unknown",
+            "breaks": "Unknown"
+        },
+        "warnings": ["Information could not be retrieved."],
+        "found": False,
+        "error": str(error)
+    }
+
+def _lease_owner():
+    """Identify this worker thread as the holder of a cache lease"""
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+def _fill_medicine_cache(medicine_name):
+    """
+    Fetch medicine info from OpenAI and cache it under its canonical name.
+    
+    Only one worker at a time fetches a given medicine; the others wait for
+    the row it writes to MedicineCache instead of making their own call.
+    """
+    lease_key = f"medicine:{medicine_name}"
+    owner = _lease_owner()
+    
+    if not CacheLease.acquire(lease_key, owner, MEDICINE_LEASE_TTL):
+        result = _wait_for_medicine_cache(medicine_name, lease_key)
+        if result is not None:
+            return result
+        # The other worker gave up or died without caching, fetch it ourselves
+        return _fetch_and_cache_medicine_info(medicine_name)
+    
+    try:
+        # Another worker may have filled the cache since our first lookup
+        cached_data = MedicineCache.get_cached_data(medicine_name)
+        if cached_data is not None:
+            result = cached_data
+            medicine_memory_cache.set(medicine_name, result)
+            return result
+        
+        return _fetch_and_cache_medicine_info(medicine_name)
+    finally:
+        CacheLease.release(lease_key, owner)
+
+def _wait_for_medicine_cache(medicine_name, lease_key):
+    """Poll MedicineCache until the lease holder writes the entry or gives up"""
+    deadline = time.monotonic() + MEDICINE_LEASE_TTL
+    while time.monotonic() < deadline:
+        time.sleep(LEASE_POLL_INTERVAL)
+        
+        # End the read transaction so commits from other workers are visible
+        db.session.rollback()
+        cached_data = MedicineCache.get_cached_data(medicine_name)
+        if cached_data is not None:
+            result = cached_data
+            medicine_memory_cache.set(medicine_name, result)
+            return result
+        
+        if not CacheLease.is_held(lease_key):
+            break
+    return None
+
+def _medicine_info_messages(medicine_name):
+    """Build the chat messages used to ask OpenAI about a medicine"""
+    return [
+        {
+            "role": "system",
+            "content": """You are a pharmaceutical information assistant. 
+            Provide detailed, accurate information about medications. 
+            Your response should be well-structured, medically accurate, and include:
+            1. General description of the medication
+            2. Use cases and conditions it treats
+            3. Pros/benefits of the medication
+            4. Cons/side effects
+            5. Dosage guidelines (when to take, how long, breaks needed)
+            6. Important warnings and contraindications
+            7. Disclaimer about consulting healthcare professionals
+
+            If the medicine name is unknown or unclear, provide a clear message stating that you don't have information about it and suggest checking the spelling or consulting a healthcare professional.
+            
+            Return your response in JSON format with the following structure:
+            {
+                "name": "Full medication name",
+                "description": "General description",
+                "useCases": ["list", "of", "use cases"],
+                "pros": ["list", "of", "benefits"],
+                "cons": ["list", "of", "side effects"],
+                "dosage": {
+                    "timing": "When to take",
+                    "duration": "How long to take",
+                    "breaks": "Any breaks needed"
+                },
+                "warnings": ["list", "of", "warnings"],
+                "found": true/false (whether the medicine was found)
+            }
+            """
+        },
+        {
+            "role": "user",
+            "content": f"Provide information about the medication: {medicine_name}"
         }
+    ]
+
+def _fetch_and_cache_medicine_info(medicine_name):
+    """Call OpenAI for a medicine and store the result in both cache tiers"""
+    response = openai.chat.completions.create(
+        model=MODEL_NAME,
+        messages=_medicine_info_messages(medicine_name),
+        response_format={"type": "json_object"},
+        max_tokens=1000
+    )
+    
+    result = json.loads(response.choices[0].message.content)
+    
+    # Cache the result
+    MedicineCache.update_cache(medicine_name, result)
+    medicine_memory_cache.set(medicine_name, result)
+    if result.get("found", True):
+        medicine_suggest_index.add(medicine_name)
+    
+    return result
+
+def stream_medicine_info(medicine_name, user=None):
+    """
+    Streaming variant of get_medicine_info
+    
+    Yields (event, data) tuples. On a cache miss each top-level field of the
+    OpenAI answer is yielded as a "field" event as soon as it is complete,
+    followed by a "result" event with the assembled medicine info, which is
+    also written to the cache. Cache hits yield the "result" event directly.
+    """
+    canonical_name = resolve_medicine_name(medicine_name)
+    
+    cached_result = medicine_memory_cache.get(canonical_name)
+    if cached_result is None:
+        cached_data, is_stale = MedicineCache.get_cached_entry(canonical_name)
+        if cached_data is not None:
+            cached_result = cached_data
+            medicine_memory_cache.set(canonical_name, cached_result)
+            if is_stale:
+                _queue_medicine_refresh(canonical_name)
+    
+    if cached_result is not None:
+        _count_negative_medicine_hit(cached_result)
+        if user:
+            record_search(user.id, medicine_name)
+        yield "result", cached_result
+        return
+    
+    if not openai or not OPENAI_API_KEY:
+        if user:
+            record_search(user.id, medicine_name)
+        yield "result", _medicine_api_key_missing_result(medicine_name)
+        return
+    
+    error_result = upstream_error_cache.get(f"medicine:{canonical_name}")
+    if error_result is not None:
+        openai_calls_avoided.incr("medicine_upstream_error")
+        yield "error", error_result
+        return
+    
+    # Concurrent lookups of the same medicine in this worker share one
+    # OpenAI call: the leader streams it, the others get its result
+    call, is_leader = medicine_single_flight.join(canonical_name)
+    try:
+        if is_leader:
+            try:
+                result = yield from _stream_medicine_cache(canonical_name)
+            except Exception as e:
+                medicine_single_flight.finish(canonical_name, call, error=e)
+                raise
+            except BaseException:
+                # The client went away, the followers fetch it themselves
+                medicine_single_flight.abandon(canonical_name, call)
+                raise
+            medicine_single_flight.finish(canonical_name, call, result=result)
+        else:
+            result = medicine_single_flight.wait(call)
+            if call.abandoned:
+                result = medicine_single_flight.do(
+                    canonical_name,
+                    lambda: _fill_medicine_cache(canonical_name)
+                )
+        
+        if user:
+            record_search(user.id, medicine_name)
+            
+        yield "result", result
+        
+    except Exception as e:
+        logger.error(f"Error streaming medicine info: {str(e)}")
+        error_result = _medicine_error_result(medicine_name, e)
+        upstream_error_cache.set(f"medicine:{canonical_name}", error_result)
+        yield "error", error_result
+
+def _stream_medicine_cache(medicine_name):
+    """
+    Streaming variant of _fill_medicine_cache
+    
+    Yields ("field", ...) events while this worker streams the answer from
+    OpenAI and returns the medicine info. Holds the same CacheLease, so a
+    medicine another worker is already fetching is waited for instead.
+    """
+    lease_key = f"medicine:{medicine_name}"
+    owner = _lease_owner()
+    
+    if not CacheLease.acquire(lease_key, owner, MEDICINE_LEASE_TTL):
+        result = _wait_for_medicine_cache(medicine_name, lease_key)
+        if result is not None:
+            return result
+        # The other worker gave up or died without caching, fetch it ourselves
+        return (yield from _stream_and_cache_medicine_info(medicine_name))
+    
+    try:
+        # Another worker may have filled the cache since our first lookup
+        cached_data = MedicineCache.get_cached_data(medicine_name)
+        if cached_data is not None:
+            medicine_memory_cache.set(medicine_name, cached_data)
+            return cached_data
+        
+        return (yield from _stream_and_cache_medicine_info(medicine_name))
+    finally:
+        CacheLease.release(lease_key, owner)
+
+def _stream_and_cache_medicine_info(medicine_name):
+    """Stream a medicine from OpenAI, yielding fields, then cache and return it"""
+    stream = openai.chat.completions.create(
+        model=MODEL_NAME,
+        messages=_medicine_info_messages(medicine_name),
+        response_format={"type": "json_object"},
+        max_tokens=1000,
+        stream=True
+    )
+    
+    parser = JSONFieldStream()
+    content = []
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if not delta:
+            continue
+        content.append(delta)
+        for name, value in parser.feed(delta):
+            yield "field", {"name": name, "value": value}
+    
+    result = json.loads("".join(content))
+    
+    # Cache the assembled result exactly like the non-streaming path
+    MedicineCache.update_cache(medicine_name, result)
+    medicine_memory_cache.set(medicine_name, result)
+    if result.get("found", True):
+        medicine_suggest_index.add(medicine_name)
+    
+    return result
+
+class JSONFieldStream:
+    """
+    Incrementally extract complete top-level fields from a JSON object whose
+    text arrives in chunks, e.g. from a streamed chat completion.
+    """
+    WHITESPACE = " \t\n\r"
+    
+    def __init__(self):
+        self._buffer = ""
+        self._pos = None
+        self._decoder = json.JSONDecoder()
+    
+    def _skip(self, pos, chars):
+        while pos < len(self._buffer) and self._buffer[pos] in chars:
+            pos += 1
+        return pos
+    
+    def feed(self, text):
+        """Add a chunk of text, returns a list of newly completed (name, value) pairs"""
+        self._buffer += text
+        fields = []
+        
+        if self._pos is None:
+            start = self._buffer.find("{")
+            if start < 0:
+                return fields
+            self._pos = start + 1
+        
+        while True:
+            pos = self._skip(self._pos, self.WHITESPACE + ",")
+            if pos >= len(self._buffer) or self._buffer[pos] == "}":
+                break
+            try:
+                name, pos = self._decoder.raw_decode(self._buffer, pos)
+                pos = self._skip(pos, self.WHITESPACE)
+                if pos >= len(self._buffer) or self._buffer[pos] != ":":
+                    break
+                pos = self._skip(pos + 1, self.WHITESPACE)
+                value, end = self._decoder.raw_decode(self._buffer, pos)
+            except ValueError:
+                # The field is not complete yet
+                break
+            
+            # A number at the very end of the buffer may still be growing
+            if end >= len(self._buffer) and isinstance(value, (int, float)) and not isinstance(value, bool):
+                break
+            
+            fields.append((name, value))
+            self._pos = end
+        
+        return fields
 
 def record_search(user_id, query):
-    """Record a search in the user's search history"""
-    search_entry = SearchHistory(user_id=user_id, query=query)
-    db.session.add(search_entry)
-    db.session.commit()
+    """
+    Record a search in the user's search history
+    
+    Rows are buffered and written in bulk together with the quota
+    counters. Quota checks include this worker's buffered rows, see
+    SearchHistoryBuffer for the slack across workers.
+    """
+    search_history_buffer.record(user_id, query)
+
+def get_remaining_interaction_checks(user_id):
+    """
+    Return how many more pairs a user can check through the batch API
+    
+    Every checked pair leaves a DrugInteractionCheck row, so the rows of the
+    last hour, committed or buffered in this worker, are what the user has
+    used. Repeats of a recent identical check are coalesced into one row and
+    cost nothing, they are answered from the cache. Like the search quota a
+    user can overshoot by the checks still buffered on other workers.
+    """
+    since = datetime.utcnow() - timedelta(hours=1)
+    checks = db.session.query(DrugInteractionCheck).filter(
+        DrugInteractionCheck.user_id == user_id,
+        DrugInteractionCheck.check_date >= since
+    ).count()
+    checks += interaction_check_buffer.pending_count(user_id, since)
+    return max(0, INTERACTION_API_PAIRS_PER_HOUR - checks)
 
 def init_admin_account():
     """Create an admin account if none exists"""
@@ -167,6 +540,10 @@ def check_drug_interaction(drug1, drug2, user=None):
     """
     Check for potential interactions between two drugs using OpenAI API with caching
     
+    Both drugs are resolved to their active ingredients first, so brand
+    names, strengths and combination products share ingredient-level cache
+    entries.
+    
     Args:
         drug1 (str): First medication name
         drug2 (str): Second medication name
@@ -175,10 +552,43 @@ def check_drug_interaction(drug1, drug2, user=None):
     Returns:
         dict: Dictionary containing interaction details
     """
-    # Check cache first
-    cached_data = DrugInteractionCache.get_cached_interaction(drug1, drug2)
-    if cached_data:
-        return json.loads(cached_data)
+    ingredient_pairs, shared = interaction_ingredient_pairs(drug1, drug2)
+    checks = [_check_ingredient_pair(ingredient1, ingredient2) for ingredient1, ingredient2 in ingredient_pairs]
+    result = _merge_interactions(drug1, drug2, [interaction for interaction, _ in checks], shared)
+    
+    # Record interaction check if user is provided and OpenAI was asked
+    if user and any(fetched for _, fetched in checks):
+        interaction_check_buffer.record(
+            user.id,
+            [drug1, drug2],
+            result.get("has_interaction", False),
+            result.get("severity")
+        )
+    
+    return result
+
+
+def _check_ingredient_pair(drug1, drug2):
+    """
+    Check one pair of canonical ingredients, returns (interaction, fetched)
+    
+    fetched is True when the answer came from OpenAI rather than a cache.
+    """
+    # Well-known interactions are answered by the local rules
+    local_result = interaction_rules.get(drug1, drug2)
+    if local_result is not None:
+        return local_result, False
+    
+    # Check the in-memory graph, then the database cache. A stale entry is
+    # returned right away and refreshed in the background
+    cached_data, is_stale = drug_interaction_graph.get(drug1, drug2)
+    if cached_data is None:
+        cached_data, is_stale = DrugInteractionCache.get_cached_entry(drug1, drug2)
+    if cached_data is not None:
+        _count_negative_interaction_hit(cached_data)
+        if is_stale:
+            _queue_interaction_refresh(drug1, drug2)
+        return cached_data, False
     
     # Check if OpenAI client is available
     if not openai or not OPENAI_API_KEY:
@@ -193,87 +603,23 @@ def check_drug_interaction(drug1, drug2, user=None):
             "effects": None,
             "recommendations": None,
             "error": "OpenAI API key is not configured. Please contact the administrator to enable drug interaction features."
-        }
+        }, False
+    
+    # Don't retry a check that just failed, e.g. during an OpenAI outage
+    error_key = f"interaction:{DrugInteractionCache.make_pair_key(drug1, drug2)}"
+    error_result = upstream_error_cache.get(error_key)
+    if error_result is not None:
+        openai_calls_avoided.incr("interaction_upstream_error")
+        return dict(error_result, drug1=drug1, drug2=drug2), False
     
     # No cache hit, use OpenAI
     try:
-        response = openai.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[
-                {
-                    "role": "system",
-                    "content": """You are a pharmaceutical expert specializing in drug interactions.
-                    Analyze potential interactions between the two drugs provided.
-                    
-                    Your response should be comprehensive and include:
-                    1. Whether the drugs have a known interaction
-                    2. The severity of the interaction (none, mild, moderate, severe)
-                    3. The mechanism of interaction
-                    4. Potential effects of the interaction
-                    5. Recommendations for patients
-                    6. A disclaimer about consulting healthcare professionals
-                    
-                    If you don't have sufficient information about one or both drugs, clearly state this.
-                    
-                    Return your response in JSON format with the following structure:
-                    {
-                        "drug1": "First drug name",
-                        "drug2": "Second drug name",
-                        "has_interaction": true/false/null (null if unknown),
-                        "severity": "none/mild/moderate/severe/unknown",
-                        "mechanism": "Description of interaction mechanism",
-                        "effects": ["list", "of", "potential", "effects"],
-                        "recommendations": ["list", "of", "recommendations"],
-                        "disclaimer": "Standard medical disclaimer"
-                    }
-                    """
-                },
-                {
-                    "role": "user",
-                    "content": f"Check for interactions between {drug1} and {drug2}"
-                }
-            ],
-            response_format={"type": "json_object"},
-            max_tokens=1000
-        )
-        
-        result = json.loads(response.choices[0].message.content)
-        
-        # Determine severity for database storage
-        severity = result.get("severity", "unknown").lower()
-        if severity not in ["none", "mild", "moderate", "severe"]:
-            severity = "unknown"
-            
-        # Create a description for database storage
-        description = None
-        if result.get("effects") and isinstance(result["effects"], list):
-            description = "; ".join(result["effects"])
-        
-        # Cache the result
-        DrugInteractionCache.update_cache(
-            drug1, 
-            drug2, 
-            json.dumps(result),
-            severity,
-            description
-        )
-        
-        # Record interaction check if user is provided
-        if user:
-            check_record = DrugInteractionCheck(
-                user_id=user.id,
-                medications=json.dumps([drug1, drug2]),
-                has_interactions=result.get("has_interaction", False),
-                highest_severity=severity
-            )
-            db.session.add(check_record)
-            db.session.commit()
-            
-        return result
+        result, _ = _fetch_and_cache_interaction(drug1, drug2)
+        return result, True
         
     except Exception as e:
         logger.error(f"Error checking drug interaction: {str(e)}")
-        return {
+        error_result = {
             "drug1": drug1,
             "drug2": drug2,
             "has_interaction": None,
@@ -284,6 +630,460 @@ def check_drug_interaction(drug1, drug2, user=None):
             "disclaimer": "Always consult healthcare professionals for medical advice",
             "error": str(e)
         }
+        upstream_error_cache.set(error_key, error_result)
+        return error_result, False
+
+
+def _merge_interactions(drug1, drug2, interactions, shared_ingredients=()):
+    """
+    Combine ingredient-level interactions into the result for a drug pair
+    
+    A single ingredient pair is returned as is, labelled with the requested
+    names. Otherwise the worst severity wins, the details of each ingredient
+    pair are concatenated, and an active ingredient in both drugs is
+    reported as a risk of doubling the dose.
+    """
+    if len(interactions) == 1 and not shared_ingredients:
+        return dict(interactions[0], drug1=drug1, drug2=drug2)
+    
+    parts = list(interactions)
+    if shared_ingredients:
+        parts.append(_shared_ingredient_result(shared_ingredients))
+    
+    if any(part.get("has_interaction") for part in parts):
+        has_interaction = True
+        severity = "none"
+        for part in parts:
+            part_severity = (part.get("severity") or "unknown").lower()
+            if part.get("has_interaction") and SEVERITY_RANKS.get(part_severity, 0) > SEVERITY_RANKS[severity]:
+                severity = part_severity
+    elif any(part.get("has_interaction") is None for part in parts):
+        has_interaction, severity = None, "unknown"
+    else:
+        has_interaction, severity = False, "none"
+    
+    merged = {
+        "drug1": drug1,
+        "drug2": drug2,
+        "has_interaction": has_interaction,
+        "severity": severity,
+        "mechanism": " ".join(
+            f"{part['drug1']} + {part['drug2']}: {part['mechanism']}"
+            for part in parts if part.get("mechanism")
+        ) or None,
+        "effects": list(dict.fromkeys(effect for part in parts for effect in part.get("effects") or [])),
+        "recommendations": list(dict.fromkeys(
+            recommendation for part in parts for recommendation in part.get("recommendations") or []
+        )),
+        "disclaimer": next((part["disclaimer"] for part in parts if part.get("disclaimer")), None),
+        "ingredient_interactions": parts
+    }
+    if all(part.get("source") == "local" for part in interactions):
+        merged["source"] = "local"
+    errors = [part["error"] for part in interactions if part.get("error")]
+    if errors:
+        merged["error"] = errors[0]
+    return merged
+
+
+def _shared_ingredient_result(ingredients):
+    """Interaction entry for two drugs that contain the same active ingredients"""
+    names = ", ".join(ingredients)
+    return {
+        "drug1": names,
+        "drug2": names,
+        "has_interaction": True,
+        "severity": "moderate",
+        "mechanism": f"Both medications contain {names}, so taking them together adds up the dose.",
+        "effects": [f"Risk of taking too much {names}"],
+        "recommendations": ["Do not take these together unless your doctor or pharmacist has advised it"],
+        "disclaimer": "Always consult healthcare professionals for medical advice"
+    }
+
+
+def known_interactions_with(medication, medications):
+    """
+    Return [(medication, severity)] for the medications known to interact
+    with medication, worst first, from the local rules and the in-memory
+    interaction graph only
+    """
+    owners = {}
+    for other in medications:
+        for ingredient in drug_ingredients(other):
+            owners.setdefault(ingredient, []).append(other)
+    
+    worst = {}
+    for ingredient in drug_ingredients(medication):
+        known = interaction_rules.interacting_with(ingredient, owners)
+        known += drug_interaction_graph.interacting_with(ingredient, owners)
+        for other_ingredient, severity in known:
+            for other in owners[other_ingredient]:
+                if SEVERITY_RANKS.get(severity, 0) >= SEVERITY_RANKS.get(worst.get(other), -1):
+                    worst[other] = severity
+    return sorted(worst.items(), key=lambda item: -SEVERITY_RANKS.get(item[1], 0))
+
+
+def _count_negative_interaction_hit(interaction):
+    """Count a cached "unknown" answer served instead of asking OpenAI again"""
+    if DrugInteractionCache.is_negative_payload(interaction):
+        openai_calls_avoided.incr("interaction_unknown")
+
+
+def _fetch_and_cache_interaction(drug1, drug2):
+    """Ask OpenAI about a drug pair and cache the answer, returns (result, severity)"""
+    response = openai.chat.completions.create(
+        model=MODEL_NAME,
+        messages=[
+            {
+                "role": "system",
+                "content": """You are a pharmaceutical expert specializing in drug interactions.
+                Analyze potential interactions between the two drugs provided.
+                
+                Your response should be comprehensive and include:
+                1. Whether the drugs have a known interaction
+                2. The severity of the interaction (none, mild, moderate, severe)
+                3. The mechanism of interaction
+                4. Potential effects of the interaction
+                5. Recommendations for patients
+                6. A disclaimer about consulting healthcare professionals
+                
+                If you don't have sufficient information about one or both drugs, clearly state this.
+                
+                Return your response in JSON format with the following structure:
+                {
+                    "drug1": "First drug name",
+                    "drug2": "Second drug name",
+                    "has_interaction": true/false/null (null if unknown),
+                    "severity": "none/mild/moderate/severe/unknown",
+                    "mechanism": "Description of interaction mechanism",
+                    "effects": ["list", "of", "potential", "effects"],
+                    "recommendations": ["list", "of", "recommendations"],
+                    "disclaimer": "Standard medical disclaimer"
+                }
+                """
+            },
+            {
+                "role": "user",
+                "content": f"Check for interactions between {drug1} and {drug2}"
+            }
+        ],
+        response_format={"type": "json_object"},
+        max_tokens=1000
+    )
+    
+    result = json.loads(response.choices[0].message.content)
+    severity = _store_interaction(drug1, drug2, result)
+    return result, severity
+
+
+def _store_interaction(drug1, drug2, result):
+    """Cache an interaction result for a drug pair, returns its severity"""
+    # Determine severity for database storage
+    severity = (result.get("severity") or "unknown").lower()
+    if severity not in ["none", "mild", "moderate", "severe"]:
+        severity = "unknown"
+        
+    # Create a description for database storage
+    description = None
+    if result.get("effects") and isinstance(result["effects"], list):
+        description = "; ".join(str(effect) for effect in result["effects"])
+    
+    # Cache the result
+    DrugInteractionCache.update_cache(
+        drug1, 
+        drug2, 
+        result,
+        severity,
+        description
+    )
+    
+    return severity
+
+
+# Structured output schema for batch interaction analysis
+INTERACTION_BATCH_SCHEMA = {
+    "name": "drug_interactions",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "interactions": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "drug1": {"type": "string"},
+                        "drug2": {"type": "string"},
+                        "has_interaction": {"type": ["boolean", "null"]},
+                        "severity": {"type": "string", "enum": INTERACTION_SEVERITIES},
+                        "mechanism": {"type": "string"},
+                        "effects": {"type": "array", "items": {"type": "string"}},
+                        "recommendations": {"type": "array", "items": {"type": "string"}},
+                        "disclaimer": {"type": "string"}
+                    },
+                    "required": ["drug1", "drug2", "has_interaction", "severity", "mechanism",
+                                 "effects", "recommendations", "disclaimer"],
+                    "additionalProperties": False
+                }
+            }
+        },
+        "required": ["interactions"],
+        "additionalProperties": False
+    }
+}
+
+
+def _fetch_and_cache_interaction_batch(pairs):
+    """
+    Ask OpenAI about several drug pairs in one request and cache the answers
+    
+    Returns a dict mapping each requested (drug1, drug2) pair to its result.
+    Pairs missing from the response or failing validation are left out, so
+    the caller can fall back to checking them one by one.
+    """
+    pair_list = "\n".join(f"{i}. {drug1} + {drug2}" for i, (drug1, drug2) in enumerate(pairs, 1))
+    response = openai.chat.completions.create(
+        model=MODEL_NAME,
+        messages=[
+            {
+                "role": "system",
+                "content": """You are a pharmaceutical expert specializing in drug interactions.
+                Analyze potential interactions for every pair of drugs listed by the user.
+                
+                Return exactly one entry per listed pair, using the drug names as given, with:
+                1. Whether the drugs have a known interaction (null if unknown)
+                2. The severity of the interaction (none, mild, moderate, severe, unknown)
+                3. The mechanism of interaction
+                4. Potential effects of the interaction
+                5. Recommendations for patients
+                6. A disclaimer about consulting healthcare professionals
+                
+                If you don't have sufficient information about a drug, clearly state this
+                in the mechanism and use severity "unknown".
+                """
+            },
+            {
+                "role": "user",
+                "content": f"Check for interactions between each of these drug pairs:\n{pair_list}"
+            }
+        ],
+        response_format={"type": "json_schema", "json_schema": INTERACTION_BATCH_SCHEMA},
+        max_tokens=min(16000, 400 * len(pairs) + 200)
+    )
+    
+    content = json.loads(response.choices[0].message.content)
+    entries = content.get("interactions") if isinstance(content, dict) else None
+    if not isinstance(entries, list):
+        raise ValueError("Batch interaction response has no interactions list")
+    
+    # Match entries to the requested pairs regardless of name order or case
+    requested = {
+        tuple(sorted([drug1.strip().lower(), drug2.strip().lower()])): (drug1, drug2)
+        for drug1, drug2 in pairs
+    }
+    results = {}
+    for entry in entries:
+        if not _is_valid_batch_interaction(entry):
+            continue
+        pair = requested.get(tuple(sorted([entry["drug1"].strip().lower(), entry["drug2"].strip().lower()])))
+        if pair is None or pair in results:
+            continue
+        
+        result = dict(entry, drug1=pair[0], drug2=pair[1], severity=entry["severity"].lower())
+        _store_interaction(pair[0], pair[1], result)
+        results[pair] = result
+    
+    return results
+
+
+def _is_valid_batch_interaction(entry):
+    """Check one entry of a batch response has the fields a single check returns"""
+    if not isinstance(entry, dict):
+        return False
+    if not isinstance(entry.get("drug1"), str) or not isinstance(entry.get("drug2"), str):
+        return False
+    if entry.get("has_interaction") not in (True, False, None):
+        return False
+    if not isinstance(entry.get("severity"), str) or entry["severity"].lower() not in INTERACTION_SEVERITIES:
+        return False
+    for field in ("effects", "recommendations"):
+        if not isinstance(entry.get(field), list):
+            return False
+    return True
+
+def _queue_interaction_refresh(drug1, drug2):
+    """Revalidate a stale drug interaction cache entry without making the user wait"""
+    if not openai or not OPENAI_API_KEY:
+        return
+    
+    def refresh():
+        with app.app_context():
+            _fetch_and_cache_interaction(drug1, drug2)
+    
+    cache_refresher.submit(f"interaction:{DrugInteractionCache.make_pair_key(drug1, drug2)}", refresh)
+
+
+def _check_interaction_in_app_context(drug1, drug2):
+    """Check an ingredient pair on a worker thread with its own session"""
+    with app.app_context():
+        interaction, _ = _check_ingredient_pair(drug1, drug2)
+        return interaction
+
+
+def _check_interaction_batch_in_app_context(pairs):
+    """Run a batch interaction check on a worker thread, returns {} on failure"""
+    with app.app_context():
+        try:
+            return _fetch_and_cache_interaction_batch(pairs)
+        except Exception as e:
+            logger.error(f"Error checking drug interaction batch: {str(e)}")
+            return {}
+
+
+def _resolve_interaction_pairs(pairs, timeout=None):
+    """
+    Yield (pair, interaction) for each drug pair as soon as it is known
+    
+    Medications are resolved to their active ingredients, and a pair is
+    yielded once all of its ingredient pairs are known. Pairs not yielded
+    before the timeout are left out.
+    """
+    expanded = {}
+    waiting = {}
+    for pair in pairs:
+        ingredient_pairs, shared = interaction_ingredient_pairs(*pair)
+        expanded[pair] = (ingredient_pairs, shared)
+        for ingredient_pair in ingredient_pairs:
+            waiting.setdefault(ingredient_pair, []).append(pair)
+        if not ingredient_pairs:
+            # The same medication twice, nothing to look up
+            yield pair, _merge_interactions(pair[0], pair[1], [], shared)
+    
+    results = {}
+    for ingredient_pair, interaction in _resolve_ingredient_pairs(list(waiting), timeout=timeout):
+        results[ingredient_pair] = interaction
+        for pair in waiting[ingredient_pair]:
+            ingredient_pairs, shared = expanded[pair]
+            if all(other in results for other in ingredient_pairs):
+                yield pair, _merge_interactions(
+                    pair[0], pair[1], [results[other] for other in ingredient_pairs], shared
+                )
+
+
+def _resolve_ingredient_pairs(pairs, timeout=None):
+    """
+    Yield (pair, interaction) for each ingredient pair as soon as it is known
+    
+    Pairs covered by the local rules and cache hits are yielded first. The
+    misses are then checked in parallel, at most INTERACTION_CONCURRENCY
+    requests at a time, and yielded as they complete. In batch mode each
+    request covers a chunk of pairs, and pairs a batch fails to answer are
+    retried one by one. Pairs still unresolved after timeout seconds are not
+    yielded; their calls finish in the background and still fill the cache.
+    """
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    
+    local_hits, pairs = interaction_rules.lookup(pairs)
+    for pair, local_result in local_hits.items():
+        yield pair, local_result
+    if not pairs:
+        return
+    
+    # Known pairs come from the in-memory graph, the rest from one database
+    # query. Stale entries count as hits and are refreshed
+    hits, misses = drug_interaction_graph.lookup(pairs)
+    if misses:
+        db_hits, misses = DrugInteractionCache.get_cached_interactions(misses)
+        hits.update(db_hits)
+    for (drug1, drug2), (cached_data, is_stale) in hits.items():
+        _count_negative_interaction_hit(cached_data)
+        if is_stale:
+            _queue_interaction_refresh(drug1, drug2)
+        yield (drug1, drug2), cached_data
+    
+    # Pairs that just failed upstream are answered with the same error
+    remaining = []
+    for drug1, drug2 in misses:
+        error_result = upstream_error_cache.get(f"interaction:{DrugInteractionCache.make_pair_key(drug1, drug2)}")
+        if error_result is not None:
+            openai_calls_avoided.incr("interaction_upstream_error")
+            yield (drug1, drug2), dict(error_result, drug1=drug1, drug2=drug2)
+        else:
+            remaining.append((drug1, drug2))
+    misses = remaining
+    
+    if not misses:
+        return
+    
+    use_batches = INTERACTION_BATCH_MODE and openai and OPENAI_API_KEY and len(misses) > 1
+    executor = ThreadPoolExecutor(
+        max_workers=max(1, min(INTERACTION_CONCURRENCY, len(misses))),
+        thread_name_prefix="interaction-check"
+    )
+    # Maps each future to the pairs it answers and whether it is a batch
+    pending = {}
+    if use_batches:
+        for i in range(0, len(misses), INTERACTION_BATCH_SIZE):
+            chunk = misses[i:i + INTERACTION_BATCH_SIZE]
+            pending[executor.submit(_check_interaction_batch_in_app_context, chunk)] = (chunk, True)
+    else:
+        for pair in misses:
+            pending[executor.submit(_check_interaction_in_app_context, *pair)] = ([pair], False)
+    
+    try:
+        while pending:
+            remaining = max(0, deadline - time.monotonic()) if deadline is not None else None
+            done, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                job_pairs, is_batch = pending.pop(future)
+                if not is_batch:
+                    yield job_pairs[0], future.result()
+                    continue
+                results = future.result()
+                for pair in job_pairs:
+                    if pair in results:
+                        yield pair, results[pair]
+                    else:
+                        pending[executor.submit(_check_interaction_in_app_context, *pair)] = ([pair], False)
+        
+        if pending:
+            unresolved = sum(len(job_pairs) for job_pairs, _ in pending.values())
+            logger.warning(f"Drug interaction deadline expired with {unresolved} pairs unresolved")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _interaction_timeout_result(drug1, drug2):
+    """Placeholder for a pair that could not be checked before the deadline"""
+    return {
+        "drug1": drug1,
+        "drug2": drug2,
+        "has_interaction": None,
+        "severity": "unknown",
+        "mechanism": None,
+        "effects": None,
+        "recommendations": None,
+        "error": "This interaction could not be checked in time. Please try again shortly.",
+        "timed_out": True
+    }
+
+
+def stream_drug_interactions(pairs, timeout=None):
+    """
+    Yield ((drug1, drug2), interaction) for every pair as soon as it is known
+    
+    Cache hits come first, then pairs as they are resolved. Pairs still
+    unresolved after timeout seconds are yielded last as timed out.
+    """
+    resolved = set()
+    for pair, interaction in _resolve_interaction_pairs(pairs, timeout=timeout):
+        resolved.add(pair)
+        yield pair, interaction
+    for pair in pairs:
+        if pair not in resolved:
+            yield pair, _interaction_timeout_result(*pair)
 
 
 def check_multiple_drug_interactions(medications, user=None):
@@ -305,31 +1105,51 @@ def check_multiple_drug_interactions(medications, user=None):
             "has_interactions": False
         }
     
-    interactions = []
+    # Check interactions between each pair of medications, concurrently
+    pairs = _medication_pairs(medications)
+    resolved = dict(_resolve_interaction_pairs(pairs, timeout=INTERACTION_DEADLINE))
+    return _summarize_interactions(medications, pairs, resolved, user)
+
+
+def _medication_pairs(medications):
+    """Every unordered pair of a medication list, in list order"""
+    return [
+        (medications[i], medications[j])
+        for i in range(len(medications))
+        for j in range(i+1, len(medications))
+    ]
+
+
+def _summarize_interactions(medications, pairs, resolved, user=None):
+    """
+    Build the multi-drug result from per-pair interactions and record the check
+    
+    Pairs missing from resolved are reported as not checked in time.
+    """
     highest_severity_rank = 0  # 0=none, 1=mild, 2=moderate, 3=severe
     severity_map = {"none": 0, "mild": 1, "moderate": 2, "severe": 3}
     has_interactions = False
+    partial = len(resolved) < len(pairs)
     
-    # Check interactions between each pair of medications
-    for i in range(len(medications)):
-        for j in range(i+1, len(medications)):
-            drug1 = medications[i]
-            drug2 = medications[j]
-            
-            interaction = check_drug_interaction(drug1, drug2)
-            interactions.append(interaction)
-            
-            # Update highest severity and interaction flag
-            # Check if interaction is None before accessing its attributes
-            if interaction is None:
-                continue
-                
-            severity = interaction.get("severity", "unknown").lower()
-            severity_rank = severity_map.get(severity, 0)
+    interactions = []
+    for drug1, drug2 in pairs:
+        if (drug1, drug2) in resolved:
+            interaction = resolved[(drug1, drug2)]
+        else:
+            interaction = _interaction_timeout_result(drug1, drug2)
+        interactions.append(interaction)
+        
+        # Update highest severity and interaction flag
+        # Check if interaction is None before accessing its attributes
+        if interaction is None:
+            continue
             
-            if interaction.get("has_interaction", False):
-                has_interactions = True
-                highest_severity_rank = max(highest_severity_rank, severity_rank)
+        severity = (interaction.get("severity") or "unknown").lower()
+        severity_rank = severity_map.get(severity, 0)
+        
+        if interaction.get("has_interaction", False):
+            has_interactions = True
+            highest_severity_rank = max(highest_severity_rank, severity_rank)
     
     # Map severity rank back to string
     highest_severity = "none"
@@ -340,45 +1160,44 @@ def check_multiple_drug_interactions(medications, user=None):
     
     # Record interaction check if user is provided
     if user:
-        check_record = DrugInteractionCheck(
-            user_id=user.id,
-            medications=json.dumps(medications),
-            has_interactions=has_interactions,
-            highest_severity=highest_severity
-        )
-        db.session.add(check_record)
-        db.session.commit()
+        interaction_check_buffer.record(user.id, medications, has_interactions, highest_severity)
     
     return {
         "medications": medications,
         "interactions": interactions,
         "highest_severity": highest_severity,
-        "has_interactions": has_interactions
+        "has_interactions": has_interactions,
+        "partial": partial
     }
 
 
-def analyze_health_data(image_path, scan_type='face'):
+def analyze_health_data(image, scan_type='face', user=None):
     """
     Analyze health scan data from image using ML and OpenAI to generate health metrics
     
     Args:
-        image_path (str): Path to the image file to analyze
+        image (ImagePayload, bytes, file or str): Image to analyze, in memory or as a file path
         scan_type (str): Type of scan - 'face', 'tongue', 'eye', or 'skin'
+        user (User, optional): User being scanned, used for the heart age estimate
     
     Returns:
         dict: Dictionary containing health metrics based on scan type
     """
+    try:
+        image = as_image_payload(image)
+    except (OSError, ValueError) as e:
+        logger.error(f"Error reading health scan image: {e}")
+        return {"error": f"Error reading image: {str(e)}"}
+    
     # First, try to use our ML-based heart rate detection for improved accuracy
     try:
-        import cv2
-        import numpy as np
         from ml_heart_rate import get_vital_signs_from_image
         
-        # Read the image for ML processing
-        image = cv2.imread(image_path)
-        if image is not None:
+        # Decode the image for ML processing
+        decoded_image = image.to_cv2()
+        if decoded_image is not None:
             # Use ML to get vital signs
-            ml_results = get_vital_signs_from_image(image)
+            ml_results = get_vital_signs_from_image(decoded_image)
             logger.info(f"ML processing results: {ml_results}")
             
             # If we got valid results, use them
@@ -417,9 +1236,8 @@ def analyze_health_data(image_path, scan_type='face'):
                     estimated_diff = hr_factor + bp_factor
                     
                     # Get user age if available, or use a default of 35
-                    if hasattr(current_user, 'date_of_birth') and current_user.date_of_birth:
-                        from datetime import datetime
-                        user_age = (datetime.utcnow().date() - current_user.date_of_birth).days // 365
+                    if user is not None and getattr(user, 'date_of_birth', None):
+                        user_age = (datetime.utcnow().date() - user.date_of_birth).days // 365
                     else:
                         user_age = 35
                         
@@ -444,12 +1262,6 @@ def analyze_health_data(image_path, scan_type='face'):
 
     # Format the image for analysis
     try:
-        import base64
-        
-        # Read the image file and convert to base64
-        with open(image_path, "rb") as image_file:
-            base64_image = base64.b64encode(image_file.read()).decode('utf-8')
-        
         # Create an OpenAI client to call the API
         client = openai
         
@@ -552,7 +1364,10 @@ def analyze_health_data(image_path, scan_type='face'):
             
         else:
             # Default to face scan if an invalid type is somehow provided
-            return analyze_health_data(image_path, 'face')
+            return analyze_health_data(image, 'face', user)
+        
+        # Send a cropped and downscaled copy rather than the full photo
+        image = prepare_for_vision(image, scan_type)
         
         # Call the OpenAI API with GPT-4 Vision
         response = client.chat.completions.create(
@@ -561,7 +1376,7 @@ def analyze_health_data(image_path, scan_type='face'):
                 {"role": "system", "content": system_role},
                 {"role": "user", "content": [
                     {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
+                    {"type": "image_url", "image_url": {"url": image.data_url}}
                 ]}
             ],
             temperature=0.3,
@@ -646,9 +1461,11 @@ def analyze_health_data(image_path, scan_type='face'):
             "error": f"Error analyzing health data: {str(e)}"
         }
 
-def analyze_food_image(image_path, food_name):
+def analyze_food_image(image, food_name):
     """
     Analyze food image to determine nutritional content
+    
+    image can be an ImagePayload, raw bytes, a file-like object or a file path.
     """
     # Check if OpenAI client is available
     if not openai or not OPENAI_API_KEY:
@@ -657,11 +1474,7 @@ def analyze_food_image(image_path, food_name):
         }
     
     try:
-        # Convert image to base64 for API submission
-        import base64
-        
-        with open(image_path, "rb") as image_file:
-            base64_image = base64.b64encode(image_file.read()).decode('utf-8')
+        image = prepare_for_vision(as_image_payload(image), "food")
         
         response = openai.chat.completions.create(
             model=MODEL_NAME,
@@ -684,7 +1497,7 @@ def analyze_food_image(image_path, food_name):
                     "role": "user",
                     "content": [
                         {"type": "text", "text": f"Analyze this food image. The food is identified as: {food_name}"},
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
+                        {"type": "image_url", "image_url": {"url": image.data_url}}
                     ]
                 }
             ],
@@ -0,0 +1,166 @@
+"""
+Health scan, food scan and diet plan analysis shared by the API routes and
+the background job workers
+"""
+import json
+
+from app import db
+from models import User, HealthScan, FoodScan, BMIRecord
+from utils import analyze_health_data, analyze_food_image, generate_diet_plan
+from utils_image import ImagePayload
+from utils_jobs import job_queue
+from utils_scan_cache import remember_scan
+
+
+def run_health_scan(user, scan_type, image, image_hash=None):
+    """Analyze a health scan image, save the HealthScan and return the result"""
+    result = analyze_health_data(image, scan_type, user)
+
+    # Save the scan to database
+    if result:
+        # Create a base health scan object with common fields
+        new_scan = HealthScan(
+            user_id=user.id,
+            scan_type=scan_type,
+            scan_image_path=None,  # We don't store the actual image
+            wellness_score=result.get('wellness_score')
+        )
+
+        # Add fields specific to each scan type
+        if scan_type == 'face':
+            new_scan.heart_rate = result.get('heart_rate')
+            new_scan.blood_pressure_systolic = result.get('blood_pressure_systolic')
+            new_scan.blood_pressure_diastolic = result.get('blood_pressure_diastolic')
+            new_scan.breathing_rate = result.get('breathing_rate')
+            new_scan.oxygen_saturation = result.get('oxygen_saturation')
+            new_scan.sympathetic_stress = result.get('sympathetic_stress')
+            new_scan.parasympathetic_activity = result.get('parasympathetic_activity')
+            new_scan.prq = result.get('prq')
+            new_scan.hemoglobin = result.get('hemoglobin')
+            new_scan.hemoglobin_a1c = result.get('hemoglobin_a1c')
+            new_scan.ascvd_risk = result.get('ascvd_risk')
+            new_scan.hypertension_risk = result.get('hypertension_risk')
+            new_scan.glucose_risk = result.get('glucose_risk')
+            new_scan.cholesterol_risk = result.get('cholesterol_risk')
+            new_scan.tuberculosis_risk = result.get('tuberculosis_risk')
+            new_scan.heart_age = result.get('heart_age')
+
+        elif scan_type == 'tongue':
+            new_scan.tongue_color = result.get('tongue_color')
+            new_scan.tongue_coating = result.get('tongue_coating')
+            new_scan.tongue_shape = result.get('tongue_shape')
+            new_scan.tcm_diagnosis = result.get('tcm_diagnosis')
+            new_scan.vitamin_deficiency = result.get('vitamin_deficiency')
+            new_scan.infection_indicator = result.get('infection_indicator')
+
+        elif scan_type == 'eye':
+            new_scan.sclera_color = result.get('sclera_color')
+            new_scan.conjunctiva_color = result.get('conjunctiva_color')
+            new_scan.eye_redness = result.get('eye_redness')
+            new_scan.pupil_reactivity = result.get('pupil_reactivity')
+            new_scan.eye_condition = result.get('eye_condition')
+
+        elif scan_type == 'skin':
+            new_scan.skin_color = result.get('skin_color')
+            new_scan.skin_texture = result.get('skin_texture')
+            new_scan.rash_detection = result.get('rash_detection', False)
+            new_scan.rash_pattern = result.get('rash_pattern')
+            new_scan.skin_condition = result.get('skin_condition')
+
+        # Add notes and recommendations
+        if result.get('notes'):
+            new_scan.notes = json.dumps(result.get('notes', {}))
+
+        # Save to database
+        db.session.add(new_scan)
+        db.session.flush()
+
+        # Add the scan ID to the result for reference
+        result['scan_id'] = new_scan.id
+        remember_scan(user.id, scan_type, image_hash, result, health_scan_id=new_scan.id)
+        db.session.commit()
+
+    return result
+
+
+def run_food_scan(user_id, food_name, image, image_hash=None):
+    """Analyze a food image, save the FoodScan and return the result"""
+    result = analyze_food_image(image, food_name)
+
+    # Save the food scan to database
+    if result:
+        new_scan = FoodScan(
+            user_id=user_id,
+            food_name=food_name,
+            calories=result.get('calories'),
+            protein=result.get('protein'),
+            carbs=result.get('carbs'),
+            fat=result.get('fat'),
+            fiber=result.get('fiber'),
+            sugar=result.get('sugar'),
+            sodium=result.get('sodium'),
+            cholesterol=result.get('cholesterol'),
+            food_image_url=None,  # We don't store images for now
+            data=result
+        )
+        db.session.add(new_scan)
+        db.session.flush()
+        remember_scan(user_id, 'food', image_hash, result, food_scan_id=new_scan.id)
+        db.session.commit()
+
+    return result
+
+
+def run_bmi_record(user_id, height, weight, bmi, category, diet_plan_params=None):
+    """
+    Save a BMIRecord and return the BMI result
+
+    diet_plan_params holds the age, gender, is_pregnant and activity_level
+    arguments of generate_diet_plan when a diet plan is needed.
+    """
+    diet_plan = None
+    if diet_plan_params is not None:
+        diet_plan = generate_diet_plan(bmi, category, **diet_plan_params)
+
+    new_record = BMIRecord(
+        user_id=user_id,
+        height=height,
+        weight=weight,
+        bmi_value=bmi,
+        bmi_category=category,
+        diet_plan=diet_plan if diet_plan else None
+    )
+    db.session.add(new_record)
+    db.session.commit()
+
+    return {
+        "bmi": round(bmi, 1),
+        "category": category,
+        "diet_plan": diet_plan
+    }
+
+
+def _job_image(job):
+    return ImagePayload.from_bytes(job.input_image, job.params.get("mime_type"))
+
+
+def _health_scan_job(job):
+    user = db.session.get(User, job.user_id)
+    return run_health_scan(user, job.params["scan_type"], _job_image(job), job.params.get("image_hash"))
+
+
+def _food_scan_job(job):
+    return run_food_scan(job.user_id, job.params["food_name"], _job_image(job), job.params.get("image_hash"))
+
+
+def _diet_plan_job(job):
+    params = job.params
+    return run_bmi_record(
+        job.user_id, params["height"], params["weight"], params["bmi"], params["category"],
+        params["diet_plan_params"]
+    )
+
+
+job_queue.register("health_scan", _health_scan_job)
+job_queue.register("food_scan", _food_scan_job)
+job_queue.register("diet_plan", _diet_plan_job)
@@ -0,0 +1,272 @@
+"""
+In-process caching utilities for MedicineAI
+"""
+import os
+import copy
+import time
+import threading
+import logging
+from collections import OrderedDict, Counter
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Per-worker medicine cache settings
+MEDICINE_LRU_SIZE = int(os.environ.get("MEDICINE_LRU_SIZE", 512))
+MEDICINE_LRU_TTL = int(os.environ.get("MEDICINE_LRU_TTL", 3600))  # seconds
+# Failed OpenAI lookups are answered from memory for this long instead of retried
+UPSTREAM_ERROR_TTL = int(os.environ.get("UPSTREAM_ERROR_TTL", 60))  # seconds
+
+
+class LRUCache:
+    """
+    Thread-safe, bounded LRU cache with a per-entry time to live.
+
+    Each gunicorn worker holds its own instance, so entries are never shared
+    between processes. Values are deep-copied on the way in and out so callers
+    can freely modify what they get back.
+    """
+
+    def __init__(self, max_size=512, ttl=3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the cached value for key, or None if missing or expired"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+
+            self._data.move_to_end(key)
+            self.hits += 1
+        return copy.deepcopy(value)
+
+    def set(self, key, value):
+        """Store a value, evicting the least recently used entries if full"""
+        if self.max_size <= 0:
+            return
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """Remove a single entry"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Remove all entries"""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """Return hit/miss/eviction counters for monitoring"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+# Decoded medicine info dicts, keyed by medicine name
+medicine_memory_cache = LRUCache(max_size=MEDICINE_LRU_SIZE, ttl=MEDICINE_LRU_TTL)
+
+
+# Error results of failed OpenAI lookups, keyed by "medicine:<name>" or
+# "interaction:<drug pair>", so an outage is not retried on every request
+upstream_error_cache = LRUCache(max_size=1024, ttl=UPSTREAM_ERROR_TTL)
+
+
+class EventCounter:
+    """Thread-safe named counters for monitoring"""
+
+    def __init__(self):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._counts[name] += amount
+
+    def stats(self):
+        """Return all counters"""
+        with self._lock:
+            counts = dict(self._counts)
+        counts["total"] = sum(counts.values())
+        return counts
+
+
+# OpenAI calls not made because a negative cache entry answered the lookup
+openai_calls_avoided = EventCounter()
+
+
+class _FlightCall:
+    """A single in-flight call that other threads can wait on"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.abandoned = False
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls for the same key into one execution.
+
+    The first thread to ask for a key runs the function; threads that ask for
+    the same key while it is running block until it finishes and share its
+    result (or its exception).
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    def join(self, key):
+        """
+        Join the call for key, returns (call, is_leader)
+
+        For callers that cannot run their work inside do(), e.g. generators:
+        the leader must pass its outcome to finish() or abandon(), the others
+        wait() for it.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.followers += 1
+                return call, False
+            call = _FlightCall()
+            self._calls[key] = call
+            self.leaders += 1
+            return call, True
+
+    def wait(self, call):
+        """Wait for the leader of a joined call and return its result, None if abandoned"""
+        call.event.wait()
+        if call.error is not None:
+            raise call.error
+        return copy.deepcopy(call.result)
+
+    def finish(self, key, call, result=None, error=None):
+        """Hand the leader's result or exception to the waiting callers"""
+        call.result = result
+        call.error = error
+        with self._lock:
+            self._calls.pop(key, None)
+        call.event.set()
+
+    def abandon(self, key, call):
+        """Give up leading a joined call without an outcome, e.g. on shutdown"""
+        call.abandoned = True
+        self.finish(key, call)
+
+    def do(self, key, fn):
+        call, is_leader = self.join(key)
+        if not is_leader:
+            result = self.wait(call)
+            if call.abandoned:
+                return self.do(key, fn)
+            return result
+
+        try:
+            result = fn()
+        except Exception as e:
+            self.finish(key, call, error=e)
+            raise
+        except BaseException:
+            # Don't leave the other callers waiting, they run fn themselves
+            self.abandon(key, call)
+            raise
+        self.finish(key, call, result=result)
+        return result
+
+    def stats(self):
+        """Return leader/follower counters for monitoring"""
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "leaders": self.leaders,
+                "followers": self.followers
+            }
+
+
+# Coalesces concurrent OpenAI lookups for the same medicine within a worker
+medicine_single_flight = SingleFlight()
+
+
+class BackgroundRefresher:
+    """
+    Run cache refreshes on a small thread pool, at most one per key at a time.
+
+    Used to revalidate stale cache entries after the stale value has already
+    been returned to the user.
+    """
+
+    def __init__(self, max_workers=2):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="cache-refresh")
+        self._pending = set()
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def submit(self, key, fn):
+        """Queue fn unless a refresh for key is already queued or running"""
+        with self._lock:
+            if key in self._pending:
+                self.skipped += 1
+                return False
+            self._pending.add(key)
+            self.queued += 1
+        self._executor.submit(self._run, key, fn)
+        return True
+
+    def _run(self, key, fn):
+        try:
+            fn()
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Background refresh of {key} failed: {str(e)}")
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def stats(self):
+        """Return refresh counters for monitoring"""
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "queued": self.queued,
+                "skipped": self.skipped,
+                "failed": self.failed
+            }
+
+
+# Revalidates stale MedicineCache and DrugInteractionCache entries
+cache_refresher = BackgroundRefresher(max_workers=int(os.environ.get("CACHE_REFRESH_WORKERS", 2)))
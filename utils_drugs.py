@@ -0,0 +1,165 @@
+"""
+Drug name utilities for MedicineAI
+"""
+import re
+import json
+import time
+import threading
+import unicodedata
+import logging
+
+from app import db
+from models import MedicineAlias, DrugProduct
+
+logger = logging.getLogger(__name__)
+
+# Strength and quantity tokens such as "500mg", "2.5 mg", "250mg/5ml", "10%"
+STRENGTH_PATTERN = re.compile(
+    r"\b\d+(?:[.,]\d+)?\s*(?:mg|mcg|ug|µg|g|ml|l|iu|units?|meq|%)"
+    r"(?:\s*/\s*\d*(?:[.,]\d+)?\s*(?:mg|mcg|ug|µg|g|ml|l|iu|units?|meq|%)?)?(?=\W|$)",
+    re.IGNORECASE
+)
+
+# Dosage form words that do not change which medicine is meant
+DOSAGE_FORM_WORDS = {
+    "tablet", "tablets", "tab", "tabs", "capsule", "capsules", "cap", "caps",
+    "syrup", "suspension", "solution", "injection", "cream", "ointment", "gel",
+    "drops", "spray", "oral", "pill", "pills"
+}
+
+# How often the in-process alias and product maps are reloaded from the database
+ALIAS_REFRESH_SECONDS = 300
+
+
+class _DatabaseMap:
+    """A dict loaded from the database and reloaded every ALIAS_REFRESH_SECONDS"""
+    
+    def __init__(self, name, load_rows):
+        self.name = name
+        self._load_rows = load_rows
+        self._map = {}
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+    
+    def get_map(self):
+        """Return the map, reloading it first if it is out of date"""
+        if time.monotonic() - self._loaded_at < ALIAS_REFRESH_SECONDS:
+            return self._map
+        
+        with self._lock:
+            if time.monotonic() - self._loaded_at < ALIAS_REFRESH_SECONDS:
+                return self._map
+            try:
+                self._map = dict(self._load_rows())
+            except Exception as e:
+                logger.error(f"Error loading {self.name}: {str(e)}")
+            self._loaded_at = time.monotonic()
+        return self._map
+    
+    def invalidate(self):
+        """Force the next lookup to reload the map from the database"""
+        self._loaded_at = 0.0
+
+
+_aliases = _DatabaseMap(
+    "medicine aliases",
+    lambda: db.session.query(MedicineAlias.alias, MedicineAlias.canonical_name).all()
+)
+
+_products = _DatabaseMap(
+    "drug products",
+    lambda: (
+        (name, json.loads(ingredients))
+        for name, ingredients in db.session.query(DrugProduct.name, DrugProduct.ingredients).all()
+    )
+)
+
+
+def canonicalize_medicine_name(name):
+    """
+    Normalize a user supplied medicine name to a stable cache key.
+    
+    Lowercases, strips strengths ("500mg") and dosage forms ("tablets"),
+    drops punctuation and collapses whitespace, so "PARACETAMOL 500mg" and
+    "paracetamol " both become "paracetamol".
+    """
+    if not name:
+        return ""
+    
+    text = unicodedata.normalize("NFKC", name).lower()
+    text = STRENGTH_PATTERN.sub(" ", text)
+    text = re.sub(r"[^\w\s+/-]", " ", text)
+    words = [word for word in text.split() if word not in DOSAGE_FORM_WORDS]
+    canonical = " ".join(words).strip(" -/+")
+    
+    # Never reduce a name to nothing, e.g. a bare "500mg"
+    return canonical or " ".join(name.lower().split())
+
+
+def _load_alias_map():
+    """Return the alias map, reloading it from the database if it is out of date"""
+    return _aliases.get_map()
+
+
+def invalidate_alias_map():
+    """Force the next lookup to reload aliases from the database"""
+    _aliases.invalidate()
+
+
+def invalidate_product_map():
+    """Force the next lookup to reload drug products from the database"""
+    _products.invalidate()
+
+
+def resolve_medicine_name(name):
+    """
+    Resolve a user supplied medicine name to its canonical cache key.
+    
+    The name is canonicalized first, then brand names and known
+    misspellings are mapped through the MedicineAlias table.
+    """
+    canonical = canonicalize_medicine_name(name)
+    return _load_alias_map().get(canonical, canonical)
+
+
+def drug_ingredients(name):
+    """
+    Resolve a medication name to its canonical active ingredients.
+    
+    Products in the DrugProduct table, e.g. brands and combination products,
+    map to their ingredients; any other name is its own single ingredient.
+    Ingredient names go through the alias map too, so "Tylenol",
+    "acetaminophen" and "paracetamol 500mg" all resolve to one ingredient.
+    """
+    ingredients = _products.get_map().get(canonicalize_medicine_name(name))
+    if not ingredients:
+        return [resolve_medicine_name(name)]
+    return sorted({resolve_medicine_name(ingredient) for ingredient in ingredients})
+
+
+def interaction_ingredient_pairs(drug1, drug2):
+    """
+    Expand a medication pair to the ingredient pairs that can interact.
+    
+    Returns (pairs, shared) where pairs are sorted (ingredient1, ingredient2)
+    tuples and shared lists the active ingredients both medications contain.
+    """
+    ingredients1 = drug_ingredients(drug1)
+    ingredients2 = drug_ingredients(drug2)
+    pairs = sorted({
+        tuple(sorted([ingredient1, ingredient2]))
+        for ingredient1 in ingredients1
+        for ingredient2 in ingredients2
+        if ingredient1 != ingredient2
+    })
+    shared = sorted(set(ingredients1) & set(ingredients2))
+    return pairs, shared
+
+
+# SearchHistory also records scans and diet plans, which are not medicine lookups
+NON_MEDICINE_QUERY_PREFIXES = ("Health Scan:", "Food Scan:", "BMI Calculator")
+
+
+def is_medicine_query(query):
+    """Check whether a SearchHistory query was a medicine lookup"""
+    return bool(query) and not query.startswith(NON_MEDICINE_QUERY_PREFIXES)
@@ -0,0 +1,254 @@
+"""
+In-memory image payloads for the MedicineAI scanners
+"""
+import os
+import base64
+import logging
+import binascii
+import threading
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_IMAGE_MIME_TYPE = "image/jpeg"
+
+# Longest image edge sent to the vision model per scan type, and the JPEG
+# quality images are re-encoded at
+VISION_MAX_EDGE = {
+    "face": int(os.environ.get("VISION_MAX_EDGE_FACE", 768)),
+    "tongue": int(os.environ.get("VISION_MAX_EDGE_TONGUE", 768)),
+    "eye": int(os.environ.get("VISION_MAX_EDGE_EYE", 768)),
+    "skin": int(os.environ.get("VISION_MAX_EDGE_SKIN", 1024)),
+    "food": int(os.environ.get("VISION_MAX_EDGE_FOOD", 1024)),
+}
+VISION_JPEG_QUALITY = int(os.environ.get("VISION_JPEG_QUALITY", 85))
+# Margin kept around a detected face, as a fraction of the face size
+VISION_FACE_MARGIN = 0.4
+
+
+class ImagePayload:
+    """
+    An uploaded image held in memory.
+
+    Keeps whichever form the image arrived in and derives the other on first
+    use: a base64 upload is passed to OpenAI as is and only decoded if the
+    raw bytes are needed, e.g. for OpenCV, and raw bytes are only encoded
+    when a data URL is requested.
+    """
+
+    def __init__(self, data=None, encoded=None, mime_type=DEFAULT_IMAGE_MIME_TYPE):
+        if data is None and encoded is None:
+            raise ValueError("An image payload needs data or encoded data")
+        self._data = data
+        self._encoded = encoded
+        self._image = None
+        self.mime_type = mime_type or DEFAULT_IMAGE_MIME_TYPE
+
+    @classmethod
+    def from_base64(cls, text):
+        """Build a payload from base64 text, with or without a data URL prefix"""
+        mime_type = DEFAULT_IMAGE_MIME_TYPE
+        if text.startswith("data:") and "," in text:
+            header, text = text.split(",", 1)
+            mime_type = header[5:].split(";", 1)[0] or DEFAULT_IMAGE_MIME_TYPE
+        encoded = "".join(text.split())
+        if not encoded:
+            raise ValueError("Image data is empty")
+        return cls(encoded=encoded, mime_type=mime_type)
+
+    @classmethod
+    def from_bytes(cls, data, mime_type=DEFAULT_IMAGE_MIME_TYPE):
+        """Build a payload from raw image bytes"""
+        if not data:
+            raise ValueError("Image data is empty")
+        return cls(data=bytes(data), mime_type=mime_type)
+
+    @classmethod
+    def from_file(cls, file, mime_type=None):
+        """Build a payload from a file-like object such as a werkzeug FileStorage"""
+        mime_type = mime_type or getattr(file, "mimetype", None) or DEFAULT_IMAGE_MIME_TYPE
+        return cls.from_bytes(file.read(), mime_type)
+
+    @classmethod
+    def from_path(cls, path, mime_type=DEFAULT_IMAGE_MIME_TYPE):
+        """Build a payload from an image file on disk"""
+        with open(path, "rb") as image_file:
+            return cls.from_bytes(image_file.read(), mime_type)
+
+    @property
+    def data(self):
+        """The raw image bytes"""
+        if self._data is None:
+            try:
+                self._data = base64.b64decode(self._encoded, validate=True)
+            except binascii.Error as e:
+                raise ValueError(f"Invalid base64 image data: {str(e)}")
+        return self._data
+
+    @property
+    def base64(self):
+        """The image as base64 text"""
+        if self._encoded is None:
+            self._encoded = base64.b64encode(self._data).decode("ascii")
+        return self._encoded
+
+    def validate(self):
+        """Decode base64 data now, raises ValueError if it is invalid, returns self"""
+        self.data
+        return self
+
+    @property
+    def size(self):
+        """Size of the image in bytes, without decoding base64"""
+        if self._data is not None:
+            return len(self._data)
+        padding = 2 if self._encoded.endswith("==") else 1 if self._encoded.endswith("=") else 0
+        return len(self._encoded) * 3 // 4 - padding
+
+    @property
+    def data_url(self):
+        """The image as a data URL for OpenAI vision requests"""
+        return f"data:{self.mime_type};base64,{self.base64}"
+
+    def to_cv2(self):
+        """Decode the image with OpenCV, returns None if it is not a valid image"""
+        if self._image is None:
+            import cv2
+            import numpy as np
+
+            self._image = cv2.imdecode(np.frombuffer(self.data, np.uint8), cv2.IMREAD_COLOR)
+        return self._image
+
+
+def as_image_payload(image):
+    """Accept an ImagePayload, raw bytes, a file-like object or a file path"""
+    if isinstance(image, ImagePayload):
+        return image
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return ImagePayload.from_bytes(image)
+    if hasattr(image, "read"):
+        return ImagePayload.from_file(image)
+    return ImagePayload.from_path(image)
+
+
+def dhash(image_payload, hash_size=8):
+    """
+    Return the 64-bit difference hash of an ImagePayload, or None if it
+    cannot be decoded
+
+    Near-identical images, e.g. the same photo re-encoded or consecutive
+    camera frames, have hashes a few bits apart.
+    """
+    try:
+        import cv2
+
+        decoded = image_payload.to_cv2()
+        if decoded is None:
+            return None
+        gray = cv2.cvtColor(decoded, cv2.COLOR_BGR2GRAY)
+        small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    except Exception as e:
+        logger.warning(f"Could not hash image: {str(e)}")
+        return None
+
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return sum(1 << i for i, bit in enumerate(bits) if bit)
+
+
+class VisionImageStats:
+    """Per scan type counters of image bytes before and after preprocessing"""
+
+    def __init__(self):
+        self._counts = defaultdict(lambda: {"images": 0, "bytes_before": 0, "bytes_after": 0})
+        self._lock = threading.Lock()
+
+    def record(self, scan_type, bytes_before, bytes_after):
+        with self._lock:
+            counts = self._counts[scan_type]
+            counts["images"] += 1
+            counts["bytes_before"] += bytes_before
+            counts["bytes_after"] += bytes_after
+
+    def stats(self):
+        """Return the counters for monitoring"""
+        with self._lock:
+            return {scan_type: dict(counts) for scan_type, counts in self._counts.items()}
+
+
+vision_image_stats = VisionImageStats()
+
+
+def _crop_to_face(image):
+    """Crop to the largest detected face plus a margin, or return the image unchanged"""
+    import cv2
+
+    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    if face_cascade.empty():
+        return image
+
+    height, width = image.shape[:2]
+    # Detect on a small copy, full resolution detection is slow and not more accurate
+    scale = min(1.0, 640 / max(height, width))
+    small = cv2.resize(image, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(40, 40))
+    if len(faces) == 0:
+        return image
+
+    x, y, w, h = [int(value / scale) for value in max(faces, key=lambda face: face[2] * face[3])]
+    margin_x, margin_y = int(w * VISION_FACE_MARGIN), int(h * VISION_FACE_MARGIN)
+    top, bottom = max(0, y - margin_y), min(height, y + h + margin_y)
+    left, right = max(0, x - margin_x), min(width, x + w + margin_x)
+    return image[top:bottom, left:right]
+
+
+def prepare_for_vision(image, scan_type):
+    """
+    Crop, downscale and re-encode an ImagePayload for a vision request
+
+    Face scans are cropped to the detected face. Images are shrunk so their
+    longest edge is at most VISION_MAX_EDGE for the scan type and re-encoded
+    as JPEG at VISION_JPEG_QUALITY. The original is returned if OpenCV is not
+    available, the image cannot be decoded or the result would be larger.
+    """
+    bytes_before = image.size
+    try:
+        import cv2
+
+        decoded = image.to_cv2()
+        if decoded is None:
+            return image
+
+        cropped = decoded
+        if scan_type == "face":
+            try:
+                cropped = _crop_to_face(decoded)
+            except Exception as e:
+                # Face detection is optional, e.g. OpenCV builds without cascades
+                logger.warning(f"Could not detect face for cropping: {str(e)}")
+        height, width = cropped.shape[:2]
+        max_edge = VISION_MAX_EDGE.get(scan_type, VISION_MAX_EDGE["food"])
+        if max(height, width) > max_edge:
+            scale = max_edge / max(height, width)
+            cropped = cv2.resize(
+                cropped, (max(1, int(width * scale)), max(1, int(height * scale))),
+                interpolation=cv2.INTER_AREA
+            )
+        elif cropped is decoded and image.mime_type == "image/jpeg":
+            # Small JPEGs are sent as uploaded
+            vision_image_stats.record(scan_type, bytes_before, bytes_before)
+            return image
+
+        ok, encoded = cv2.imencode(".jpg", cropped, [cv2.IMWRITE_JPEG_QUALITY, VISION_JPEG_QUALITY])
+        if not ok or len(encoded) >= bytes_before:
+            vision_image_stats.record(scan_type, bytes_before, bytes_before)
+            return image
+
+        prepared = ImagePayload.from_bytes(encoded.tobytes(), "image/jpeg")
+    except Exception as e:
+        logger.warning(f"Could not preprocess {scan_type} image: {str(e)}")
+        return image
+
+    vision_image_stats.record(scan_type, bytes_before, prepared.size)
+    logger.info(f"Prepared {scan_type} image for vision: {bytes_before} -> {prepared.size} bytes")
+    return prepared
@@ -0,0 +1,245 @@
+"""
+In-memory drug interaction graph for MedicineAI
+"""
+import os
+import copy
+import time
+import logging
+import threading
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+
+from app import app, db
+from utils_cache import cache_refresher
+
+logger = logging.getLogger(__name__)
+
+# How often rows updated by other workers are pulled in, and how often the
+# whole graph is rebuilt to drop expired edges
+INTERACTION_GRAPH_SYNC_SECONDS = int(os.environ.get("INTERACTION_GRAPH_SYNC_SECONDS", 60))
+INTERACTION_GRAPH_REBUILD_SECONDS = int(os.environ.get("INTERACTION_GRAPH_REBUILD_SECONDS", 3600))
+
+SEVERITY_RANKS = {"none": 0, "mild": 1, "moderate": 2, "severe": 3}
+
+InteractionEdge = namedtuple("InteractionEdge", ["data", "severity", "updated_at", "negative"])
+
+
+def _pair_key(drug1, drug2):
+    drug_names = sorted([drug1, drug2])
+    return f"{drug_names[0]}:{drug_names[1]}"
+
+
+class DrugInteractionGraph:
+    """
+    Read-optimized copy of DrugInteractionCache with drugs as nodes.
+
+    Each edge holds the cached interaction payload and its severity. The
+    graph is loaded from the database once per worker, updated directly by
+    DrugInteractionCache.update_cache and synced with rows written by other
+    workers in the background. Edges follow the cache TTLs, so a lookup never
+    returns anything the database cache would not.
+    """
+
+    def __init__(self):
+        self._edges = {}
+        self._adjacency = defaultdict(dict)
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._model = None
+        self._built_at = None
+        self._synced_at = None
+        self._synced_until = None
+        self.lookups = 0
+        self.hits = 0
+
+    def _add_edge(self, drug1, drug2, edge):
+        key = _pair_key(drug1, drug2)
+        current = self._edges.get(key)
+        if current is not None and current.updated_at > edge.updated_at:
+            return
+        self._edges[key] = edge
+        self._adjacency[drug1][drug2] = key
+        self._adjacency[drug2][drug1] = key
+
+    def _load_rows(self, since=None):
+        # models imports this module, so import the model when first needed
+        from models import DrugInteractionCache
+
+        query = db.session.query(
+            DrugInteractionCache.drug_pair,
+            DrugInteractionCache.interaction_data,
+            DrugInteractionCache.severity,
+            DrugInteractionCache.last_updated,
+            DrugInteractionCache.is_negative
+        )
+        if since is not None:
+            query = query.filter(DrugInteractionCache.last_updated >= since)
+        else:
+            query = query.filter(
+                DrugInteractionCache.last_updated >= datetime.utcnow() - DrugInteractionCache.HARD_TTL
+            )
+        return DrugInteractionCache, query.all()
+
+    def build(self):
+        """Load every unexpired DrugInteractionCache row"""
+        started_at = datetime.utcnow()
+        model, rows = self._load_rows()
+
+        edges = {}
+        adjacency = defaultdict(dict)
+        for drug_pair, data, severity, updated_at, negative in rows:
+            drug1, _, drug2 = drug_pair.partition(":")
+            edges[drug_pair] = InteractionEdge(data, severity, updated_at, negative)
+            adjacency[drug1][drug2] = drug_pair
+            adjacency[drug2][drug1] = drug_pair
+
+        with self._lock:
+            # Keep edges added by this worker while the rows were loading
+            for key, edge in self._edges.items():
+                if edge.updated_at >= started_at:
+                    edges[key] = edge
+                    drug1, _, drug2 = key.partition(":")
+                    adjacency[drug1][drug2] = key
+                    adjacency[drug2][drug1] = key
+            self._edges = edges
+            self._adjacency = adjacency
+            self._model = model
+            self._built_at = time.monotonic()
+            self._synced_at = self._built_at
+            self._synced_until = started_at
+        logger.info(f"Built drug interaction graph with {len(edges)} interactions")
+
+    def sync(self):
+        """Pull in rows written since the last build or sync, e.g. by other workers"""
+        started_at = datetime.utcnow()
+        # Allow for commits that were in progress during the previous sync
+        _, rows = self._load_rows(since=self._synced_until - timedelta(seconds=5))
+        with self._lock:
+            for drug_pair, data, severity, updated_at, negative in rows:
+                drug1, _, drug2 = drug_pair.partition(":")
+                self._add_edge(drug1, drug2, InteractionEdge(data, severity, updated_at, negative))
+            self._synced_at = time.monotonic()
+            self._synced_until = started_at
+
+    def add(self, drug1, drug2, data, severity=None, updated_at=None, negative=False):
+        """Add or replace the edge for a drug pair"""
+        edge = InteractionEdge(data, severity, updated_at or datetime.utcnow(), negative)
+        with self._lock:
+            self._add_edge(drug1, drug2, edge)
+
+    def _ensure_fresh(self):
+        if self._built_at is None:
+            # Concurrent first lookups wait for one build instead of each loading the table
+            with self._build_lock:
+                if self._built_at is None:
+                    self.build()
+            return
+
+        def run_in_app_context(fn):
+            def task():
+                with app.app_context():
+                    fn()
+            return task
+
+        now = time.monotonic()
+        if now - self._built_at > INTERACTION_GRAPH_REBUILD_SECONDS:
+            cache_refresher.submit("drug-interaction-graph", run_in_app_context(self.build))
+        elif now - self._synced_at > INTERACTION_GRAPH_SYNC_SECONDS:
+            cache_refresher.submit("drug-interaction-graph", run_in_app_context(self.sync))
+
+    def _usable(self, edge, now):
+        """Return (usable, is_stale) for an edge under the cache TTLs"""
+        return self._model.freshness(edge.updated_at, edge.negative, now)
+
+    def lookup(self, pairs):
+        """
+        Look up drug pairs in the graph
+
+        Returns (hits, misses) shaped like DrugInteractionCache.get_cached_interactions.
+        """
+        self._ensure_fresh()
+        now = datetime.utcnow()
+        hits = {}
+        misses = []
+        with self._lock:
+            for pair in pairs:
+                edge = self._edges.get(_pair_key(*pair))
+                usable, is_stale = self._usable(edge, now) if edge else (False, False)
+                if usable:
+                    hits[pair] = (edge.data, is_stale)
+                else:
+                    misses.append(pair)
+            self.lookups += len(pairs)
+            self.hits += len(hits)
+        return {pair: (copy.deepcopy(data), is_stale) for pair, (data, is_stale) in hits.items()}, misses
+
+    def get(self, drug1, drug2):
+        """Return (data, is_stale) for one pair, or (None, False) if unknown"""
+        hits, _ = self.lookup([(drug1, drug2)])
+        return hits.get((drug1, drug2), (None, False))
+
+    @staticmethod
+    def _interacts(edge):
+        return isinstance(edge.data, dict) and bool(edge.data.get("has_interaction"))
+
+    def _edges_among(self, drugs):
+        """Return {(drug1, drug2): edge} for usable interacting edges within a set of drugs"""
+        self._ensure_fresh()
+        drugs = list(dict.fromkeys(drugs))
+        members = set(drugs)
+        now = datetime.utcnow()
+        found = {}
+        with self._lock:
+            for drug in drugs:
+                for other, key in self._adjacency.get(drug, {}).items():
+                    if other not in members or (other, drug) in found:
+                        continue
+                    edge = self._edges[key]
+                    if self._usable(edge, now)[0] and self._interacts(edge):
+                        found[(drug, other)] = edge
+        return found
+
+    def interactions_among(self, drugs):
+        """Return {(drug1, drug2): data} for every known interaction within a set of drugs"""
+        return {pair: copy.deepcopy(edge.data) for pair, edge in self._edges_among(drugs).items()}
+
+    def worst_severity(self, drugs):
+        """Return the highest severity among known interactions within a set of drugs"""
+        worst = "none"
+        for edge in self._edges_among(drugs).values():
+            severity = (edge.severity or "none").lower()
+            if SEVERITY_RANKS.get(severity, 0) > SEVERITY_RANKS[worst]:
+                worst = severity
+        return worst
+
+    def interacting_with(self, drug, drugs=None):
+        """
+        Return [(other drug, severity)] for drugs known to interact with drug,
+        limited to the given drugs if any, worst first
+        """
+        self._ensure_fresh()
+        members = set(drugs) if drugs is not None else None
+        now = datetime.utcnow()
+        found = []
+        with self._lock:
+            for other, key in self._adjacency.get(drug, {}).items():
+                if members is not None and other not in members:
+                    continue
+                edge = self._edges[key]
+                if self._usable(edge, now)[0] and self._interacts(edge):
+                    found.append((other, (edge.severity or "unknown").lower()))
+        found.sort(key=lambda item: -SEVERITY_RANKS.get(item[1], 0))
+        return found
+
+    def stats(self):
+        """Return graph counters for monitoring"""
+        with self._lock:
+            return {
+                "drugs": len(self._adjacency),
+                "interactions": len(self._edges),
+                "lookups": self.lookups,
+                "hits": self.hits
+            }
+
+
+drug_interaction_graph = DrugInteractionGraph()
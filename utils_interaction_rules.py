@@ -0,0 +1,154 @@
+"""
+Local rules engine for well-known drug interactions in MedicineAI
+"""
+import os
+import copy
+import json
+import logging
+import threading
+from itertools import product
+
+from utils_drugs import drug_ingredients
+from utils_interaction_graph import SEVERITY_RANKS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "interaction_rules.json")
+INTERACTION_RULES_FILE = os.environ.get("INTERACTION_RULES_FILE", DEFAULT_RULES_FILE)
+
+
+def _pair_key(drug1, drug2):
+    drug_names = sorted([drug1, drug2])
+    return f"{drug_names[0]}:{drug_names[1]}"
+
+
+class InteractionRules:
+    """
+    Curated interaction rules indexed by ingredient pair.
+
+    The rules file names drug classes and rules between classes or single
+    ingredients. Every rule is expanded to the ingredient pairs it covers
+    when the file is loaded, so a lookup is one dict access. Where rules
+    overlap the most severe one wins. Results are tagged source "local"
+    and carry the rule id and the rules file version.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.version = None
+        self._index = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+        self.lookups = 0
+        self.hits = 0
+
+    def load(self):
+        """(Re)load the rules file, keeping the current rules if it is invalid"""
+        try:
+            with open(self.path) as f:
+                rules = json.load(f)
+            index = self._build_index(rules)
+        except Exception as e:
+            logger.error(f"Error loading interaction rules from {self.path}: {str(e)}")
+            self._loaded = True
+            return
+
+        with self._lock:
+            self._index = index
+            self.version = rules.get("version")
+            self._loaded = True
+        logger.info(f"Loaded interaction rules {self.version} covering {len(index)} ingredient pairs")
+
+    @staticmethod
+    def _ingredients(members):
+        # Key members like the lookups, which use resolved ingredient names,
+        # so brands, aliases and combination products in the file match too
+        return {ingredient for member in members for ingredient in drug_ingredients(member)}
+
+    @classmethod
+    def _build_index(cls, rules):
+        classes = {
+            name: cls._ingredients(members)
+            for name, members in rules.get("classes", {}).items()
+        }
+
+        def expand(side):
+            if isinstance(side, list):
+                return cls._ingredients(side)
+            if side in classes:
+                return classes[side]
+            return cls._ingredients([side])
+
+        index = {}
+        for rule in rules["rules"]:
+            side1, side2 = rule["between"]
+            entry = {
+                "has_interaction": True,
+                "severity": rule["severity"],
+                "mechanism": rule["mechanism"],
+                "effects": rule.get("effects", []),
+                "recommendations": rule.get("recommendations", []),
+                "disclaimer": rule.get("disclaimer", rules.get("disclaimer")),
+                "source": "local",
+                "rule": rule["id"],
+                "rules_version": rules.get("version")
+            }
+            for drug1, drug2 in product(expand(side1), expand(side2)):
+                if drug1 == drug2:
+                    continue
+                key = _pair_key(drug1, drug2)
+                current = index.get(key)
+                if current is None or SEVERITY_RANKS.get(entry["severity"], 0) > SEVERITY_RANKS.get(current["severity"], 0):
+                    index[key] = entry
+        return index
+
+    def _ensure_loaded(self):
+        # Loading twice when workers race on the first lookup is harmless
+        if not self._loaded:
+            self.load()
+
+    def get(self, drug1, drug2):
+        """Return the local result for a pair of canonical ingredients, or None"""
+        self._ensure_loaded()
+        entry = self._index.get(_pair_key(drug1, drug2))
+        self.lookups += 1
+        if entry is None:
+            return None
+        self.hits += 1
+        return dict(copy.deepcopy(entry), drug1=drug1, drug2=drug2)
+
+    def lookup(self, pairs):
+        """Return (hits, misses) with hits mapping each covered pair to its result"""
+        hits = {}
+        misses = []
+        for pair in pairs:
+            result = self.get(*pair)
+            if result is not None:
+                hits[pair] = result
+            else:
+                misses.append(pair)
+        return hits, misses
+
+    def interacting_with(self, drug, drugs):
+        """Return [(other drug, severity)] for the given drugs a rule covers with drug"""
+        self._ensure_loaded()
+        found = []
+        for other in drugs:
+            if other == drug:
+                continue
+            entry = self._index.get(_pair_key(drug, other))
+            if entry is not None:
+                found.append((other, entry["severity"]))
+        return found
+
+    def stats(self):
+        """Return rules engine counters for monitoring"""
+        return {
+            "version": self.version,
+            "pairs": len(self._index),
+            "lookups": self.lookups,
+            "hits": self.hits
+        }
+
+
+interaction_rules = InteractionRules(INTERACTION_RULES_FILE)
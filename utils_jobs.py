@@ -0,0 +1,212 @@
+"""
+Database-backed background jobs for slow analysis requests in MedicineAI
+"""
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_, and_
+
+from app import app, db
+from models import AnalysisJob
+
+logger = logging.getLogger(__name__)
+
+# Worker threads per web process. Set to 0 when jobs are run by job_worker.py
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+# How often idle workers look for jobs queued by other processes
+JOB_POLL_SECONDS = float(os.environ.get("JOB_POLL_SECONDS", 1.0))
+# Running jobs not finished after this long are assumed lost and run again,
+# or marked as failed once they were tried JOB_MAX_ATTEMPTS times
+JOB_STALE_SECONDS = int(os.environ.get("JOB_STALE_SECONDS", 300))
+JOB_MAX_ATTEMPTS = 3
+# Finished jobs are deleted after this long
+JOB_RETENTION_HOURS = int(os.environ.get("JOB_RETENTION_HOURS", 24))
+
+
+class JobQueue:
+    """
+    Queue of AnalysisJob rows worked off by a pool of threads.
+
+    Web processes start their threads on startup in main.py, job_worker.py
+    when it runs; scripts importing the app never claim jobs. Jobs are
+    claimed with a conditional UPDATE, so any number of web processes and
+    job_worker.py processes can share the table. Handlers are registered per
+    job kind, receive the AnalysisJob and return the result payload; an
+    exception marks the job as failed.
+    """
+
+    def __init__(self, workers=2, poll_seconds=1.0):
+        self.workers = workers
+        self.poll_seconds = poll_seconds
+        self._handlers = {}
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._threads_pid = None
+        self._pruned_at = 0.0
+        self._failed_stale_at = 0.0
+        self.completed = 0
+        self.failed = 0
+
+    def register(self, kind, handler):
+        """Run handler(job) for jobs of the given kind"""
+        self._handlers[kind] = handler
+
+    def enqueue(self, user_id, kind, params=None, image=None):
+        """Queue a job and wake a worker, returns the committed AnalysisJob"""
+        if kind not in self._handlers:
+            raise ValueError(f"No handler registered for {kind} jobs")
+        job = AnalysisJob(user_id=user_id, kind=kind, params=params, input_image=image)
+        db.session.add(job)
+        db.session.commit()
+
+        self.start_workers()
+        self._wakeup.set()
+        return job
+
+    @staticmethod
+    def _stale(now):
+        return and_(
+            AnalysisJob.status == 'running',
+            AnalysisJob.started_at < now - timedelta(seconds=JOB_STALE_SECONDS)
+        )
+
+    def _claimable(self, now):
+        return or_(
+            AnalysisJob.status == 'queued',
+            and_(self._stale(now), AnalysisJob.attempts < JOB_MAX_ATTEMPTS)
+        )
+
+    def claim(self):
+        """Mark the oldest runnable job as running, returns its id or None"""
+        while True:
+            now = datetime.utcnow()
+            job_id = db.session.query(AnalysisJob.id).filter(
+                self._claimable(now)
+            ).order_by(AnalysisJob.created_at, AnalysisJob.id).limit(1).scalar()
+            if job_id is None:
+                db.session.commit()
+                return None
+
+            # Another worker may claim the same job first, then try the next one
+            claimed = db.session.execute(
+                db.update(AnalysisJob).where(
+                    AnalysisJob.id == job_id,
+                    self._claimable(now)
+                ).values(status='running', started_at=now, attempts=AnalysisJob.attempts + 1)
+            ).rowcount
+            db.session.commit()
+            if claimed:
+                return job_id
+
+    def run(self, job_id):
+        """Run a claimed job and store its result or error"""
+        job = db.session.get(AnalysisJob, job_id)
+        handler = self._handlers.get(job.kind)
+        try:
+            if handler is None:
+                raise ValueError(f"No handler registered for {job.kind} jobs")
+            result = handler(job)
+            job.status = 'done'
+            job.result = result
+            self.completed += 1
+        except Exception as e:
+            logger.error(f"Error running {job.kind} job {job_id}: {str(e)}")
+            db.session.rollback()
+            job = db.session.get(AnalysisJob, job_id)
+            job.status = 'error'
+            job.error = str(e)
+            self.failed += 1
+
+        job.input_image = None
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+
+    def run_pending(self):
+        """Run jobs until none are left, returns the number run"""
+        count = 0
+        while True:
+            with app.app_context():
+                job_id = self.claim()
+                if job_id is None:
+                    return count
+                self.run(job_id)
+            count += 1
+
+    def fail_stale(self):
+        """Mark stale jobs that used up their attempts as failed, returns the number"""
+        now = datetime.utcnow()
+        failed = db.session.execute(
+            db.update(AnalysisJob).where(
+                self._stale(now),
+                AnalysisJob.attempts >= JOB_MAX_ATTEMPTS
+            ).values(
+                status='error',
+                error=f"Gave up after {JOB_MAX_ATTEMPTS} attempts",
+                input_image=None,
+                finished_at=now
+            )
+        ).rowcount
+        db.session.commit()
+        if failed:
+            logger.warning(f"Gave up on {failed} analysis jobs after {JOB_MAX_ATTEMPTS} attempts")
+        self.failed += failed
+        return failed
+
+    def prune(self):
+        """Delete finished jobs older than JOB_RETENTION_HOURS"""
+        self.fail_stale()
+        cutoff = datetime.utcnow() - timedelta(hours=JOB_RETENTION_HOURS)
+        deleted = db.session.query(AnalysisJob).filter(
+            AnalysisJob.status.in_(['done', 'error']),
+            AnalysisJob.finished_at < cutoff
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return deleted
+
+    def work(self):
+        """Worker loop: run jobs as they arrive, polling for jobs from other processes"""
+        while True:
+            try:
+                self.run_pending()
+                if time.monotonic() - self._failed_stale_at > 60:
+                    self._failed_stale_at = time.monotonic()
+                    with app.app_context():
+                        self.fail_stale()
+                if time.monotonic() - self._pruned_at > 3600:
+                    self._pruned_at = time.monotonic()
+                    with app.app_context():
+                        self.prune()
+            except Exception as e:
+                logger.error(f"Error in job worker: {str(e)}")
+            self._wakeup.wait(self.poll_seconds)
+            self._wakeup.clear()
+
+    def start_workers(self):
+        """Start the worker threads in this process if needed"""
+        if self.workers <= 0 or self._threads_pid == os.getpid():
+            return
+        with self._lock:
+            if self._threads_pid == os.getpid():
+                return
+            self._threads_pid = os.getpid()
+            self._threads = [
+                threading.Thread(target=self.work, name=f"analysis-job-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def stats(self):
+        """Return queue counters for monitoring"""
+        return {
+            "workers": len(self._threads) if self._threads_pid == os.getpid() else 0,
+            "completed": self.completed,
+            "failed": self.failed
+        }
+
+
+job_queue = JobQueue(workers=JOB_WORKERS, poll_seconds=JOB_POLL_SECONDS)
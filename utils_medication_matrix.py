@@ -0,0 +1,209 @@
+"""
+Precomputed interaction matrix over users' saved medications
+
+Every pair of a user's UserMedication rows has a MedicationInteraction row.
+Adding, renaming or deleting a medication only touches the pairs it is part
+of, and new pairs are resolved in the background, so checking saved
+medications is normally a single read.
+"""
+import os
+import logging
+from datetime import datetime
+
+from sqlalchemy import or_
+
+from app import app, db
+from models import UserMedication, MedicationInteraction, DrugInteractionCache
+from utils import (
+    INTERACTION_DEADLINE, check_multiple_drug_interactions,
+    _medication_pairs, _resolve_interaction_pairs, _summarize_interactions
+)
+from utils_cache import BackgroundRefresher
+
+logger = logging.getLogger(__name__)
+
+# Background workers computing new pairs after medication changes
+MEDICATION_MATRIX_WORKERS = int(os.environ.get("MEDICATION_MATRIX_WORKERS", 2))
+
+medication_matrix_refresher = BackgroundRefresher(max_workers=MEDICATION_MATRIX_WORKERS)
+
+
+def remove_medication_pairs(medication_id):
+    """Delete the pairs a medication is part of, the caller commits"""
+    db.session.query(MedicationInteraction).filter(or_(
+        MedicationInteraction.medication1_id == medication_id,
+        MedicationInteraction.medication2_id == medication_id
+    )).delete(synchronize_session=False)
+
+
+def add_medication_pairs(medication):
+    """Create pending pairs between a medication and the user's other medications, the caller commits"""
+    other_ids = [
+        other_id for (other_id,) in db.session.query(UserMedication.id).filter(
+            UserMedication.user_id == medication.user_id,
+            UserMedication.id != medication.id
+        )
+    ]
+    for other_id in other_ids:
+        medication1_id, medication2_id = MedicationInteraction.ordered_ids(medication.id, other_id)
+        db.session.add(MedicationInteraction(
+            user_id=medication.user_id,
+            medication1_id=medication1_id,
+            medication2_id=medication2_id
+        ))
+    return len(other_ids)
+
+
+def queue_matrix_update(user_id):
+    """Resolve a user's pending pairs in the background"""
+    def update():
+        with app.app_context():
+            compute_pending_pairs(user_id)
+
+    medication_matrix_refresher.submit(f"medication-matrix:{user_id}", update)
+
+
+def compute_pending_pairs(user_id):
+    """Resolve every pending pair of a user, returns the number stored"""
+    stored = 0
+    while True:
+        rows = db.session.query(MedicationInteraction).filter_by(user_id=user_id, status='pending').all()
+        if not rows:
+            return stored
+        names = _medication_names([row.medication1_id for row in rows] + [row.medication2_id for row in rows])
+
+        pairs = {}
+        for row in rows:
+            pair = (names.get(row.medication1_id), names.get(row.medication2_id))
+            if None in pair:
+                continue
+            pairs[pair] = (row.medication1_id, row.medication2_id)
+
+        resolved = dict(_resolve_interaction_pairs(list(pairs)))
+        newly_stored = _store_pairs(user_id, pairs, resolved)
+        stored += newly_stored
+        # Stop when a pass makes no progress, e.g. nothing resolved before
+        # the deadline or the rows could not be stored, instead of retrying
+        if not newly_stored:
+            return stored
+
+
+def check_saved_medication_interactions(medications, user):
+    """
+    Check interactions between a user's saved medications
+
+    Same result as check_multiple_drug_interactions, read from the user's
+    interaction matrix. Pairs that are missing, pending or failed are
+    resolved now and stored. Names that are not saved medications fall back
+    to check_multiple_drug_interactions.
+    """
+    if not medications or len(medications) < 2:
+        return check_multiple_drug_interactions(medications, user)
+
+    saved = {}
+    for medication_id, name in db.session.query(UserMedication.id, UserMedication.medication_name).filter(
+        UserMedication.user_id == user.id,
+        UserMedication.medication_name.in_(set(medications))
+    ).order_by(UserMedication.id):
+        saved.setdefault(name, medication_id)
+    if any(name not in saved for name in medications):
+        return check_multiple_drug_interactions(medications, user)
+
+    pairs = _medication_pairs(medications)
+    id_pairs = {
+        pair: MedicationInteraction.ordered_ids(saved[pair[0]], saved[pair[1]])
+        for pair in pairs
+    }
+
+    # Entries the interaction cache would have expired are recomputed like
+    # cache misses
+    now = datetime.utcnow()
+    ready = {
+        (row.medication1_id, row.medication2_id): row.interaction_data
+        for row in db.session.query(MedicationInteraction).filter(
+            MedicationInteraction.user_id == user.id,
+            MedicationInteraction.status == 'ready',
+            MedicationInteraction.updated_at >= now - DrugInteractionCache.HARD_TTL,
+            MedicationInteraction.medication1_id.in_(set(saved.values()))
+        )
+        if DrugInteractionCache.freshness(row.updated_at, row.has_interaction is None, now)[0]
+    }
+
+    resolved = {}
+    missing = []
+    for pair in pairs:
+        data = ready.get(id_pairs[pair])
+        if data is not None:
+            resolved[pair] = data
+        else:
+            missing.append(pair)
+
+    if missing:
+        computed = dict(_resolve_interaction_pairs(missing, timeout=INTERACTION_DEADLINE))
+        _store_pairs(user.id, {pair: id_pairs[pair] for pair in missing}, computed)
+        resolved.update(computed)
+
+    return _summarize_interactions(medications, pairs, resolved, user)
+
+
+def _medication_names(medication_ids):
+    return dict(db.session.query(UserMedication.id, UserMedication.medication_name).filter(
+        UserMedication.id.in_(set(medication_ids))
+    ))
+
+
+def _store_pairs(user_id, pairs, resolved):
+    """
+    Write resolved interactions into the matrix
+
+    pairs maps (drug1, drug2) to (medication1_id, medication2_id). Rows are
+    updated in place, or created if the pair predates the matrix. Pairs whose
+    medication has been deleted meanwhile are skipped.
+    """
+    existing = {
+        (row.medication1_id, row.medication2_id): row.id
+        for row in db.session.query(MedicationInteraction).filter(
+            MedicationInteraction.user_id == user_id,
+            MedicationInteraction.medication1_id.in_({ids[0] for ids in pairs.values()})
+        )
+    }
+    live_ids = set(_medication_names([medication_id for ids in pairs.values() for medication_id in ids]))
+
+    stored = 0
+    now = datetime.utcnow()
+    for pair, (medication1_id, medication2_id) in pairs.items():
+        interaction = resolved.get(pair)
+        if interaction is None or medication1_id == medication2_id:
+            continue
+        if medication1_id not in live_ids or medication2_id not in live_ids:
+            continue
+
+        values = {
+            "status": "error" if interaction.get("error") else "ready",
+            "interaction_data": interaction,
+            "has_interaction": interaction.get("has_interaction"),
+            "severity": (interaction.get("severity") or "unknown").lower(),
+            "updated_at": now
+        }
+        row_id = existing.get((medication1_id, medication2_id))
+        if row_id is not None:
+            db.session.execute(
+                db.update(MedicationInteraction).where(MedicationInteraction.id == row_id).values(**values)
+            )
+        else:
+            db.session.add(MedicationInteraction(
+                user_id=user_id,
+                medication1_id=medication1_id,
+                medication2_id=medication2_id,
+                **values
+            ))
+        stored += 1
+
+    try:
+        db.session.commit()
+    except Exception as e:
+        # Another request stored the same pairs first, the matrix is only a cache
+        db.session.rollback()
+        logger.warning(f"Could not store medication interactions for user {user_id}: {str(e)}")
+        return 0
+    return stored
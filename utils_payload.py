@@ -0,0 +1,112 @@
+"""
+Compact storage for cached AI payloads in MedicineAI
+
+PayloadType is a column type that stores JSON-compatible Python objects.
+On PostgreSQL it maps to JSONB. Elsewhere the payload is encoded with the
+codec named by PAYLOAD_CODEC ("zlib" by default, or "json") and stored as
+binary. Reads detect the codec from the stored bytes, so rows written with
+any codec, including legacy pretty-printed JSON text, decode transparently.
+"""
+import os
+import json
+import zlib
+
+from sqlalchemy.types import TypeDecorator, LargeBinary
+from sqlalchemy.dialects.postgresql import JSONB
+
+PAYLOAD_CODEC = os.environ.get("PAYLOAD_CODEC", "zlib")
+ZLIB_LEVEL = 6
+
+
+class JSONCodec:
+    """Compact JSON text without whitespace"""
+    name = "json"
+
+    @staticmethod
+    def matches(raw):
+        return raw[:1] in (b"{", b"[", b'"')
+
+    @staticmethod
+    def encode(value):
+        return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+    @staticmethod
+    def decode(raw):
+        return json.loads(raw.decode("utf-8"))
+
+
+class ZlibJSONCodec:
+    """Compact JSON compressed with zlib"""
+    name = "zlib"
+
+    @staticmethod
+    def matches(raw):
+        # zlib streams start with a 0x78 header byte
+        return raw[:1] == b"\x78"
+
+    @staticmethod
+    def encode(value):
+        return zlib.compress(JSONCodec.encode(value), ZLIB_LEVEL)
+
+    @staticmethod
+    def decode(raw):
+        return JSONCodec.decode(zlib.decompress(raw))
+
+
+PAYLOAD_CODECS = {codec.name: codec for codec in (JSONCodec, ZlibJSONCodec)}
+
+
+def get_codec(name=None):
+    """Return the codec used for new writes"""
+    return PAYLOAD_CODECS[name or PAYLOAD_CODEC]
+
+
+def encode_payload(value, codec_name=None):
+    """Encode a JSON-compatible value to bytes with the configured codec"""
+    return get_codec(codec_name).encode(value)
+
+
+def decode_payload(raw):
+    """Decode stored bytes or legacy JSON text written by any codec"""
+    if raw is None:
+        return None
+    if isinstance(raw, str):
+        return json.loads(raw)
+    raw = bytes(raw)
+    for codec in PAYLOAD_CODECS.values():
+        if codec.matches(raw):
+            return codec.decode(raw)
+    return JSONCodec.decode(raw)
+
+
+class PayloadType(TypeDecorator):
+    """Column type holding a JSON-compatible payload in compact form"""
+    impl = LargeBinary
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "postgresql":
+            return dialect.type_descriptor(JSONB())
+        return dialect.type_descriptor(LargeBinary())
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        # Accept JSON text from callers that still serialize themselves
+        if isinstance(value, (str, bytes)):
+            value = decode_payload(value)
+        if dialect.name == "postgresql":
+            return value
+        return encode_payload(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None or not isinstance(value, (str, bytes, bytearray, memoryview)):
+            # Already decoded, e.g. by the JSONB driver
+            return value
+        if isinstance(value, str) and dialect.name == "postgresql":
+            # A JSONB string scalar, or a column not yet migrated from TEXT
+            try:
+                return json.loads(value)
+            except ValueError:
+                return value
+        return decode_payload(value)
@@ -0,0 +1,65 @@
+"""
+Perceptual hash cache for health and food scan results in MedicineAI
+"""
+import os
+import logging
+from datetime import datetime, timedelta
+
+from app import db
+from models import ScanImageHash
+from utils_cache import EventCounter
+from utils_image import dhash
+
+logger = logging.getLogger(__name__)
+
+# Rescans of a near-identical image within the window return the stored
+# result. The distance is the number of differing bits of the 64-bit dHash
+SCAN_DEDUPE_WINDOW_SECONDS = int(os.environ.get("SCAN_DEDUPE_WINDOW_SECONDS", 600))
+SCAN_DEDUPE_MAX_DISTANCE = int(os.environ.get("SCAN_DEDUPE_MAX_DISTANCE", 6))
+
+scan_dedupe_stats = EventCounter()
+
+
+def find_recent_scan(user_id, scan_type, image):
+    """
+    Look for a recent scan of a near-identical image by the same user
+
+    Returns (result, image_hash). result is the stored result of the closest
+    match, or None. image_hash is None if the image could not be hashed.
+    """
+    image_hash = dhash(image)
+    if image_hash is None:
+        return None, None
+
+    since = datetime.utcnow() - timedelta(seconds=SCAN_DEDUPE_WINDOW_SECONDS)
+    candidates = db.session.query(ScanImageHash.image_hash, ScanImageHash.result).filter(
+        ScanImageHash.user_id == user_id,
+        ScanImageHash.scan_type == scan_type,
+        ScanImageHash.created_at >= since
+    ).order_by(ScanImageHash.created_at.desc()).all()
+
+    best = None
+    for stored_hash, result in candidates:
+        distance = bin(ScanImageHash.to_unsigned(stored_hash) ^ image_hash).count("1")
+        if distance <= SCAN_DEDUPE_MAX_DISTANCE and (best is None or distance < best[0]):
+            best = (distance, result)
+
+    if best is None:
+        scan_dedupe_stats.incr(f"{scan_type}_miss")
+        return None, image_hash
+    scan_dedupe_stats.incr(f"{scan_type}_hit")
+    return dict(best[1], duplicate_scan=True), image_hash
+
+
+def remember_scan(user_id, scan_type, image_hash, result, health_scan_id=None, food_scan_id=None):
+    """Store the result of a scan under its image hash, the caller commits"""
+    if image_hash is None or not result or result.get("error"):
+        return
+    db.session.add(ScanImageHash(
+        user_id=user_id,
+        scan_type=scan_type,
+        image_hash=ScanImageHash.to_signed(image_hash),
+        result=result,
+        health_scan_id=health_scan_id,
+        food_scan_id=food_scan_id
+    ))
@@ -0,0 +1,168 @@
+"""
+Medicine name autocomplete for MedicineAI
+"""
+import os
+import time
+import bisect
+import difflib
+import logging
+import threading
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+from app import app, db
+from models import MedicineCache, MedicineAlias, SearchHistory
+from utils_cache import cache_refresher
+from utils_drugs import resolve_medicine_name
+
+logger = logging.getLogger(__name__)
+
+# How often the whole index is rebuilt from the database
+SUGGEST_REFRESH_SECONDS = int(os.environ.get("SUGGEST_REFRESH_SECONDS", 600))
+# Searches from this period rank the indexed names by popularity
+SUGGEST_HISTORY_DAYS = 90
+# Lookups slower than this are counted for monitoring
+SUGGEST_SLOW_MS = 5.0
+
+
+def _normalize(text):
+    return " ".join(text.lower().split())
+
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class MedicineSuggestIndex:
+    """
+    In-memory prefix and fuzzy index over known medicine names.
+
+    Only canonical names are indexed, i.e. cached medicines and the targets
+    of aliases, never what users typed. Search history only ranks them.
+    Prefix matches come from a sorted list searched with bisect. When there
+    are not enough of them, names sharing the most trigrams with the query
+    are ranked by similarity to catch misspellings.
+    """
+
+    def __init__(self):
+        self._names = []
+        self._weights = {}
+        self._trigram_index = defaultdict(set)
+        self._lock = threading.Lock()
+        self._built_at = None
+        self.lookups = 0
+        self.slow_lookups = 0
+
+    def build(self):
+        """Rebuild the index from MedicineCache and MedicineAlias, ranked by SearchHistory"""
+        weights = Counter()
+
+        # Skip cached answers for names OpenAI did not recognise
+        for (name,) in db.session.query(MedicineCache.medicine_name).filter(MedicineCache.is_negative.is_(False)):
+            weights[resolve_medicine_name(name)] += 1
+        for (name,) in db.session.query(MedicineAlias.canonical_name).distinct():
+            weights[resolve_medicine_name(name)] += 1
+
+        # Popular searches only raise the weight of names indexed above
+        since = datetime.utcnow() - timedelta(days=SUGGEST_HISTORY_DAYS)
+        popular = db.session.query(
+            SearchHistory.query,
+            db.func.count(SearchHistory.id)
+        ).filter(
+            SearchHistory.timestamp >= since
+        ).group_by(SearchHistory.query).all()
+        for query, count in popular:
+            name = resolve_medicine_name(query)
+            if name in weights:
+                weights[name] += count
+
+        trigram_index = defaultdict(set)
+        for name in weights:
+            for trigram in _trigrams(name):
+                trigram_index[trigram].add(name)
+
+        with self._lock:
+            self._names = sorted(weights)
+            self._weights = dict(weights)
+            self._trigram_index = trigram_index
+            self._built_at = time.monotonic()
+        logger.info(f"Built medicine suggestion index with {len(weights)} names")
+
+    def add(self, name, weight=1):
+        """Add a name incrementally, or raise its weight if already indexed"""
+        name = _normalize(name)
+        if not name:
+            return
+        with self._lock:
+            if name not in self._weights:
+                bisect.insort(self._names, name)
+                for trigram in _trigrams(name):
+                    self._trigram_index[trigram].add(name)
+            self._weights[name] = self._weights.get(name, 0) + weight
+
+    def refresh(self):
+        """Rebuild the index in the background, at most one build at a time"""
+        def rebuild():
+            with app.app_context():
+                self.build()
+        cache_refresher.submit("medicine-suggest-index", rebuild)
+
+    def _ensure_fresh(self):
+        # Lookups never wait for a build: until the first one finishes they
+        # find nothing, after that they use the current index
+        if self._built_at is None or time.monotonic() - self._built_at > SUGGEST_REFRESH_SECONDS:
+            self.refresh()
+
+    def suggest(self, query, limit=8):
+        """Return up to limit medicine names matching the query prefix or resembling it"""
+        started = time.perf_counter()
+        self._ensure_fresh()
+        query = _normalize(query)
+        if not query:
+            return []
+
+        with self._lock:
+            # Prefix matches, most popular first
+            start = bisect.bisect_left(self._names, query)
+            prefix_matches = []
+            for name in self._names[start:start + 200]:
+                if not name.startswith(query):
+                    break
+                prefix_matches.append(name)
+            prefix_matches.sort(key=lambda name: -self._weights.get(name, 0))
+            results = prefix_matches[:limit]
+
+            # Fuzzy matches for misspellings
+            if len(results) < limit and len(query) >= 3:
+                shared = Counter()
+                for trigram in _trigrams(query):
+                    shared.update(self._trigram_index.get(trigram, ()))
+                candidates = [name for name, _ in shared.most_common(30) if name not in results]
+                scored = []
+                for name in candidates:
+                    ratio = difflib.SequenceMatcher(None, query, name[:len(query) + 3]).ratio()
+                    if ratio >= 0.6:
+                        scored.append((ratio, self._weights.get(name, 0), name))
+                scored.sort(reverse=True)
+                results.extend(name for _, _, name in scored[:limit - len(results)])
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.lookups += 1
+        if elapsed_ms > SUGGEST_SLOW_MS:
+            self.slow_lookups += 1
+        return [name.title() for name in results]
+
+    def stats(self):
+        """Return index counters for monitoring"""
+        with self._lock:
+            size = len(self._names)
+        return {
+            "built": self._built_at is not None,
+            "names": size,
+            "lookups": self.lookups,
+            "slow_lookups": self.slow_lookups
+        }
+
+
+medicine_suggest_index = MedicineSuggestIndex()
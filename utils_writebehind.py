@@ -0,0 +1,248 @@
+"""
+Write-behind buffering for high volume inserts in MedicineAI
+"""
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from app import app, db
+from models import SearchHistory, SearchUsage, DrugInteractionCheck
+from utils_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Search history buffer settings
+SEARCH_HISTORY_FLUSH_ROWS = int(os.environ.get("SEARCH_HISTORY_FLUSH_ROWS", 50))
+SEARCH_HISTORY_FLUSH_SECONDS = float(os.environ.get("SEARCH_HISTORY_FLUSH_SECONDS", 2))
+
+# Interaction check audit buffer settings. Identical checks by the same user
+# within the coalesce window are recorded once
+INTERACTION_CHECK_FLUSH_ROWS = int(os.environ.get("INTERACTION_CHECK_FLUSH_ROWS", 50))
+INTERACTION_CHECK_FLUSH_SECONDS = float(os.environ.get("INTERACTION_CHECK_FLUSH_SECONDS", 2))
+INTERACTION_CHECK_COALESCE_SECONDS = int(os.environ.get("INTERACTION_CHECK_COALESCE_SECONDS", 60))
+
+
+class WriteBehindBuffer:
+    """
+    Collect rows for a model in memory and write them with one bulk INSERT.
+
+    Rows are flushed when max_rows are pending, by a background thread every
+    max_age seconds, and when the worker process exits. Flushes run in their
+    own app context so they never commit a request's unfinished session.
+    """
+
+    def __init__(self, model, max_rows=50, max_age=2.0):
+        self.model = model
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self._rows = []
+        self._in_flight = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flusher = None
+        self._flusher_pid = None
+        self.flushed_rows = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.dropped_rows = 0
+        atexit.register(self.flush)
+
+    def add(self, **values):
+        """Queue a row, flushing immediately if the buffer is full"""
+        with self._lock:
+            self._rows.append(values)
+            is_full = len(self._rows) >= self.max_rows
+        self._ensure_flusher()
+        if is_full:
+            self.flush()
+
+    def pending(self, predicate=None):
+        """Return a copy of the rows not yet committed, optionally filtered"""
+        with self._lock:
+            rows = self._in_flight + self._rows
+        if predicate is None:
+            return rows
+        return [row for row in rows if predicate(row)]
+
+    def flush(self):
+        """Write all pending rows in one transaction, returns the row count"""
+        with self._flush_lock:
+            # Rows stay visible to pending() until they are committed
+            with self._lock:
+                rows, self._rows = self._rows, []
+                self._in_flight = rows
+            if not rows:
+                return 0
+
+            try:
+                with app.app_context():
+                    self._write(rows)
+                    db.session.commit()
+                self.flushes += 1
+                self.flushed_rows += len(rows)
+                return len(rows)
+            except IntegrityError as e:
+                # A row the database rejects, e.g. one buffered for a user
+                # deleted since, must not hold back the rest of the batch
+                logger.warning(f"Writing {self.model.__name__} rows one by one: {str(e)}")
+                written = self._write_rows_singly(rows)
+                self.flushes += 1
+                self.flushed_rows += written
+                return written
+            except Exception as e:
+                self.failed_flushes += 1
+                logger.error(f"Error flushing {self.model.__name__} buffer: {str(e)}")
+                # Keep the rows for the next attempt unless the database has
+                # been failing long enough for the buffer to grow unbounded
+                with self._lock:
+                    if len(self._rows) + len(rows) <= self.max_rows * 20:
+                        self._rows[:0] = rows
+                    else:
+                        logger.error(f"Dropping {len(rows)} buffered {self.model.__name__} rows")
+                return 0
+            finally:
+                with self._lock:
+                    self._in_flight = []
+
+    def _write_rows_singly(self, rows):
+        """Write rows in separate transactions, dropping the ones that fail, returns the count written"""
+        written = 0
+        with app.app_context():
+            for row in rows:
+                try:
+                    self._write([row])
+                    db.session.commit()
+                    written += 1
+                except IntegrityError:
+                    db.session.rollback()
+                    self.dropped_rows += 1
+        if written < len(rows):
+            logger.error(f"Dropped {len(rows) - written} {self.model.__name__} rows the database rejected")
+        return written
+
+    def _write(self, rows):
+        """Insert the rows, runs inside the flush transaction"""
+        db.session.execute(db.insert(self.model), rows)
+
+    def _ensure_flusher(self):
+        """Start the periodic flush thread in this process if needed"""
+        if self._flusher is not None and self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher is not None and self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+            self._flusher = threading.Thread(
+                target=self._run_flusher,
+                name=f"{self.model.__name__}-flusher",
+                daemon=True
+            )
+            self._flusher.start()
+
+    def _run_flusher(self):
+        while True:
+            time.sleep(self.max_age)
+            self.flush()
+
+    def stats(self):
+        """Return buffer counters for monitoring"""
+        with self._lock:
+            pending = len(self._in_flight) + len(self._rows)
+        return {
+            "pending": pending,
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+            "failed_flushes": self.failed_flushes,
+            "dropped_rows": self.dropped_rows
+        }
+
+
+class SearchHistoryBuffer(WriteBehindBuffer):
+    """
+    Write-behind buffer for SearchHistory rows
+
+    The SearchUsage quota counters are bumped in the same bulk flush, so a
+    search costs no write on the request path. Quota checks add this
+    worker's unflushed rows to the committed counters but cannot see other
+    workers' buffers. A user can therefore overshoot a quota by the searches
+    they made on other workers in the last SEARCH_HISTORY_FLUSH_SECONDS,
+    at most SEARCH_HISTORY_FLUSH_ROWS per worker.
+    """
+
+    def record(self, user_id, query):
+        self.add(user_id=user_id, query=query, timestamp=datetime.utcnow())
+
+    def _write(self, rows):
+        """Insert the rows and bump the quota counters in the same transaction"""
+        super()._write(rows)
+        SearchUsage.increment((row["user_id"], row["timestamp"]) for row in rows)
+
+    def pending_count(self, user_id, since):
+        """Count buffered searches by a user at or after the given time"""
+        return len(self.pending(
+            lambda row: row["user_id"] == user_id and row["timestamp"] >= since
+        ))
+
+
+class InteractionCheckBuffer(WriteBehindBuffer):
+    """Write-behind buffer for DrugInteractionCheck audit rows"""
+
+    def __init__(self, model, coalesce_seconds=60, **kwargs):
+        super().__init__(model, **kwargs)
+        self._recent = LRUCache(max_size=4096, ttl=coalesce_seconds)
+        self.coalesced = 0
+
+    @staticmethod
+    def compact_medications(medications):
+        """Encode a medication list as sorted, de-duplicated JSON without whitespace"""
+        names = {" ".join(name.split()) for name in medications}
+        return json.dumps(sorted(names, key=str.lower), separators=(",", ":"))
+
+    def record(self, user_id, medications, has_interactions, highest_severity):
+        """Queue an interaction check, returns False if it repeats a recent identical check"""
+        medications = self.compact_medications(medications)
+        key = (user_id, medications, bool(has_interactions), highest_severity)
+        if self._recent.get(key) is not None:
+            self.coalesced += 1
+            return False
+        self._recent.set(key, True)
+
+        self.add(
+            user_id=user_id,
+            medications=medications,
+            has_interactions=bool(has_interactions),
+            highest_severity=highest_severity,
+            check_date=datetime.utcnow()
+        )
+        return True
+
+    def pending_count(self, user_id, since):
+        """Count buffered checks by a user at or after the given time"""
+        return len(self.pending(
+            lambda row: row["user_id"] == user_id and row["check_date"] >= since
+        ))
+
+    def stats(self):
+        stats = super().stats()
+        stats["coalesced"] = self.coalesced
+        return stats
+
+
+search_history_buffer = SearchHistoryBuffer(
+    SearchHistory,
+    max_rows=SEARCH_HISTORY_FLUSH_ROWS,
+    max_age=SEARCH_HISTORY_FLUSH_SECONDS
+)
+
+interaction_check_buffer = InteractionCheckBuffer(
+    DrugInteractionCheck,
+    coalesce_seconds=INTERACTION_CHECK_COALESCE_SECONDS,
+    max_rows=INTERACTION_CHECK_FLUSH_ROWS,
+    max_age=INTERACTION_CHECK_FLUSH_SECONDS
+)